@@ -0,0 +1,94 @@
+# admission.py - Controle de admissão de conexões
+#
+# Depois de um deploy, centenas de clientes reconectam ao mesmo tempo. Cada
+# conexão em login ocupa o loop (espera do nome, decifra, checagem no hub), então
+# limitamos quantas ficam em login ao mesmo tempo, quantas vêm do mesmo IP e o
+# total de conexões. A checagem roda no process_request, antes do upgrade: a
+# recusa é uma resposta HTTP barata, sem WebSocket, sem chave e sem decifra.
+
+import metrics
+
+REASONS = ("handshakes", "per_ip", "connections")
+
+class Ticket:
+    """Vaga de uma conexão admitida; devolvida uma única vez em release()"""
+
+    def __init__(self, control, ip):
+        self.control = control
+        self.ip = ip
+        self.logging_in = True
+        self.released = False
+
+    def logged_in(self):
+        """Login concluído: libera a vaga de handshake, mantém a de conexão"""
+        if self.logging_in and not self.released:
+            self.logging_in = False
+            self.control.handshakes -= 1
+
+    def release(self):
+        if self.released:
+            return
+        self.logged_in()
+        self.released = True
+        control = self.control
+        control.connections -= 1
+        restantes = control.per_ip.get(self.ip, 1) - 1
+        if restantes > 0:
+            control.per_ip[self.ip] = restantes
+        else:
+            control.per_ip.pop(self.ip, None)
+
+class AdmissionControl:
+    """Contadores de conexões; roda num único event loop, então não precisa de lock"""
+
+    def __init__(self, max_handshakes=0, max_per_ip=0, max_connections=0, registry=None):
+        # 0 = sem limite
+        self.max_handshakes = max_handshakes
+        self.max_per_ip = max_per_ip
+        self.max_connections = max_connections
+        self.handshakes = 0
+        self.connections = 0
+        self.per_ip = {}
+
+        registry = registry or metrics.Registry()
+        registry.gauge("chat_handshakes_in_flight", "Conexões aceitas que ainda não concluíram o login",
+                       lambda: self.handshakes)
+        registry.gauge("chat_connections_open", "Conexões WebSocket abertas (em login ou registradas)",
+                       lambda: self.connections)
+        self.rejected = {reason: registry.counter(f"chat_admission_rejected_{reason}_total",
+                                                  f"Conexões recusadas pelo limite de {reason}")
+                         for reason in REASONS}
+
+    def check(self, ip):
+        """Motivo da recusa ("handshakes", "per_ip" ou "connections"), ou None se há vaga"""
+        if self.max_connections and self.connections >= self.max_connections:
+            return "connections"
+        if self.max_handshakes and self.handshakes >= self.max_handshakes:
+            return "handshakes"
+        if self.max_per_ip and self.per_ip.get(ip, 0) >= self.max_per_ip:
+            return "per_ip"
+        return None
+
+    def reject(self, reason):
+        self.rejected[reason].inc()
+
+    def enter(self, ip):
+        """Ticket para a conexão, ou None (e conta a recusa) se os limites foram atingidos
+        entre o process_request e o handler"""
+        reason = self.check(ip)
+        if reason:
+            self.reject(reason)
+            return None
+        self.handshakes += 1
+        self.connections += 1
+        self.per_ip[ip] = self.per_ip.get(ip, 0) + 1
+        return Ticket(self, ip)
+
+def forwarded_ip(remote_address, headers, trust_proxy):
+    """IP do cliente: atrás do proxy do Render, o último X-Forwarded-For (quem o proxy viu);
+    os anteriores vêm do próprio cliente e podem ser forjados"""
+    if trust_proxy:
+        forwarded = headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[-1].strip()
+    return remote_address[0] if remote_address else "unknown"
@@ -0,0 +1,210 @@
+# bench_carga.py - Gerador de carga para o servidor_render.py
+#
+# Simula milhares de clientes com o mesmo handshake do client.py (recebe a
+# chave, envia o nome cifrado), distribuídos em vários processos, e mede a
+# latência ponta a ponta das mensagens de chat, a vazão e o CPU/RSS do servidor.
+#
+# Exemplo (tudo em localhost, sem rede):
+#   python bench_carga.py --spawn --clients 2000 --processes 4 --rate 200 --duration 30
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+
+import websockets
+import cryptog
+import envelope
+
+MARKER = "bench:"
+
+# ========== CLIENTES SIMULADOS ==========
+async def simulated_client(uri, name, engine, start_at, stop_at, interval, stats):
+    """Um cliente: handshake, envio no ritmo pedido e medição das mensagens recebidas"""
+    try:
+        websocket = await websockets.connect(uri, subprotocols=cryptog.engine_subprotocols([engine]),
+                                             ping_interval=None, max_queue=None)
+    except (OSError, websockets.exceptions.WebSocketException):
+        stats["connect_errors"] += 1
+        return
+
+    try:
+        chave = (await websocket.recv()).encode('utf-8')
+        cipher = cryptog.get_engine(cryptog.engine_from_subprotocol(websocket.subprotocol), chave)
+        await websocket.send(cipher.encrypt(name.encode('utf-8')))
+        stats["connected"] += 1
+
+        receiver = asyncio.create_task(receive_loop(websocket, cipher, stats))
+        await asyncio.sleep(max(0, start_at - time.time()))
+
+        seq = 0
+        # Fase aleatória para os clientes não enviarem todos no mesmo instante
+        await asyncio.sleep(random.uniform(0, interval))
+        while time.time() < stop_at:
+            seq += 1
+            body = f"{MARKER}{seq}:{time.time():.6f}"
+            await websocket.send(cipher.encrypt(body.encode('utf-8')))
+            stats["sent"] += 1
+            await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+
+        await asyncio.sleep(max(0, stop_at + stats["drain"] - time.time()))
+        receiver.cancel()
+    except (OSError, websockets.exceptions.WebSocketException, asyncio.TimeoutError):
+        stats["errors"] += 1
+    finally:
+        await websocket.close()
+
+async def receive_loop(websocket, cipher, stats):
+    try:
+        async for frame in websocket:
+            agora = time.time()
+            env = envelope.decode(cipher.decrypt(frame))
+            if env.kind != envelope.KIND_CHAT or not env.body.startswith(MARKER):
+                continue
+            enviado = float(env.body[len(MARKER):].split(":", 1)[1])
+            stats["latencies"].append(agora - enviado)
+            stats["received"] += 1
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+async def run_clients(options, process_index, start_at):
+    stats = {"connected": 0, "connect_errors": 0, "errors": 0, "sent": 0, "received": 0,
+             "latencies": [], "drain": options["drain"]}
+    stop_at = start_at + options["duration"]
+    interval = options["clients"] / options["rate"] if options["rate"] > 0 else float("inf")
+
+    tasks = []
+    pausa = options["processes"] / options["connect_rate"]
+    for i in range(options["per_process"]):
+        name = f"b{process_index}_{i}"
+        tasks.append(asyncio.create_task(simulated_client(
+            options["uri"], name, options["engine"], start_at, stop_at, interval, stats)))
+        await asyncio.sleep(pausa)
+    await asyncio.gather(*tasks)
+    stats.pop("drain")
+    return stats
+
+def client_process(options, process_index, start_at):
+    return asyncio.run(run_clients(options, process_index, start_at))
+
+# ========== SERVIDOR ==========
+def process_tree(pid):
+    """pid e todos os descendentes (workers do modo multi-processo)"""
+    pids = [pid]
+    for current in pids:
+        try:
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+def server_usage(pid):
+    """(segundos de CPU, RSS em bytes) somando o processo do servidor e seus filhos"""
+    if not pid:
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu = 0.0
+    rss = 0
+    for current in process_tree(pid):
+        try:
+            with open(f"/proc/{current}/stat") as f:
+                campos = f.read().rsplit(")", 1)[1].split()
+            cpu += (int(campos[11]) + int(campos[12])) / ticks
+            with open(f"/proc/{current}/status") as f:
+                for linha in f:
+                    if linha.startswith("VmRSS:"):
+                        rss += int(linha.split()[1]) * 1024
+        except OSError:
+            pass
+    return cpu, rss
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+# ========== PRINCIPAL ==========
+def parse_args():
+    parser = argparse.ArgumentParser(description="Gerador de carga para o servidor_render.py")
+    parser.add_argument("--uri", default="ws://localhost:10000")
+    parser.add_argument("--clients", type=int, default=500, help="total de clientes simulados")
+    parser.add_argument("--processes", type=int, default=max(1, os.cpu_count() // 2))
+    parser.add_argument("--rate", type=float, default=100.0, help="mensagens/s somando todos os clientes")
+    parser.add_argument("--duration", type=float, default=20.0, help="segundos de envio")
+    parser.add_argument("--drain", type=float, default=3.0, help="segundos de espera após o envio")
+    parser.add_argument("--connect-rate", type=float, default=500.0, help="conexões/s durante a rampa")
+    parser.add_argument("--engine", default="aesgcm", choices=list(cryptog.ENGINES))
+    parser.add_argument("--spawn", action="store_true", help="inicia um servidor_render.py local")
+    parser.add_argument("--workers", type=int, default=1, help="WORKERS do servidor iniciado com --spawn")
+    parser.add_argument("--server-pid", type=int, help="pid de um servidor já rodando, para CPU/RSS")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    server = None
+    server_pid = args.server_pid
+
+    if args.spawn:
+        port = args.uri.rsplit(":", 1)[1].split("/")[0]
+        # Todos os clientes simulados vêm do mesmo IP: sem limites de admissão
+        env = dict(os.environ, PORT=port, WORKERS=str(args.workers), MESSAGE_LOG="0",
+                   HISTORY_MAX_MESSAGES="0", FANOUT_REPORT_INTERVAL="3600",
+                   MAX_HANDSHAKES="0", MAX_CONNECTIONS_PER_IP="0", MAX_CONNECTIONS="0")
+        server = subprocess.Popen([sys.executable, "servidor_render.py"], env=env,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        server_pid = server.pid
+        time.sleep(2.0)
+
+    per_process = -(-args.clients // args.processes)
+    options = {
+        "uri": args.uri, "clients": per_process * args.processes, "processes": args.processes,
+        "per_process": per_process, "rate": args.rate, "duration": args.duration,
+        "drain": args.drain, "connect_rate": args.connect_rate, "engine": args.engine,
+    }
+    # Todos os processos começam a enviar juntos, depois da rampa de conexões
+    rampa = options["clients"] / args.connect_rate + 2.0
+    start_at = time.time() + rampa
+
+    print(f"🚀 {options['clients']} clientes em {args.processes} processos, "
+          f"{args.rate:.0f} msg/s por {args.duration:.0f}s (rampa de {rampa:.1f}s)")
+
+    try:
+        with multiprocessing.Pool(args.processes) as pool:
+            pending = pool.starmap_async(client_process,
+                                         [(options, index, start_at) for index in range(args.processes)])
+            time.sleep(max(0, start_at - time.time()))
+            uso_inicio = server_usage(server_pid)
+            time.sleep(args.duration)
+            uso_fim = server_usage(server_pid)
+            results = pending.get()
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    total = {key: sum(result[key] for result in results)
+             for key in ("connected", "connect_errors", "errors", "sent", "received")}
+    latencies = sorted(lat for result in results for lat in result["latencies"])
+
+    print("\n📊 Resultado")
+    print(f"  Conectados: {total['connected']}/{options['clients']} "
+          f"(falhas de conexão: {total['connect_errors']}, erros: {total['errors']})")
+    print(f"  Enviadas: {total['sent']} ({total['sent'] / args.duration:.1f} msg/s)")
+    print(f"  Entregues: {total['received']} ({total['received'] / args.duration:.1f} entregas/s)")
+    if latencies:
+        print(f"  Latência ponta a ponta: p50 {percentile(latencies, 0.50) * 1000:.1f} ms, "
+              f"p95 {percentile(latencies, 0.95) * 1000:.1f} ms, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms, "
+              f"máx {latencies[-1] * 1000:.1f} ms")
+    if uso_inicio and uso_fim:
+        cpu = (uso_fim[0] - uso_inicio[0]) / args.duration * 100
+        print(f"  Servidor: CPU {cpu:.0f}% de um núcleo, RSS {uso_fim[1] / 1024 / 1024:.1f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# bench_cifras.py - Micro-benchmark dos motores de cifra do cryptog
+#
+# Uso: python bench_cifras.py [iterações]
+
+import sys
+import time
+
+import cryptog
+
+PAYLOAD_SIZES = [32, 256, 1024, 4096]
+DEFAULT_ITERATIONS = 20000
+
+def measure(func, arg, iterations):
+    """Retorna operações por segundo de func(arg)"""
+    inicio = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    elapsed = time.perf_counter() - inicio
+    return iterations / elapsed
+
+def construction_cost(name, key, iterations):
+    """Compara construir o motor a cada mensagem com reutilizar a instância em cache"""
+    engine_cls = cryptog.ENGINES[name]
+    inicio = time.perf_counter()
+    for _ in range(iterations):
+        engine_cls(key)
+    sem_cache = (time.perf_counter() - inicio) / iterations * 1e6
+
+    inicio = time.perf_counter()
+    for _ in range(iterations):
+        cryptog.get_engine(name, key)
+    com_cache = (time.perf_counter() - inicio) / iterations * 1e6
+    return sem_cache, com_cache
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ITERATIONS
+    key = cryptog.generate_key()
+
+    print(f"{'motor':<10}{'payload':>9}{'cifrado':>9}{'overhead':>10}{'enc/s':>12}{'dec/s':>12}")
+    print("-" * 62)
+    for name in cryptog.ENGINES:
+        engine = cryptog.get_engine(name, key)
+        for size in PAYLOAD_SIZES:
+            payload = b"x" * size
+            token = engine.encrypt(payload)
+            enc = measure(engine.encrypt, payload, iterations)
+            dec = measure(engine.decrypt, token, iterations)
+            print(f"{name:<10}{size:>9}{len(token):>9}{len(token) - size:>10}{enc:>12,.0f}{dec:>12,.0f}")
+        print("-" * 62)
+
+    print("\nCusto de construção por mensagem (µs): sem cache vs. get_engine")
+    for name in cryptog.ENGINES:
+        sem_cache, com_cache = construction_cost(name, key, iterations // 10)
+        print(f"  {name:<10} {sem_cache:8.2f} vs. {com_cache:6.2f}")
+
+if __name__ == "__main__":
+    main()
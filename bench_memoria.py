@@ -0,0 +1,140 @@
+# bench_memoria.py - Memória por conexão do servidor_render.py (tracemalloc)
+#
+# Sobe um servidor com MEMORY_TRACE=1, conecta N clientes e lê o /memory em três
+# momentos: sem clientes, com todos ociosos e com todos conversando. A diferença
+# dividida por N dá os bytes por conexão ociosa e ativa; o RSS vem do /proc.
+# Vários orçamentos (CONNECTION_MEMORY_BUDGET) podem ser comparados numa execução.
+#
+# Exemplo:
+#   python bench_memoria.py --clients 2000 --budgets 0,262144,65536
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+import websockets
+import cryptog
+from bench_carga import server_usage
+
+# ========== CLIENTES ==========
+async def connect(uri, name, engine):
+    websocket = await websockets.connect(uri, subprotocols=cryptog.engine_subprotocols([engine]),
+                                         ping_interval=None)
+    chave = (await websocket.recv()).encode('utf-8')
+    cipher = cryptog.get_engine(cryptog.engine_from_subprotocol(websocket.subprotocol), chave)
+    await websocket.send(cipher.encrypt(name.encode('utf-8')))
+    return websocket, cipher
+
+async def drain(websocket):
+    """Lê (e descarta) o que chega, como um cliente que acompanha o chat"""
+    try:
+        async for _ in websocket:
+            pass
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+async def talk(websocket, cipher, interval, stop_at, size):
+    texto = "x" * size
+    while time.time() < stop_at:
+        await websocket.send(cipher.encrypt(texto.encode('utf-8')))
+        await asyncio.sleep(interval)
+
+def memory(base_url):
+    with urllib.request.urlopen(base_url + "/memory", timeout=60) as response:
+        return json.loads(response.read())
+
+# ========== MEDIÇÃO ==========
+async def measure(options, server_pid):
+    uri = options.uri
+    base_url = uri.replace("ws://", "http://", 1)
+    await asyncio.sleep(0.5)
+    sem_clientes = memory(base_url)
+    rss_base = server_usage(server_pid)[1]
+
+    conexoes = []
+    for i in range(options.clients):
+        conexoes.append(await connect(uri, f"m{i}", options.engine))
+    leitores = [asyncio.create_task(drain(websocket)) for websocket, _ in conexoes]
+    await asyncio.sleep(options.settle)
+    ociosos = memory(base_url)
+    rss_ocioso = server_usage(server_pid)[1]
+
+    # Ativos: a sala toda recebe options.rate mensagens/s durante options.duration segundos
+    stop_at = time.time() + options.duration
+    interval = options.clients / options.rate
+    falantes = [asyncio.create_task(talk(websocket, cipher, interval, stop_at, options.size))
+                for websocket, cipher in conexoes]
+    await asyncio.sleep(options.duration / 2)
+    ativos = await asyncio.get_running_loop().run_in_executor(None, memory, base_url)
+    rss_ativo = server_usage(server_pid)[1]
+    await asyncio.gather(*falantes, return_exceptions=True)
+
+    for websocket, _ in conexoes:
+        await websocket.close()
+    for task in leitores:
+        task.cancel()
+
+    n = max(1, ociosos["connections"])
+    return {
+        "connections": ociosos["connections"],
+        "idle": (ociosos["traced_bytes"] - sem_clientes["traced_bytes"]) / n,
+        "active": (ativos["traced_bytes"] - sem_clientes["traced_bytes"]) / n,
+        "rss_idle": (rss_ocioso - rss_base) / n,
+        "rss_active": (rss_ativo - rss_base) / n,
+        "top_idle": ociosos["top"][:options.top],
+        "top_active": ativos["top"][:options.top],
+    }
+
+def run_budget(options, budget):
+    port = options.uri.rsplit(":", 1)[1].split("/")[0]
+    env = dict(os.environ, PORT=port, MEMORY_TRACE="1", CONNECTION_MEMORY_BUDGET=str(budget),
+               MESSAGE_LOG="0", HISTORY_MAX_MESSAGES="0", FANOUT_REPORT_INTERVAL="3600",
+               SESSION_GRACE="0", MAX_HANDSHAKES="0", MAX_CONNECTIONS_PER_IP="0", MAX_CONNECTIONS="0")
+    server = subprocess.Popen([sys.executable, "servidor_render.py"], env=env,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(2.0)
+        return asyncio.run(measure(options, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+# ========== PRINCIPAL ==========
+def parse_args():
+    parser = argparse.ArgumentParser(description="Memória por conexão do servidor_render.py")
+    parser.add_argument("--uri", default="ws://localhost:10000")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--budgets", default="0,262144",
+                        help="orçamentos por conexão a comparar, em bytes (0 = padrões do websockets)")
+    parser.add_argument("--rate", type=float, default=200.0, help="mensagens/s somando todos os clientes")
+    parser.add_argument("--size", type=int, default=200, help="caracteres por mensagem")
+    parser.add_argument("--duration", type=float, default=6.0, help="segundos da fase ativa")
+    parser.add_argument("--settle", type=float, default=1.0, help="espera antes de medir os ociosos")
+    parser.add_argument("--engine", default="aesgcm", choices=list(cryptog.ENGINES))
+    parser.add_argument("--top", type=int, default=5, help="linhas que mais alocam a mostrar")
+    return parser.parse_args()
+
+def main():
+    options = parse_args()
+    budgets = [int(budget) for budget in options.budgets.split(",")]
+    print(f"🧠 {options.clients} conexões, {options.rate:.0f} msg/s na fase ativa")
+
+    for budget in budgets:
+        result = run_budget(options, budget)
+        titulo = f"{budget // 1024} KiB" if budget > 0 else "padrões do websockets"
+        print(f"\n📊 Orçamento: {titulo} ({result['connections']} conexões medidas)")
+        print(f"  tracemalloc: {result['idle']:.0f} B por conexão ociosa, {result['active']:.0f} B por ativa")
+        print(f"  RSS:         {result['rss_idle']:.0f} B por conexão ociosa, {result['rss_active']:.0f} B por ativa")
+        for fase in ("idle", "active"):
+            print(f"  Maiores alocações do servidor ({'ociosos' if fase == 'idle' else 'ativos'}):")
+            for stat in result["top_" + fase]:
+                print(f"    {stat['bytes'] / 1024:9.1f} KiB {stat['count']:7d} blocos  {stat['where']}")
+
+if __name__ == "__main__":
+    main()
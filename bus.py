@@ -0,0 +1,295 @@
+# bus.py - Barramento pub/sub local (Unix socket) entre os workers do servidor_render
+#
+# O processo mestre roda o BusHub, dono da lista global de usuários; cada
+# worker mantém um BusClient. Chat, presença e PMs passam pelo hub, então um
+# usuário no worker A alcança um usuário no worker B. O hub também guarda as
+# sessões retomáveis, para o resume funcionar em qualquer worker. Cada mudança
+# na lista gera um evento de presença com a versão da lista; os workers o
+# repassam aos clientes como aviso de entrada/saída.
+
+import asyncio
+import itertools
+import json
+import os
+import struct
+
+from roster import Roster
+from sessions import SessionStore
+
+HEADER = struct.Struct("!I")
+MAX_FRAME = 1 << 20
+CLAIM_TIMEOUT = 5.0
+SWEEP_INTERVAL = 1.0
+
+def encode_frame(msg):
+    """Serializa uma mensagem do barramento: tamanho (4 bytes) + JSON"""
+    body = json.dumps(msg, separators=(",", ":"), ensure_ascii=False).encode('utf-8')
+    return HEADER.pack(len(body)) + body
+
+async def read_frame(reader):
+    header = await reader.readexactly(HEADER.size)
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise ValueError(f"Frame do barramento muito grande: {length} bytes")
+    return json.loads(await reader.readexactly(length))
+
+# ========== HUB (PROCESSO MESTRE) ==========
+class BusHub:
+    """Servidor do barramento: lista global de usuários e retransmissão entre workers"""
+
+    def __init__(self, path, on_chat=None, session_grace=0):
+        self.path = path
+        self.on_chat = on_chat
+        self.workers = {}   # worker_id -> StreamWriter
+        self.roster = {}    # nome em casefold -> {"username", "worker"}; worker None = sessão em graça
+        self.version = 0    # versão da lista, incrementada a cada entrada/saída
+        self.sessions = SessionStore(session_grace)
+        self.server = None
+        self.sweeper = None
+        self.handlers = set()   # tasks das conexões dos workers
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self._handle_worker, path=self.path)
+        if self.sessions.grace > 0:
+            self.sweeper = asyncio.create_task(self._sweep())
+
+    async def close(self):
+        if self.sweeper:
+            self.sweeper.cancel()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        # Fecha as conexões dos workers e espera os handlers saírem sozinhos (EOF), em vez
+        # de o asyncio.run cancelá-los no meio de uma leitura
+        for writer in list(self.workers.values()):
+            writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _send(self, worker_id, msg):
+        writer = self.workers.get(worker_id)
+        if writer:
+            writer.write(encode_frame(msg))
+
+    def _publish(self, msg):
+        frame = encode_frame(msg)
+        for writer in list(self.workers.values()):
+            writer.write(frame)
+
+    def _chat(self, msg):
+        if self.on_chat:
+            self.on_chat(msg)
+        self._publish(msg)
+
+    def _presence(self, event, username):
+        self.version += 1
+        self._publish({"op": "presence", "event": event, "username": username, "version": self.version})
+
+    def _leave(self, key):
+        """Tira o usuário da lista global e avisa todos os workers"""
+        entry = self.roster.pop(key)
+        self._presence("leave", entry["username"])
+
+    def _end_expired(self, session):
+        """Tira da lista global quem estava em graça numa sessão que expirou (None: nada a fazer)"""
+        if session is None:
+            return
+        key = session.username.casefold()
+        entry = self.roster.get(key)
+        if entry and entry["worker"] is None:
+            self._leave(key)
+
+    async def _sweep(self):
+        """Expira as sessões cuja janela de graça acabou"""
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            for session in self.sessions.expire():
+                self._end_expired(session)
+
+    async def _handle_worker(self, reader, writer):
+        worker_id = None
+        task = asyncio.current_task()
+        self.handlers.add(task)
+        try:
+            hello = await read_frame(reader)
+            worker_id = hello["worker"]
+            self.workers[worker_id] = writer
+            writer.write(encode_frame({
+                "op": "roster",
+                "users": [entry["username"] for entry in self.roster.values()],
+                "version": self.version
+            }))
+
+            while True:
+                msg = await read_frame(reader)
+                self._dispatch(worker_id, msg)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if worker_id is not None and self.workers.get(worker_id) is writer:
+                del self.workers[worker_id]
+                # Usuários de um worker que caiu entram em graça (podem retomar em
+                # outro worker); sem sessão, saem da lista global
+                for key, entry in list(self.roster.items()):
+                    if entry["worker"] == worker_id:
+                        if self.sessions.detach_user(entry["username"]):
+                            entry["worker"] = None
+                        else:
+                            self._leave(key)
+            writer.close()
+            self.handlers.discard(task)
+
+    def _dispatch(self, worker_id, msg):
+        op = msg.get("op")
+
+        if op == "claim":
+            # O hub roda num único loop: checar e reservar o nome é atômico
+            key = msg["username"].casefold()
+            # Graça vencida mas ainda não varrida: o nome já está livre
+            self._end_expired(self.sessions.expire_user(msg["username"]))
+            ok = key not in self.roster
+            token = None
+            if ok:
+                self.roster[key] = {"username": msg["username"], "worker": worker_id}
+                token = self.sessions.issue(msg["username"])
+                # Presença antes da resposta: o worker já vê o usuário na lista ao concluir o claim
+                self._presence("join", msg["username"])
+            self._send(worker_id, {"op": "claim_result", "req": msg["req"], "ok": ok, "token": token})
+
+        elif op == "release":
+            key = msg["username"].casefold()
+            entry = self.roster.get(key)
+            if entry and entry["worker"] == worker_id:
+                self.sessions.drop_user(entry["username"])
+                self._leave(key)
+
+        elif op == "detach":
+            # Conexão caiu sem /sair: mantém o nome reservado durante a graça
+            key = msg["username"].casefold()
+            entry = self.roster.get(key)
+            if entry and entry["worker"] == worker_id:
+                if self.sessions.detach(msg["token"]):
+                    entry["worker"] = None
+                else:
+                    self._leave(key)
+
+        elif op == "resume":
+            # Token de sessão já vencida: libera o nome agora, para o claim que vem em seguida
+            self._end_expired(self.sessions.expire_token(msg["token"]))
+            resumed = self.sessions.resume(msg["token"])
+            if not resumed:
+                self._send(worker_id, {"op": "resume_result", "req": msg["req"], "ok": False})
+                return
+            session, pending = resumed
+            key = session.username.casefold()
+            entry = self.roster.get(key)
+            if entry and entry["worker"] not in (None, worker_id):
+                # A conexão antiga ainda está aberta em outro worker: ele a fecha sem aviso de saída
+                self._send(entry["worker"], {"op": "takeover", "username": session.username})
+            self.roster[key] = {"username": session.username, "worker": worker_id}
+            self._send(worker_id, {"op": "resume_result", "req": msg["req"], "ok": True,
+                                   "username": session.username, "token": session.token,
+                                   "pending": pending})
+
+        elif op == "chat":
+            self._chat(msg)
+
+        elif op == "pm":
+            entry = self.roster.get(msg["to"].casefold())
+            if entry and entry["worker"] is None:
+                self.sessions.add_pending(entry["username"], {"from": msg["from"], "text": msg["text"]})
+            elif entry:
+                self._send(entry["worker"], msg)
+
+# ========== CLIENTE (WORKERS) ==========
+class BusClient:
+    """Conexão de um worker com o hub; mantém um espelho da lista global de usuários"""
+
+    def __init__(self, path, worker_id, on_message, roster=None):
+        self.path = path
+        self.worker_id = worker_id
+        self.on_message = on_message
+        self.roster = roster if roster is not None else Roster()  # espelho da lista global, com a versão do hub
+        self.pending = {}
+        self.ids = itertools.count(1)
+        self.writer = None
+        self.task = None
+        self.closed = asyncio.Event()
+
+    async def connect(self, retries=50, delay=0.1):
+        for _ in range(retries):
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(delay)
+        else:
+            raise ConnectionError(f"Barramento indisponível em {self.path}")
+
+        self.writer.write(encode_frame({"op": "hello", "worker": self.worker_id}))
+        self.task = asyncio.create_task(self._reader(reader))
+
+    async def wait_closed(self):
+        await self.closed.wait()
+
+    def publish(self, msg):
+        msg["worker"] = self.worker_id
+        self.writer.write(encode_frame(msg))
+
+    async def _request(self, msg):
+        """Envia um pedido ao hub e espera a resposta com o mesmo req"""
+        req = msg["req"] = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[req] = future
+        self.publish(msg)
+        try:
+            return await asyncio.wait_for(future, CLAIM_TIMEOUT)
+        finally:
+            self.pending.pop(req, None)
+
+    async def claim(self, username):
+        """Reserva o nome na lista global: (ok, token da sessão); ok False se já estiver em uso"""
+        result = await self._request({"op": "claim", "username": username})
+        return result["ok"], result.get("token")
+
+    async def resume(self, token):
+        """(nome, token novo, PMs pendentes) de uma sessão em graça, ou None"""
+        result = await self._request({"op": "resume", "token": token})
+        if not result["ok"]:
+            return None
+        return result["username"], result["token"], result["pending"]
+
+    def release(self, username):
+        self.publish({"op": "release", "username": username})
+
+    def detach(self, username, token):
+        """Conexão caiu: o hub segura o nome pela janela de graça e publica a saída se ela expirar"""
+        self.publish({"op": "detach", "username": username, "token": token})
+
+    async def _reader(self, reader):
+        try:
+            while True:
+                msg = await read_frame(reader)
+                op = msg.get("op")
+                if op == "roster":
+                    self.roster.reset(msg["users"], msg["version"])
+                elif op == "presence":
+                    if msg["event"] == "join":
+                        self.roster.add(msg["username"], msg["version"])
+                    else:
+                        self.roster.remove(msg["username"], msg["version"])
+                    await self.on_message(msg)
+                elif op in ("claim_result", "resume_result"):
+                    future = self.pending.get(msg["req"])
+                    if future and not future.done():
+                        future.set_result(msg)
+                else:
+                    await self.on_message(msg)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.closed.set()
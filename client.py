@@ -1,9 +1,14 @@
 # cliente.py - Adapted for WebSockets
 
 import asyncio
+import datetime
+import random
+import threading
 import websockets
-from cryptography.fernet import Fernet
 from colorama import init, Fore, Style
+import cryptog
+import envelope
+from roster import parse_page
 
 init(autoreset=True)
 
@@ -12,6 +17,23 @@ init(autoreset=True)
 SERVER_URI = "wss://chat-online-vj6d.onrender.com"
 # Para teste local (descomente a linha abaixo):
 # SERVER_URI = "ws://localhost:10000"
+# Motor de cifra preferido (chacha20, aesgcm ou fernet); o servidor escolhe entre os oferecidos
+CIPHER_ENGINE = "aesgcm"
+
+# Reconexão automática: backoff exponencial com jitter (segundos); 0 tentativas = sem limite
+RECONNECT_BASE_DELAY = 1.0
+RECONNECT_MAX_DELAY = 30.0
+RECONNECT_MAX_ATTEMPTS = 0
+CLOSE_REPLACED = 4000         # a sessão foi retomada em outra conexão
+CLOSE_SESSION_EXPIRED = 4001  # o servidor não reconhece mais o token de sessão
+NAME_RETRIES_AFTER_EXPIRY = 3  # logins recusados por nome em uso tolerados logo após o 4001
+
+# Sessão atual: token para retomar a conexão e a última mensagem de sala recebida
+session = {"token": None, "last_seq": 0, "established": False}
+
+# Lista local de quem está online: montada com as páginas do /users e mantida pelos avisos de
+# entrada/saída (seq = versão da lista). Enquanto estiver em dia, /users é respondido localmente.
+local_roster = {"version": None, "names": {}, "loading": None}
 
 class ColorManager:
     @staticmethod
@@ -35,118 +57,250 @@ def validate_username(username):
             not username.startswith('/') and 
             all(c.isalnum() or c in '_- ' for c in username))
 
-async def receive_messages(websocket, chave):
+def offered_subprotocols():
+    """Subprotocolos oferecidos no handshake: o motor preferido primeiro, Fernet por último"""
+    names = [CIPHER_ENGINE] + [name for name in cryptog.ENGINES if name != CIPHER_ENGINE]
+    names.remove("fernet")
+    names.append("fernet")
+    return cryptog.engine_subprotocols(names)
+
+# ========== EXIBIÇÃO POR TIPO DE ENVELOPE ==========
+def format_history(env):
+    quando = datetime.datetime.fromtimestamp(env.timestamp).strftime("%d/%m %H:%M")
+    return f"📜 [{quando}] {env.sender}: {env.body}"
+
+def format_roster(names, total, page=1, pages=1):
+    linha = f"👥 Online ({total}): {', '.join(names)}"
+    if page < pages:
+        linha += f" — página {page}/{pages}, use /users {page + 1}"
+    return ColorManager.system(linha)
+
+def render_roster_page(env):
+    page, pages, total, names = parse_page(env.body)
+    return format_roster(names, total, page, pages)
+
+RENDERERS = {
+    envelope.KIND_SYSTEM: lambda env: ColorManager.system(f"[Sistema] {env.body}"),
+    envelope.KIND_CHAT: lambda env: f"💬 {env.sender}: {env.body}",
+    envelope.KIND_PRIVATE: lambda env: ColorManager.info(f"📩 {env.sender} para você: {env.body}"),
+    envelope.KIND_PRIVATE_SENT: lambda env: ColorManager.info(f"📩 Você para {env.sender}: {env.body}"),
+    envelope.KIND_JOIN: lambda env: ColorManager.system(f"👉 {env.sender} entrou no chat"),
+    envelope.KIND_LEAVE: lambda env: ColorManager.system(f"👋 {env.sender} {env.body or 'saiu do chat'}"),
+    envelope.KIND_ANNOUNCEMENT: lambda env: ColorManager.system(f"📢 {env.body}"),
+    envelope.KIND_VOTE: lambda env: ColorManager.info(f"🗳️ {env.body}"),
+    envelope.KIND_HISTORY: format_history,
+    envelope.KIND_ROSTER: render_roster_page,
+}
+
+def reset_roster():
+    local_roster.update(version=None, names={}, loading=None)
+
+def update_roster(env):
+    """Aplica uma página do /users ou um aviso de entrada/saída à lista local"""
+    if env.kind == envelope.KIND_ROSTER:
+        page, pages, _, names = parse_page(env.body)
+        loading = local_roster["loading"]
+        if loading is None or loading["version"] != env.seq:
+            loading = local_roster["loading"] = {"version": env.seq, "names": {}, "pages": set()}
+        loading["names"].update((name.casefold(), name) for name in names)
+        loading["pages"].add(page)
+        if len(loading["pages"]) == pages:
+            local_roster.update(version=env.seq, names=loading["names"], loading=None)
+    elif local_roster["version"] is not None and env.seq:
+        if env.seq > local_roster["version"] + 1:
+            reset_roster()  # perdemos algum aviso: a lista local não vale mais
+            return
+        if env.seq == local_roster["version"] + 1:
+            if env.kind == envelope.KIND_JOIN:
+                local_roster["names"][env.sender.casefold()] = env.sender
+            else:
+                local_roster["names"].pop(env.sender.casefold(), None)
+            local_roster["version"] = env.seq
+
+def render_envelope(env):
+    renderer = RENDERERS.get(env.kind)
+    return renderer(env) if renderer else f"📨 {env.body}"
+
+async def receive_messages(websocket, cipher):
     """Task para receber mensagens do servidor"""
     try:
         async for msg_criptografada in websocket:
             try:
-                msg = Fernet(chave).decrypt(msg_criptografada).decode('utf-8')
-                
-                # Colorir diferentes tipos de mensagem
-                if msg.startswith('[Sistema]'):
-                    print(ColorManager.system(msg))
-                elif msg.startswith('📩'):
-                    print(ColorManager.info(msg))
-                elif msg.startswith('👉') or msg.startswith('👋'):
-                    print(ColorManager.system(msg))
-                elif msg.startswith('💬'):
-                    print(msg)
-                else:
-                    print(f"📨 {msg}")
+                env = envelope.decode(cipher.decrypt(msg_criptografada))
+                session["established"] = True
+                if env.kind == envelope.KIND_SESSION:
+                    session["token"] = env.body
+                    continue
+                if env.kind in (envelope.KIND_CHAT, envelope.KIND_HISTORY) and env.seq:
+                    session["last_seq"] = max(session["last_seq"], env.seq)
+                elif env.kind in (envelope.KIND_ROSTER, envelope.KIND_JOIN, envelope.KIND_LEAVE):
+                    update_roster(env)
+                print(render_envelope(env))
                     
             except Exception as e:
                 print(ColorManager.error(f"❌ Erro ao decifrar mensagem: {e}"))
     except websockets.exceptions.ConnectionClosed:
-        print(ColorManager.error("\n📡 Conexão com o servidor foi fechada"))
+        pass
     except Exception as e:
         print(ColorManager.error(f"\n💥 Erro no recebimento: {e}"))
 
+def read_input(loop, outgoing, stop):
+    """Lê o teclado numa thread e enfileira as linhas; continua entre uma reconexão e outra"""
+    while not stop.is_set():
+        try:
+            msg = input()
+        except (EOFError, KeyboardInterrupt):
+            msg = '/sair'
+        if stop.is_set():
+            return  # o cliente já terminou; o loop pode estar fechado
+        if msg.lower() == '/sair':
+            stop.set()
+        loop.call_soon_threadsafe(outgoing.put_nowait, msg)
+
+async def send_messages(websocket, cipher, outgoing):
+    """Envia o que foi digitado; retorna quando o usuário sai com /sair"""
+    while True:
+        msg = await outgoing.get()
+        if msg.lower() == '/sair':
+            print(ColorManager.info("👋 Saindo do chat..."))
+            await websocket.send(cipher.encrypt(msg.encode('utf-8')))
+            return
+        if msg.strip().lower() == '/users' and local_roster["version"] is not None:
+            # Lista local em dia: não precisa pedir ao servidor
+            names = list(local_roster["names"].values())
+            print(format_roster(names, len(names)))
+            continue
+        if msg.strip():
+            try:
+                await websocket.send(cipher.encrypt(msg.encode('utf-8')))
+            except websockets.exceptions.ConnectionClosed:
+                print(ColorManager.error(f"❌ Não enviada (sem conexão): {msg}"))
+                raise
+
+def login_frame(username):
+    """Primeiro frame: retoma a sessão se houver token; senão login com a última seq já vista"""
+    if session["token"]:
+        return f"/resume {session['token']} {session['last_seq']}"
+    if session["last_seq"]:
+        return f"/login {session['last_seq']} {username}"
+    return username
+
+def backoff_delay(attempt):
+    """Backoff exponencial com jitter total: espera aleatória entre 0 e min(teto, base * 2^tentativa),
+    para que todos os clientes não voltem juntos depois de um reinício do servidor"""
+    return random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt))
+
+async def run_connection(username, outgoing):
+    """Uma conexão completa; retorna (saiu com /sair, código de fechamento, motivo)"""
+    async with websockets.connect(
+        SERVER_URI,
+        subprotocols=offered_subprotocols(),
+        ping_interval=20,
+        ping_timeout=20,
+        close_timeout=10
+    ) as websocket:
+        
+        # Receber chave como texto base64
+        chave_b64 = await websocket.recv()
+        chave_bytes = chave_b64.encode('utf-8')  # Converter para bytes
+        engine_name = cryptog.engine_from_subprotocol(websocket.subprotocol)
+        cipher = cryptog.get_engine(engine_name, chave_bytes)
+        
+        # Avisos de entrada/saída perdidos enquanto desconectado: a lista local é refeita no próximo /users
+        reset_roster()
+
+        # Enviar username (ou pedido de resume) criptografado
+        await websocket.send(cipher.encrypt(login_frame(username).encode('utf-8')))
+        
+        # Recebimento e envio em paralelo; o primeiro que terminar encerra a conexão
+        receive_task = asyncio.create_task(receive_messages(websocket, cipher))
+        send_task = asyncio.create_task(send_messages(websocket, cipher, outgoing))
+        try:
+            await asyncio.wait({receive_task, send_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (receive_task, send_task):
+                task.cancel()
+            await asyncio.gather(receive_task, send_task, return_exceptions=True)
+        saiu = send_task.done() and not send_task.cancelled() and send_task.exception() is None
+    return saiu, websocket.close_code, websocket.close_reason
+
 async def main():
     print("=" * 50)
     print("💬 CLIENTE DE CHAT - RENDER.COM")
     print("=" * 50)
     
+    username = input('👤 Digite seu usuário: ').strip()
+    
+    if not validate_username(username):
+        print(ColorManager.error("❌ Nome inválido. Use 2-20 caracteres (letras, números, '-_')"))
+        return
+    
+    print(ColorManager.info("🔗 Conectando ao servidor..."))
+    print("\n" + "=" * 50)
+    print("💬 CHAT - Digite suas mensagens abaixo")
+    print("=" * 50)
+    print("Comandos disponíveis:")
+    print("  /users [página] - Listar usuários online")
+    print("  /pm <user> <msg> - Mensagem privada")
+    print("  /history [n|desde] - Mensagens anteriores (ex: /history 50, /history 2h)")
+    print("  /sair        - Sair do chat")
+    print("=" * 50)
+    print()
+
+    outgoing = asyncio.Queue()
+    stop_input = threading.Event()
+    threading.Thread(target=read_input, args=(asyncio.get_running_loop(), outgoing, stop_input)).start()
+    attempt = 0
+    name_retries = 0
+
     try:
-        username = input('👤 Digite seu usuário: ').strip()
-        
-        if not validate_username(username):
-            print(ColorManager.error("❌ Nome inválido. Use 2-20 caracteres (letras, números, '-_')"))
-            return
-        
-        print(ColorManager.info("🔗 Conectando ao servidor..."))
-        
-        # Configurações de conexão para Render
-        async with websockets.connect(
-            SERVER_URI,
-            ping_interval=20,
-            ping_timeout=20,
-            close_timeout=10
-        ) as websocket:
-            
-            # Receber chave como texto base64
-            chave_b64 = await websocket.recv()
-            chave_bytes = chave_b64.encode('utf-8')  # Converter para bytes
-            cipher = Fernet(chave_bytes)
-            
-            print(ColorManager.success("🔑 Chave recebida do servidor"))
-            
-            # Enviar username criptografado
-            encrypted_username = cipher.encrypt(username.encode('utf-8'))
-            await websocket.send(encrypted_username)
-            
-            print(ColorManager.success("✅ Conectado ao servidor!"))
-            print("\n" + "=" * 50)
-            print("💬 CHAT INICIADO - Digite suas mensagens abaixo")
-            print("=" * 50)
-            print("Comandos disponíveis:")
-            print("  /users       - Listar usuários online")
-            print("  /pm <user> <msg> - Mensagem privada")
-            print("  /sair        - Sair do chat")
-            print("=" * 50)
-            print()
-            
-            # Iniciar task para receber mensagens
-            receive_task = asyncio.create_task(receive_messages(websocket, chave_bytes))
-            
+        while True:
+            session["established"] = False
             try:
-                while True:
-                    # Ler input do usuário
-                    try:
-                        msg = await asyncio.get_event_loop().run_in_executor(None, input)
-                    except (EOFError, KeyboardInterrupt):
-                        print(ColorManager.info("\n👋 Saindo do chat..."))
-                        break
-                    
-                    if msg.lower() == '/sair':
-                        print(ColorManager.info("👋 Saindo do chat..."))
-                        encrypted_msg = cipher.encrypt(msg.encode('utf-8'))
-                        await websocket.send(encrypted_msg)
-                        break
-                    elif msg.strip():
-                        # Encriptar e enviar mensagem
-                        encrypted_msg = cipher.encrypt(msg.encode('utf-8'))
-                        await websocket.send(encrypted_msg)
-            
-            except Exception as e:
-                print(ColorManager.error(f"💥 Erro: {e}"))
-            
-            finally:
-                # Fechar conexão
-                receive_task.cancel()
-                try:
-                    await receive_task
-                except asyncio.CancelledError:
-                    pass
-                
-    except websockets.exceptions.InvalidURI:
-        print(ColorManager.error("❌ URL do servidor inválida"))
-    except websockets.exceptions.ConnectionClosedError:
-        print(ColorManager.error("❌ Não foi possível conectar ao servidor"))
-    except asyncio.TimeoutError:
-        print(ColorManager.error("⏰ Timeout ao conectar com o servidor"))
+                saiu, code, reason = await run_connection(username, outgoing)
+            except websockets.exceptions.InvalidURI:
+                print(ColorManager.error("❌ URL do servidor inválida"))
+                break
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+                saiu, code, reason = False, None, str(e) or type(e).__name__
+
+            if saiu:
+                break
+            if session["established"]:
+                attempt = 0
+                name_retries = 0
+
+            if code == CLOSE_SESSION_EXPIRED:
+                # Sessão perdida (ex.: servidor reiniciou): login de novo, pedindo só o que faltou.
+                # O nome pode ainda estar reservado pela sessão antiga por um instante
+                print(ColorManager.info("🔄 Sessão expirada; entrando de novo..."))
+                session["token"] = None
+                name_retries = NAME_RETRIES_AFTER_EXPIRY
+            elif code == 1008 and not session["established"]:
+                if not name_retries:
+                    # Login recusado (nome em uso, nome inválido...): tentar de novo não resolve
+                    print(ColorManager.error(f"❌ Conexão recusada: {reason}"))
+                    break
+                name_retries -= 1
+            if code == CLOSE_REPLACED:
+                print(ColorManager.info(f"🔌 {reason}"))
+                break
+            if RECONNECT_MAX_ATTEMPTS and attempt >= RECONNECT_MAX_ATTEMPTS:
+                print(ColorManager.error("❌ Não foi possível reconectar ao servidor"))
+                break
+
+            espera = backoff_delay(attempt)
+            attempt += 1
+            print(ColorManager.error(f"📡 Conexão perdida ({reason or code}); "
+                                     f"reconectando em {espera:.1f}s (tentativa {attempt})"))
+            await asyncio.sleep(espera)
     except Exception as e:
         print(ColorManager.error(f"💥 Erro inesperado: {e}"))
     
+    if not stop_input.is_set():
+        # O input() da thread de leitura ainda está esperando uma linha
+        stop_input.set()
+        print(ColorManager.info("↩️  Pressione Enter para sair"))
     print(ColorManager.info("📴 Cliente finalizado"))
 
 if __name__ == "__main__":
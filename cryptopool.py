@@ -0,0 +1,174 @@
+# cryptopool.py - Cifra/decifra fora do event loop quando o loop começa a atrasar
+#
+# Enquanto o lag do loop (medido pelo LoopLagMonitor) está baixo, as operações
+# rodam inline (sem custo extra). Acima do limiar, passam para um pool de threads ou de processos: as operações
+# pedidas na mesma volta do loop são agrupadas num único lote por job, e o lote
+# volta como futures, na ordem em que foram pedidas.
+
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+
+import applog
+import cryptog
+import metrics
+
+MODES = ("off", "thread", "process")
+
+log = applog.get_logger("cripto")
+
+def run_batch(items, submitted_at):
+    """Executa um lote no pool: [(op, motor, chave, dados)] -> (espera na fila, tempo de cifra, resultados)"""
+    inicio = time.monotonic()
+    results = []
+    for op, name, key, data in items:
+        try:
+            engine = cryptog.get_engine(name, key)
+            results.append(engine.encrypt(data) if op == "encrypt" else engine.decrypt(data))
+        except Exception as e:
+            # O erro é só deste item: os outros clientes do lote recebem os seus resultados
+            results.append(e)
+    return inicio - submitted_at, time.monotonic() - inicio, results
+
+def watch_parent(parent_pid):
+    """Inicializador dos processos do pool: encerra o filho se o servidor morrer"""
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
+
+class CryptoOffload:
+    """Despacha operações de cifra inline ou para o pool, conforme o lag do loop"""
+
+    def __init__(self, mode="thread", workers=2, lag_threshold=0.02, batch_max=64,
+                 hold_seconds=5.0, registry=None):
+        if mode not in MODES:
+            raise ValueError(f"Modo de executor inválido: {mode} (use {', '.join(MODES)})")
+        self.mode = mode
+        self.workers = workers
+        self.lag_threshold = lag_threshold
+        self.batch_max = batch_max
+        self.hold_seconds = hold_seconds
+
+        self.executor = None
+        self.active = mode != "off" and lag_threshold <= 0
+        self.active_since = 0.0
+        self.pending = []
+        self.flush_scheduled = False
+
+        registry = registry or metrics.Registry()
+        self.offloaded = registry.counter("chat_crypto_offloaded_total", "Operações de cifra feitas no pool")
+        self.inline = registry.counter("chat_crypto_inline_total", "Operações de cifra feitas no event loop")
+        registry.gauge("chat_crypto_offload_active", "1 quando a cifra está no pool", lambda: int(self.active))
+        self.queue_wait = registry.histogram("chat_crypto_queue_wait_seconds",
+                                             "Espera de um lote até começar a rodar no pool")
+        self.crypto_time = registry.histogram("chat_crypto_batch_seconds", "Tempo de cifra de um lote no pool")
+        self.batch_size = registry.histogram("chat_crypto_batch_size", "Operações por lote enviado ao pool",
+                                             metrics.DEPTH_BUCKETS)
+
+    def start(self, lag_monitor=None):
+        """Cria o pool e passa a seguir o monitor de lag; chamar com o loop rodando"""
+        if self.mode == "off":
+            return
+        if self.mode == "process" and multiprocessing.current_process().daemon:
+            # Workers do modo multi-processo são daemon e não podem ter filhos
+            log.warning("Processo daemon não pode criar pool de processos; usando threads")
+            self.mode = "thread"
+        if self.mode == "process":
+            # fork como no modo multi-processo: o filho não reexecuta o módulo principal.
+            # Os filhos nascem já no primeiro submit, antes do servidor abrir a porta,
+            # para não herdarem o socket de escuta.
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("fork"),
+                initializer=watch_parent, initargs=(os.getpid(),))
+            self.executor.submit(int).result()
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="crypto")
+        if self.lag_threshold > 0 and lag_monitor:
+            lag_monitor.subscribe(self.on_lag)
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    # ========== DESPACHO ==========
+    def encrypt_nowait(self, cipher, data):
+        """Bytes cifrados (inline) ou um Future com eles (pool); a ordem de quem enfileira é preservada"""
+        if not self.active:
+            self.inline.inc()
+            return cipher.encrypt(data)
+        return self._submit("encrypt", cipher, data)
+
+    async def decrypt(self, cipher, data):
+        """Decifra; levanta cryptog.DecryptError como a chamada direta"""
+        if not self.active:
+            self.inline.inc()
+            return cipher.decrypt(data)
+        return await self._submit("decrypt", cipher, data)
+
+    def _submit(self, op, cipher, data):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((future, (op, cipher.name, cipher.key, data)))
+        if len(self.pending) >= self.batch_max:
+            self._flush()
+        elif not self.flush_scheduled:
+            # Tudo o que for pedido até a próxima volta do loop vai no mesmo lote
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+        return future
+
+    def _flush(self):
+        self.flush_scheduled = False
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        self.offloaded.inc(len(batch))
+        self.batch_size.observe(len(batch))
+        job = asyncio.get_running_loop().run_in_executor(
+            self.executor, run_batch, [item for _, item in batch], time.monotonic())
+        job.add_done_callback(lambda done: self._resolve(batch, done))
+
+    def _resolve(self, batch, job):
+        try:
+            wait, elapsed, results = job.result()
+        except Exception as e:
+            # Erros de cada item voltam em results; aqui só chega falha do próprio job
+            for future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            if isinstance(e, concurrent.futures.BrokenExecutor):
+                # Pool quebrado (ex.: processo filho morto): volta ao modo inline de vez
+                log.error("Falha no pool, voltando ao modo inline: %s", e)
+                self.active = False
+                self.mode = "off"
+            else:
+                log.error("Falha num lote do pool: %s", e)
+            return
+        self.queue_wait.observe(wait)
+        self.crypto_time.observe(elapsed)
+        for (future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    # ========== LAG ADAPTATIVO ==========
+    def on_lag(self, monitor):
+        """Liga/desliga o pool conforme a média de lag, com histerese"""
+        if self.mode == "off":
+            return
+        agora = time.monotonic()
+        if not self.active and monitor.lag > self.lag_threshold:
+            self.active = True
+            self.active_since = agora
+            log.warning("Lag do loop em %.1f ms: cifra movida para o pool (%s)", monitor.lag * 1000, self.mode)
+        elif (self.active and monitor.lag < self.lag_threshold / 2
+              and agora - self.active_since >= self.hold_seconds):
+            self.active = False
+            log.info("Lag do loop em %.1f ms: cifra de volta ao loop", monitor.lag * 1000)
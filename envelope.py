@@ -0,0 +1,71 @@
+# envelope.py - Envelope binário tipado das mensagens servidor -> cliente
+#
+# Formato (big-endian): versão (1), tipo (1), seq (8), timestamp do servidor (8,
+# double), tamanho do remetente (1), tamanho da sala (1), remetente, sala, corpo.
+# O cliente despacha pelo tipo, sem procurar prefixos no texto.
+
+import struct
+import time
+from collections import namedtuple
+
+VERSION = 1
+HEADER = struct.Struct("!BBQdBB")
+
+# ========== TIPOS ==========
+KIND_SYSTEM = 1         # aviso do servidor para um cliente
+KIND_CHAT = 2           # mensagem de sala: sender = autor
+KIND_PRIVATE = 3        # PM recebida: sender = quem enviou
+KIND_PRIVATE_SENT = 4   # confirmação de PM enviada: sender = destinatário
+KIND_JOIN = 5           # sender entrou na sala
+KIND_LEAVE = 6          # sender saiu; body opcional com o motivo
+KIND_ANNOUNCEMENT = 7   # anúncio do administrador
+KIND_VOTE = 8           # andamento de votação
+KIND_HISTORY = 9        # mensagem antiga vinda de /history (seq e timestamp originais)
+KIND_SESSION = 10       # token de sessão para retomar a conexão (body = token)
+KIND_ROSTER = 11        # página do /users: seq = versão da lista (JOIN/LEAVE levam a versão no seq)
+
+KIND_NAMES = {
+    KIND_SYSTEM: "system",
+    KIND_CHAT: "chat",
+    KIND_PRIVATE: "private",
+    KIND_PRIVATE_SENT: "private_sent",
+    KIND_JOIN: "join",
+    KIND_LEAVE: "leave",
+    KIND_ANNOUNCEMENT: "announcement",
+    KIND_VOTE: "vote",
+    KIND_HISTORY: "history",
+    KIND_SESSION: "session",
+    KIND_ROSTER: "roster",
+}
+
+Envelope = namedtuple("Envelope", "kind sender room seq timestamp body")
+
+class EnvelopeError(ValueError):
+    pass
+
+def encode(kind, body="", sender="", room="", seq=0, timestamp=None):
+    sender_bytes = sender.encode('utf-8')
+    room_bytes = room.encode('utf-8')
+    if len(sender_bytes) > 255 or len(room_bytes) > 255:
+        raise EnvelopeError("Remetente ou sala com mais de 255 bytes")
+    header = HEADER.pack(VERSION, kind, seq, time.time() if timestamp is None else timestamp,
+                         len(sender_bytes), len(room_bytes))
+    return header + sender_bytes + room_bytes + body.encode('utf-8')
+
+def decode(data):
+    if len(data) < HEADER.size:
+        raise EnvelopeError("Envelope truncado")
+    version, kind, seq, timestamp, sender_len, room_len = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise EnvelopeError(f"Versão de envelope desconhecida: {version}")
+    inicio = HEADER.size
+    meio = inicio + sender_len
+    fim = meio + room_len
+    if fim > len(data):
+        raise EnvelopeError("Envelope truncado")
+    return Envelope(kind,
+                    bytes(data[inicio:meio]).decode('utf-8'),
+                    bytes(data[meio:fim]).decode('utf-8'),
+                    seq,
+                    timestamp,
+                    bytes(data[fim:]).decode('utf-8'))
@@ -0,0 +1,59 @@
+# history.py - Histórico recente em memória (ring buffer limitado por contagem e bytes)
+
+import sys
+from collections import deque
+
+class RingHistory:
+    """Últimas mensagens de uma sala; descarta as mais antigas ao passar dos limites"""
+
+    def __init__(self, max_messages, max_bytes):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.entries = deque()
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def append(self, payload):
+        """Guarda um payload já serializado (bytes)"""
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+        self.entries.append((payload, size))
+        self.bytes += size
+        while len(self.entries) > self.max_messages or self.bytes > self.max_bytes:
+            _, removed = self.entries.popleft()
+            self.bytes -= removed
+
+    def snapshot(self):
+        """Cópia das mensagens atuais, da mais antiga para a mais nova"""
+        return [payload for payload, _ in self.entries]
+
+    def memory_usage(self):
+        """Estimativa em bytes do que o buffer ocupa no heap (deque, tuplas e payloads)"""
+        total = sys.getsizeof(self.entries)
+        for entry in self.entries:
+            total += sys.getsizeof(entry) + sys.getsizeof(entry[0])
+        return total
+
+class HistoryStore:
+    """Um RingHistory por sala, criado sob demanda"""
+
+    def __init__(self, max_messages, max_bytes):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.rooms = {}
+
+    def room(self, name):
+        history = self.rooms.get(name)
+        if history is None:
+            history = self.rooms[name] = RingHistory(self.max_messages, self.max_bytes)
+        return history
+
+    def stats(self):
+        """(mensagens, bytes de payload, bytes estimados em memória) somando todas as salas"""
+        messages = sum(len(history) for history in self.rooms.values())
+        content = sum(history.bytes for history in self.rooms.values())
+        memory = sum(history.memory_usage() for history in self.rooms.values())
+        return messages, content, memory
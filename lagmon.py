@@ -0,0 +1,87 @@
+# lagmon.py - Monitor de lag do event loop
+#
+# Uma task dorme `interval` e mede quanto acordou atrasada. As amostras ficam
+# numa janela móvel (percentis para o health check) e numa média móvel (reação
+# rápida); quem precisa reagir ao lag, como o pool de cifra, assina o monitor.
+
+import asyncio
+import time
+from collections import deque
+
+class LoopLagMonitor:
+    """Amostra o atraso de agendamento do loop e diz se ele está degradado"""
+
+    def __init__(self, interval=0.1, window_seconds=30.0, threshold=0.25, sustain=5.0, smoothing=0.3):
+        self.interval = interval
+        self.threshold = threshold
+        self.sustain = sustain
+        self.smoothing = smoothing
+        self.samples = deque(maxlen=max(1, int(window_seconds / interval)))
+        self.lag = 0.0          # média móvel
+        self.last = 0.0
+        self.over_since = None  # desde quando a média está acima do limiar
+        self.listeners = []
+        self.task = None
+
+    def subscribe(self, callback):
+        """callback(monitor) é chamado depois de cada amostra"""
+        self.listeners.append(callback)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            inicio = loop.time()
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, loop.time() - inicio - self.interval))
+
+    def record(self, sample):
+        self.last = sample
+        self.samples.append(sample)
+        self.lag += self.smoothing * (sample - self.lag)
+
+        if self.lag > self.threshold:
+            if self.over_since is None:
+                self.over_since = time.monotonic()
+        else:
+            self.over_since = None
+
+        for callback in self.listeners:
+            callback(self)
+
+    def degraded(self):
+        """True quando o lag ficou acima do limiar por pelo menos `sustain` segundos"""
+        return self.over_since is not None and time.monotonic() - self.over_since >= self.sustain
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def snapshot(self):
+        """Resumo da janela em milissegundos"""
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {"samples": 0}
+
+        def at(fraction):
+            return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 2)
+
+        return {
+            "samples": len(ordered),
+            "window_s": round(len(ordered) * self.interval, 1),
+            "avg_ms": round(self.lag * 1000, 2),
+            "p50_ms": at(0.50),
+            "p90_ms": at(0.90),
+            "p99_ms": at(0.99),
+            "max_ms": round(ordered[-1] * 1000, 2),
+        }
@@ -0,0 +1,134 @@
+# applog.py - Logging em fila: quem loga só enfileira, uma thread escreve
+#
+# O event loop (ou as threads de cliente) nunca espera por stdout: os registros
+# vão para uma fila limitada (cheia = descarta e conta) e uma QueueListener os
+# escreve em texto ou JSON. Erros repetidos passam por um limite por janela.
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")  # "text" ou "json"
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+LOG_RATE_LIMIT = int(os.environ.get("LOG_RATE_LIMIT", 5))          # repetições por janela (0 = sem limite)
+LOG_RATE_WINDOW = float(os.environ.get("LOG_RATE_WINDOW", 10.0))   # segundos
+
+ROOT = "chat"
+TEXT_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+# Cores (colorama) só fazem sentido num terminal
+color_enabled = sys.stdout.isatty() and LOG_FORMAT == "text"
+
+_handler = None
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro"""
+
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+class RateLimitFilter(logging.Filter):
+    """Deixa passar no máximo `limit` avisos/erros com o mesmo texto-modelo por janela"""
+
+    def __init__(self, limit, window):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.seen = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or self.limit <= 0:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        agora = time.monotonic()
+        with self.lock:
+            inicio, count, suppressed = self.seen.get(key, (agora, 0, 0))
+            if agora - inicio >= self.window:
+                if suppressed:
+                    record.msg = f"{record.msg} (+{suppressed} repetidas suprimidas)"
+                inicio, count, suppressed = agora, 0, 0
+            count += 1
+            if count > self.limit:
+                self.seen[key] = (inicio, count, suppressed + 1)
+                return False
+            self.seen[key] = (inicio, count, suppressed)
+            if len(self.seen) > 1000:
+                self.seen = {k: v for k, v in self.seen.items() if agora - v[0] < self.window}
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que nunca bloqueia: com a fila cheia, descarta e conta"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def setup(level=LOG_LEVEL):
+    """Configura o logger "chat" (uma vez por processo) e devolve-o"""
+    global _handler
+    logger = logging.getLogger(ROOT)
+    if _handler:
+        return logger
+
+    logger.setLevel(level)
+    logger.propagate = False
+    _handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_WINDOW))
+    logger.addHandler(_handler)
+    _start_listener()
+    atexit.register(stop)
+    os.register_at_fork(after_in_child=_restart_after_fork)
+    return logger
+
+def get_logger(name):
+    return logging.getLogger(f"{ROOT}.{name}")
+
+def dropped():
+    """Registros descartados por fila cheia neste processo"""
+    return _handler.dropped if _handler else 0
+
+def stop():
+    """Esvazia a fila e para a thread escritora"""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+def _start_listener():
+    global _listener
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    _listener = logging.handlers.QueueListener(_handler.queue, stream)
+    _listener.start()
+
+def _restart_after_fork():
+    # A thread escritora não existe no filho: fila e thread novas
+    global _listener
+    _listener = None
+    _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _handler.dropped = 0
+    _start_listener()
@@ -0,0 +1,249 @@
+# bench_escala.py - Escala do servidor local: uma thread por cliente x reactor (selectors)
+#
+# Sobe o servidor.py com cada SERVER_ENGINE (salas privadas, num diretório
+# temporário para não mexer no lobby) e, para cada número de clientes,
+# conecta todos, faz todos falarem num ritmo fixo e mede: latência de entrega num
+# cliente observador (p50/p99), mensagens entregues/s somando as salas, e threads,
+# RSS e CPU do servidor. O anti-spam silencia quem fala de novo em menos de 5 s,
+# então cada cliente fala no máximo uma vez a cada SPAM_INTERVAL segundos.
+#
+# Com --rooms N os clientes se dividem entre N salas, hospedadas de dois jeitos:
+#   salas     - um processo com as N salas atrás de uma única porta
+#   processos - N processos de uma sala cada (o modelo antigo); threads, RSS e
+#               CPU somam todos os processos
+#
+# Exemplo:
+#   python bench_escala.py --clients 100,500,1000 --rate 100 --duration 15
+#   python bench_escala.py --clients 1000 --rooms 100 --engines selectors --layouts salas,processos
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+from cryptog import encrypt_message
+import framing
+
+SERVER_HOST = 'localhost'
+PASSWORD = "bench"
+MARKER = "bench:"
+SPAM_INTERVAL = 5.5
+
+# ========== SERVIDOR ==========
+def spawn_server(engine, port, workdir, rooms=1):
+    """Um servidor.py com `rooms` salas privadas (ids 1..rooms) na mesma porta"""
+    env = dict(os.environ, SERVER_ENGINE=engine, LOG_LEVEL="WARNING")
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "servidor.py")],
+                              stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              cwd=workdir, env=env)
+    # Menu: sala privada, senha, porta (só na primeira), sem limite; 'voltar' deixa a sala aberta
+    server.stdin.write(f"2\n{PASSWORD}\n{port}\n0\nvoltar\n".encode())
+    server.stdin.write(f"2\n{PASSWORD}\n0\nvoltar\n".encode() * (rooms - 1))
+    server.stdin.flush()
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            # Pronto quando a última sala aceita o handshake (antes disso: FAIL_ROOM)
+            with socket.create_connection((SERVER_HOST, port), timeout=1) as sock:
+                sock.sendall(framing.encode(str(rooms).encode()) + framing.encode(PASSWORD.encode()))
+                if len(framing.FrameReader(sock, 4096).read() or b"") == 44:
+                    return server
+        except OSError:
+            pass
+        time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"Servidor ({engine}) não subiu na porta {port}")
+
+def stop_server(server):
+    try:
+        server.stdin.write(b"4\n")   # menu principal: desligar o servidor
+        server.stdin.flush()
+    except OSError:
+        pass
+    server.terminate()
+    server.wait()
+
+def server_usage(pids):
+    """(threads, RSS em bytes, segundos de CPU) somando os processos do servidor"""
+    threads = rss = cpu = 0
+    for pid in pids:
+        with open(f"/proc/{pid}/status") as f:
+            for linha in f:
+                if linha.startswith("Threads:"):
+                    threads += int(linha.split()[1])
+                elif linha.startswith("VmRSS:"):
+                    rss += int(linha.split()[1]) * 1024
+        with open(f"/proc/{pid}/stat") as f:
+            campos = f.read().rsplit(")", 1)[1].split()
+        cpu += (int(campos[11]) + int(campos[12])) / os.sysconf("SC_CLK_TCK")
+    return threads, rss, cpu
+
+def spawn_layout(layout, engine, port, rooms, workdir):
+    """Sobe as salas; devolve (processos, [(porta, sala)] de cada sala)"""
+    if layout == "salas":
+        return [spawn_server(engine, port, workdir, rooms)], [(port, sala) for sala in range(1, rooms + 1)]
+    servers = []
+    try:
+        for k in range(rooms):
+            servers.append(spawn_server(engine, port + k, workdir))
+    except Exception:
+        for server in servers:
+            stop_server(server)
+        raise
+    return servers, [(port + k, 1) for k in range(rooms)]
+
+# ========== CLIENTES ==========
+async def read_frames(reader, decoder):
+    """Frames completos do próximo bloco lido; None no fim da conexão"""
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            return None
+        decoder.feed(data)
+        frames = decoder.frames()
+        if frames:
+            return frames
+
+async def connect(port, room, name):
+    """Handshake do cliente.py: sala, senha, chave, nome cifrado, OK_NAME"""
+    reader, writer = await asyncio.open_connection(SERVER_HOST, port)
+    decoder = framing.FrameDecoder(4096)
+    writer.write(framing.encode(str(room).encode('ascii')) + framing.encode(PASSWORD.encode('utf-8')))
+    (chave,) = await read_frames(reader, decoder)
+    writer.write(framing.encode(encrypt_message(name, chave)))
+    # No modelo de threads um broadcast de outra thread pode chegar antes do OK_NAME
+    while True:
+        frames = await read_frames(reader, decoder)
+        if frames is None or b"FAIL_NAME" in frames:
+            raise RuntimeError(f"Servidor recusou o nome {name}")
+        if b"OK_NAME" in frames:
+            break
+    return reader, writer, chave, decoder
+
+async def count_deliveries(reader, decoder, stats):
+    """Conta as mensagens recebidas sem decifrar"""
+    while (frames := await read_frames(reader, decoder)) is not None:
+        stats["delivered"] += len(frames)
+
+async def observe(reader, decoder, chave, stats):
+    """Decifra tudo o que chega e mede a latência das mensagens do benchmark"""
+    fernet = Fernet(chave)
+    while (frames := await read_frames(reader, decoder)) is not None:
+        for frame in frames:
+            corpo = fernet.decrypt(frame).decode('utf-8', 'replace')
+            inicio = corpo.find(MARKER)
+            if inicio >= 0 and stats["measuring"]:
+                stats["latencies"].append(time.time() - float(corpo[inicio + len(MARKER):]))
+
+async def talk(writer, chave, interval, offset, stop_at):
+    await asyncio.sleep(offset)
+    while time.time() < stop_at:
+        writer.write(framing.encode(encrypt_message(f"{MARKER}{time.time():.6f}", chave)))
+        await asyncio.sleep(interval)
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    ordenados = sorted(values)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+async def run_room(options, targets, clients, server_pids):
+    stats = {"delivered": 0, "latencies": [], "measuring": False}
+    conexoes = []
+    limite = asyncio.Semaphore(options.connect_concurrency)
+
+    async def entrar(i):
+        async with limite:
+            conexoes.append(await connect(*targets[i % len(targets)], f"b{i}"))
+
+    inicio = time.time()
+    await asyncio.gather(*(entrar(i) for i in range(clients)))
+    tempo_conexao = time.time() - inicio
+
+    reader, _, chave, decoder = conexoes[0]
+    leitores = [asyncio.create_task(observe(reader, decoder, chave, stats))]
+    leitores += [asyncio.create_task(count_deliveries(reader, decoder, stats))
+                 for reader, _, _, decoder in conexoes[1:]]
+    await asyncio.sleep(options.settle)
+    threads_ocioso, rss_ocioso, _ = server_usage(server_pids)
+
+    # Fase ativa: todos menos o observador falam; as salas recebem ~options.rate mensagens/s
+    falantes = conexoes[1:]
+    interval = max(len(falantes) / options.rate, SPAM_INTERVAL)
+    stop_at = time.time() + interval + options.duration
+    tarefas = [asyncio.create_task(talk(writer, chave, interval, interval * i / len(falantes), stop_at))
+               for i, (_, writer, chave, _) in enumerate(falantes)]
+    await asyncio.sleep(interval)   # aquecimento: todo mundo já falou uma vez
+    _, _, cpu_inicio = server_usage(server_pids)
+    entregues_inicio = stats["delivered"]
+    stats["measuring"] = True
+    await asyncio.sleep(options.duration)
+    entregues = stats["delivered"] - entregues_inicio
+    threads_ativo, rss_ativo, cpu_fim = server_usage(server_pids)
+    await asyncio.gather(*tarefas)
+    await asyncio.sleep(options.drain)
+    stats["measuring"] = False
+
+    for _, writer, _, _ in conexoes:
+        writer.close()
+    for tarefa in leitores:
+        tarefa.cancel()
+
+    return {
+        "connect_s": tempo_conexao,
+        "rate": len(falantes) / interval,
+        "delivered_s": entregues / options.duration,
+        "p50": percentile(stats["latencies"], 0.50) * 1000,
+        "p99": percentile(stats["latencies"], 0.99) * 1000,
+        "threads": (threads_ocioso, threads_ativo),
+        "rss": (rss_ocioso, rss_ativo),
+        "cpu": (cpu_fim - cpu_inicio) / options.duration,
+    }
+
+# ========== PRINCIPAL ==========
+def parse_args():
+    parser = argparse.ArgumentParser(description="Escala do servidor local: threads x selectors")
+    parser.add_argument("--clients", default="100,500,1000", help="números de clientes a medir (somando as salas)")
+    parser.add_argument("--engines", default="threads,selectors")
+    parser.add_argument("--rooms", type=int, default=1, help="salas entre as quais os clientes se dividem")
+    parser.add_argument("--layouts", default="salas", help="salas (um processo) e/ou processos (um por sala)")
+    parser.add_argument("--rate", type=float, default=100.0,
+                        help=f"mensagens/s somando as salas (limitado a clientes/{SPAM_INTERVAL} pelo anti-spam)")
+    parser.add_argument("--duration", type=float, default=15.0, help="segundos medidos da fase ativa (após o aquecimento)")
+    parser.add_argument("--settle", type=float, default=1.0, help="espera depois de conectar todos")
+    parser.add_argument("--drain", type=float, default=2.0, help="espera para as últimas entregas")
+    parser.add_argument("--connect-concurrency", type=int, default=50)
+    parser.add_argument("--port", type=int, default=20400, help="primeira porta (fora da faixa efêmera)")
+    return parser.parse_args()
+
+def main():
+    options = parse_args()
+    tamanhos = [int(n) for n in options.clients.split(",")]
+    print(f"📈 {options.clients} clientes em {options.rooms} sala(s), ~{options.rate:.0f} msg/s, "
+          f"{options.duration:.0f} s por medição")
+
+    porta = options.port
+    for clients in tamanhos:
+        print(f"\n👥 {clients} clientes")
+        for layout in options.layouts.split(","):
+            for engine in options.engines.split(","):
+                with tempfile.TemporaryDirectory() as workdir:
+                    servers, targets = spawn_layout(layout, engine, porta, options.rooms, workdir)
+                    try:
+                        r = asyncio.run(run_room(options, targets, clients, [server.pid for server in servers]))
+                    finally:
+                        for server in servers:
+                            stop_server(server)
+                porta += len(servers)
+                print(f"  {layout:9} {engine:9} conexão {r['connect_s']:6.2f}s | {r['rate']:5.1f} msg/s -> "
+                      f"{r['delivered_s']:8.0f} entregas/s | latência p50 {r['p50']:7.1f} ms p99 {r['p99']:7.1f} ms | "
+                      f"threads {r['threads'][0]}/{r['threads'][1]} | RSS {r['rss'][0] / 2**20:6.1f}/{r['rss'][1] / 2**20:6.1f} MiB | "
+                      f"CPU {r['cpu'] * 100:5.1f}%")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# bench_framing.py - Vazão do codec de frames (framing.py) num socket TCP local
+#
+# Uma thread envia N frames de um tamanho fixo, B frames por sendall() (B > 1 é
+# o pipelining: vários frames por syscall). Do outro lado, dois leitores:
+#   ingênuo     - buffer = buffer + recv(); frame = buffer[:n]; buffer = buffer[n:]
+#   FrameDecoder - recv_into num bytearray reaproveitado e fatias de memoryview
+# Mostra frames/s, MB/s e quantos recv foram necessários em cada combinação.
+#
+# Exemplo:
+#   python bench_framing.py --frames 200000 --sizes 64,512,4096 --batches 1,16,128
+
+import argparse
+import socket
+import threading
+import time
+
+import framing
+
+# ========== LEITORES ==========
+def naive_reader(sock, expected):
+    """Concatena bytes a cada recv e corta o buffer a cada frame"""
+    buffer = b""
+    frames = recvs = 0
+    while frames < expected:
+        data = sock.recv(framing.BUFFER_SIZE)
+        if not data:
+            break
+        recvs += 1
+        buffer += data
+        while len(buffer) >= framing.HEADER.size:
+            (tamanho,) = framing.HEADER.unpack_from(buffer)
+            fim = framing.HEADER.size + tamanho
+            if len(buffer) < fim:
+                break
+            _ = buffer[framing.HEADER.size:fim]
+            buffer = buffer[fim:]
+            frames += 1
+    return frames, recvs
+
+def decoder_reader(sock, expected):
+    """recv_into direto no buffer do FrameDecoder"""
+    decoder = framing.FrameDecoder()
+    frames = recvs = 0
+    while frames < expected:
+        if not decoder.recv_from(sock):
+            break
+        recvs += 1
+        frames += len(decoder.frames())
+    return frames, recvs
+
+READERS = {"ingênuo": naive_reader, "FrameDecoder": decoder_reader}
+
+# ========== MEDIÇÃO ==========
+def socket_pair():
+    """Par de sockets TCP em localhost (o mesmo caminho do chat, não um socket Unix)"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        sender = socket.create_connection(listener.getsockname())
+        receiver, _ = listener.accept()
+    return sender, receiver
+
+def run(reader, frames, size, batch):
+    sender, receiver = socket_pair()
+    bloco = framing.encode_many([b"x" * size] * batch)
+    envios, resto = divmod(frames, batch)
+
+    def enviar():
+        for _ in range(envios):
+            sender.sendall(bloco)
+        if resto:
+            sender.sendall(framing.encode_many([b"x" * size] * resto))
+
+    thread = threading.Thread(target=enviar)
+    inicio = time.perf_counter()
+    thread.start()
+    recebidos, recvs = reader(receiver, frames)
+    elapsed = time.perf_counter() - inicio
+    thread.join()
+    sender.close()
+    receiver.close()
+    if recebidos != frames:
+        raise RuntimeError(f"Esperava {frames} frames, recebeu {recebidos}")
+    return elapsed, recvs
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Vazão do codec de frames do chat local")
+    parser.add_argument("--frames", type=int, default=200000, help="frames por medição")
+    parser.add_argument("--sizes", default="64,512,4096", help="tamanhos de frame (bytes de conteúdo)")
+    parser.add_argument("--batches", default="1,16,128", help="frames por sendall()")
+    return parser.parse_args()
+
+def main():
+    options = parse_args()
+    print(f"📦 {options.frames} frames por medição")
+    for size in (int(s) for s in options.sizes.split(",")):
+        print(f"\n📏 Frames de {size} bytes")
+        for batch in (int(b) for b in options.batches.split(",")):
+            for nome, reader in READERS.items():
+                elapsed, recvs = run(reader, options.frames, size, batch)
+                taxa = options.frames / elapsed
+                print(f"  {batch:4d} por send | {nome:12} {taxa:11,.0f} frames/s "
+                      f"{taxa * (size + framing.HEADER.size) / 1e6:8.1f} MB/s | {recvs:7d} recv")
+
+if __name__ == "__main__":
+    main()
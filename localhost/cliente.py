@@ -1,9 +1,12 @@
 import threading
 import socket
-import json
-import os
+import sqlite3
 import sys
-from cryptog import encrypt_message, decrypt_message
+from cryptog import encrypt_message, decrypt_bytes
+from lobby import LobbyStore
+import discovery
+import envelope
+import framing
 from colorama import init, Fore, Style
 
 
@@ -12,7 +15,6 @@ init(autoreset=True)
 
 
 # ========== CONFIGURAÇÕES ==========
-LOBBY_FILE = 'lobby.json'
 SERVER_HOST = 'localhost'
 BUFFER_SIZE = 2048
 PROTOCOL_TIMEOUT = 10.0
@@ -60,14 +62,14 @@ class ColorManager:
 
 # ========== OPERAÇÕES DO LOBBY ==========
 def read_lobby():
-    """Lê e retorna a lista de servidores do lobby"""
+    """Lê e retorna a lista de servidores do lobby (uma consulta, sem ler o arquivo inteiro)"""
+    store = LobbyStore()
     try:
-        if not os.path.exists(LOBBY_FILE):
-            return []
-        with open(LOBBY_FILE, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError):
+        return store.list_rooms()
+    except sqlite3.Error:
         return []
+    finally:
+        store.close()
 
 
 
@@ -114,6 +116,7 @@ def print_help_menu(): #    Exibe o menu de ajuda completo
         ("mute <user> [min]", "Silencia um usuário (permanentemente ou por [min] minutos)."),
         ("unmute <user>", "Remove o silêncio de um usuário."),
         ("broadcast <msg>", "Envia um anúncio global para todos na sala."),
+        ("voltar", "Volta ao menu deixando a sala aberta (várias salas na mesma porta)."),
         ("sair", "Desliga a sala atual e volta ao menu de criação.")
     ]
     
@@ -122,7 +125,7 @@ def print_help_menu(): #    Exibe o menu de ajuda completo
     
     print(Style.BRIGHT + "\nLimitações:")
     print(" - Chats públicos não precisam de senha, mas chats privados sim.")
-    print(" - Um log de salas privadas (porta e senha) é salvo em 'private_rooms.log'.")
+    print(" - Um log de salas privadas (porta, sala e senha) é salvo em 'private_rooms.log'.")
     print(" - O Anti-Flood automático bane após 3 infrações (Aviso -> Mute 5 min -> Expulsão).")
     
     print(ColorManager.info("------------------------"))
@@ -143,13 +146,13 @@ def main():
         choice = input("Escolha: ").strip()
         
         if choice == '1':
-            porta = handle_public_chat_selection()
+            porta, sala = handle_public_chat_selection()
             if porta:
-                connect_to_chat(porta, None)
+                connect_to_chat(porta, sala, None)
         elif choice == '2':
-            porta, senha = handle_private_chat_selection()
+            porta, sala, senha = handle_private_chat_selection()
             if porta:
-                connect_to_chat(porta, senha)
+                connect_to_chat(porta, sala, senha)
         elif choice == '3':
             print_help_menu()
         elif choice == '4':
@@ -175,13 +178,34 @@ def display_main_menu():
 
 def handle_public_chat_selection():
     """Manipula a seleção de chat público"""
-    servers = read_lobby()
+    snapshot = discovery.fetch_rooms()
+    if snapshot is None:
+        # Serviço de descoberta fora do ar: usa o lobby em disco
+        servers, version = read_lobby(), None
+    else:
+        servers, version = snapshot["rooms"], snapshot["version"]
     if not servers:
         print(ColorManager.warning("\nNenhum chat público encontrado"))
-        return None
+        return None, None
     
     display_public_chats(servers)
-    return select_chat_from_list(servers)
+    if version is None:
+        return select_chat_from_list(servers)
+
+    # Enquanto o usuário escolhe, o serviço empurra a lista nova a cada mudança;
+    # a seleção vale sobre a lista mais recente (atualizada no lugar)
+    def on_rooms_changed(snapshot):
+        servers[:] = snapshot["rooms"]
+        print(ColorManager.info("\n🔄 A lista de salas mudou"))
+        display_public_chats(servers)
+        print("\nDigite o número do chat para entrar: ", end="", flush=True)
+
+    watcher = discovery.RoomWatcher(on_rooms_changed, since_version=version)
+    watcher.start()
+    try:
+        return select_chat_from_list(servers)
+    finally:
+        watcher.stop()
 
 
 
@@ -192,13 +216,14 @@ def handle_private_chat_selection():
         porta = int(input("\nDigite a PORTA do chat privado: "))
         if not validate_port(porta):
             print(ColorManager.error("Porta deve estar entre 1024 e 65535"))
-            return None, None
+            return None, None, None
         
+        sala = int(input("Digite o número da SALA: "))
         senha = input("Digite a SENHA do chat: ")
-        return porta, senha
+        return porta, sala, senha
     except ValueError:
-        print(ColorManager.error("A porta deve ser um número"))
-        return None, None
+        print(ColorManager.error("A porta e a sala devem ser números"))
+        return None, None, None
 
 
 
@@ -211,8 +236,9 @@ def display_public_chats(servers):
         max_members = server.get('max', 'N/A')
         name = server.get('name', 'Sala Sem Nome')
         port = server.get('port', 'N/A')
+        room = server.get('room', 'N/A')
         
-        print(f"{i+1}: {name} ({members}/{max_members}) - Porta: {port}")
+        print(f"{i+1}: {name} ({members}/{max_members}) - Porta: {port}, Sala: {room}")
 
 
 
@@ -224,21 +250,22 @@ def select_chat_from_list(servers):
         if 1 <= select_num <= len(servers):
             selected_server = servers[select_num - 1]
             porta = int(selected_server['port'])
+            sala = int(selected_server['room'])
             print(ColorManager.info(f"Conectando à sala '{selected_server['name']}'..."))
-            return porta
+            return porta, sala
         else:
             print(ColorManager.error("Número inválido"))
-            return None
-    except (ValueError, IndexError):
+            return None, None
+    except (ValueError, IndexError, KeyError):
         print(ColorManager.error("Entrada inválida ou erro ao ler lobby"))
-        return None
+        return None, None
 
 
 
 
 
 # ========== CONEXÃO E AUTENTICAÇÃO ==========
-def connect_to_chat(porta, senha):
+def connect_to_chat(porta, sala, senha):
     """Estabelece conexão com o chat e gerencia a sessão"""
     client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     client.settimeout(PROTOCOL_TIMEOUT)
@@ -246,25 +273,26 @@ def connect_to_chat(porta, senha):
     try:
         client.connect((SERVER_HOST, porta))
         client.settimeout(None)
+        reader = framing.FrameReader(client, BUFFER_SIZE)
         
         # Autenticação
-        if not authenticate_client(client, senha):
+        if not authenticate_client(client, sala, senha):
             client.close()
             return
         
         # Recebimento da chave
-        chave_bytes = receive_encryption_key(client)
+        chave_bytes = receive_encryption_key(client, reader)
         if not chave_bytes:
             client.close()
             return
         
         # Autenticação do usuário
-        if not authenticate_username(client, chave_bytes):
+        if not authenticate_username(client, reader, chave_bytes):
             client.close()
             return
         
         # Início da sessão de chat
-        start_chat_session(client, chave_bytes)
+        start_chat_session(client, reader, chave_bytes)
         
     except ConnectionRefusedError:
         print(ColorManager.error(f"\nNinguém está ouvindo na porta {porta}"))
@@ -278,18 +306,12 @@ def connect_to_chat(porta, senha):
 
 
 
-def authenticate_client(client, senha):
-    """Autentica o cliente com senha (se necessário)"""
+def authenticate_client(client, sala, senha):
+    """Escolhe a sala (um processo hospeda várias na mesma porta) e envia a senha (se
+    necessário); a resposta chega no lugar da chave"""
+    client.sendall(framing.encode(str(sala).encode('ascii')))
     if senha is not None:
-        client.send(senha.encode('utf-8'))
-        initial_response = client.recv(9)
-        
-        if initial_response == b"FAIL     ":
-            print(ColorManager.error("\nSenha incorreta. Conexão recusada"))
-            return False
-        elif initial_response == b"FAIL_FULL":
-            print(ColorManager.error("\nA sala está cheia"))
-            return False
+        client.sendall(framing.encode(senha.encode('utf-8')))
     
     return True
 
@@ -297,44 +319,40 @@ def authenticate_client(client, senha):
 
 
 
-def receive_encryption_key(client):
-    """Recebe a chave de criptografia do servidor"""
+def receive_encryption_key(client, reader):
+    """Recebe a chave de criptografia do servidor (ou a recusa: sala inexistente, senha errada, sala cheia)"""
     try:
-        initial_response = client.recv(9)
+        client.settimeout(SOCKET_TIMEOUT)
+        response = reader.read()
+        client.settimeout(None)
         
-        if initial_response in [b"FAIL     ", b"FAIL_FULL"]:
-            handle_protocol_errors(initial_response)
+        if response is None:
+            print(ColorManager.error("O servidor fechou a conexão antes de enviar a chave"))
             return None
         
-        # A chave Fernet tem 44 bytes
-        remaining_bytes = 44 - len(initial_response)
-        if remaining_bytes < 0:
-            print(ColorManager.error("Resposta inesperada do servidor ao receber chave"))
+        if response in [b"FAIL", b"FAIL_FULL", b"FAIL_ROOM"]:
+            handle_protocol_errors(response)
             return None
         
-        if remaining_bytes > 0:
-            client.settimeout(SOCKET_TIMEOUT)
-            key_bytes_remaining = client.recv(remaining_bytes)
-            client.settimeout(None)
-            chave_bytes = initial_response + key_bytes_remaining
-        else:
-            chave_bytes = initial_response
-        
-        if len(chave_bytes) != 44:
-            print(ColorManager.error(f"Falha ao receber a chave completa. Esperava 44 bytes, recebeu {len(chave_bytes)}"))
+        # A chave Fernet tem 44 bytes
+        if len(response) != 44:
+            print(ColorManager.error(f"Chave inválida recebida do servidor ({len(response)} bytes)"))
             return None
         
-        return chave_bytes
+        return response
         
     except socket.timeout:
         print(ColorManager.error("Tempo limite ao receber chave do servidor"))
         return None
+    except framing.FrameError as e:
+        print(ColorManager.error(f"Resposta inválida do servidor: {e}"))
+        return None
 
 
 
 
 
-def authenticate_username(client, chave_bytes):
+def authenticate_username(client, reader, chave_bytes):
     """Autentica o nome de usuário com o servidor"""
     username = input('Usuário> ').strip()
     
@@ -343,15 +361,15 @@ def authenticate_username(client, chave_bytes):
         return False
     
     try:
-        client.send(encrypt_message(username, chave_bytes))
+        client.sendall(framing.encode(encrypt_message(username, chave_bytes)))
         client.settimeout(SOCKET_TIMEOUT)
-        auth_status = client.recv(9)
+        auth_status = reader.read()
         client.settimeout(None)
         
         if auth_status == b"FAIL_NAME":
             print(ColorManager.error(f"O nome '{username}' já está em uso nesta sala"))
             return False
-        elif auth_status != b"OK_NAME  ":
+        elif auth_status != b"OK_NAME":
             print(ColorManager.error("Resposta inesperada do servidor após enviar nome"))
             return False
         
@@ -367,10 +385,12 @@ def authenticate_username(client, chave_bytes):
 
 def handle_protocol_errors(response):
     """Manipula erros de protocolo do servidor"""
-    if response == b"FAIL     ":
+    if response == b"FAIL":
         print(ColorManager.error("Senha incorreta. Conexão recusada"))
     elif response == b"FAIL_FULL":
         print(ColorManager.error("A sala está cheia"))
+    elif response == b"FAIL_ROOM":
+        print(ColorManager.error("Essa sala não existe (ou já foi fechada) nesta porta"))
 
 
 
@@ -387,7 +407,7 @@ def safe_close_socket(sock):
 
 
 # ========== SESSÃO DE CHAT ==========
-def start_chat_session(client, chave_bytes):
+def start_chat_session(client, reader, chave_bytes):
     """Inicia a sessão de chat com threads de envio e recebimento"""
     global stop_threads
     stop_threads = False
@@ -396,7 +416,7 @@ def start_chat_session(client, chave_bytes):
     print("Digite '/help' para ver os comandos")
     
     # Iniciar threads
-    receive_thread = threading.Thread(target=receiveMessages, args=[client, chave_bytes])
+    receive_thread = threading.Thread(target=receiveMessages, args=[reader, chave_bytes])
     send_thread = threading.Thread(target=sendMessages, args=[client, chave_bytes])
     
     receive_thread.start()
@@ -412,21 +432,24 @@ def start_chat_session(client, chave_bytes):
 
 
 
-def receiveMessages(client, chave):
-    """Thread para recebimento de mensagens"""
+def receiveMessages(reader, chave):
+    """Thread para recebimento de mensagens (um frame por mensagem)"""
     global stop_threads
     
     while not stop_threads:
         try:
-            msg_criptografada = client.recv(BUFFER_SIZE)
-            if not msg_criptografada:
+            msg_criptografada = reader.read()
+            if msg_criptografada is None:
                 if not stop_threads:
                     print(ColorManager.warning('\nO servidor fechou a sala'))
                     stop_threads = True
                 break
             
-            msg = decrypt_message(msg_criptografada, chave)
-            display_formatted_message(msg)
+            payload = decrypt_bytes(msg_criptografada, chave)
+            if payload is None:
+                print(ColorManager.error('\nMensagem recebida não pôde ser descriptografada'))
+                continue
+            display_formatted_message(envelope.decode(payload))
 
         except ConnectionResetError:
             if not stop_threads:
@@ -444,24 +467,22 @@ def receiveMessages(client, chave):
 
 
 
-def display_formatted_message(msg):
-    """Exibe mensagens formatadas com cores apropriadas"""
-    if msg.startswith('<'):
-        parts = msg.split('>', 1)
-        if len(parts) == 2:
-            print(ColorManager.user_msg(parts[0] + '>') + Style.NORMAL + parts[1])
-        else:
-            print(Style.BRIGHT + msg)
-    elif msg.startswith('[PM'):
-        print(ColorManager.private_msg(msg))
-    elif msg.startswith('[Sistema]'):
-        print(ColorManager.system(msg))
-    elif msg.startswith('[ANÚNCIO'):
-        print(ColorManager.announcement(msg))
-    elif msg.startswith('[Votação]'):
-        print(ColorManager.vote(msg))
-    else:
-        print(ColorManager.info(msg))
+# Um formatador por tipo de envelope (sem procurar prefixos no texto)
+MESSAGE_RENDERERS = {
+    envelope.KIND_CHAT: lambda env: ColorManager.user_msg(f"<{env.sender}>") + Style.NORMAL + f" {env.body}",
+    envelope.KIND_PRIVATE: lambda env: ColorManager.private_msg(f"[PM de {env.sender}] {env.body}"),
+    envelope.KIND_PRIVATE_SENT: lambda env: ColorManager.private_msg(f"[PM enviada para {env.sender}] {env.body}"),
+    envelope.KIND_SYSTEM: lambda env: ColorManager.system(f"[Sistema] {env.body}"),
+    envelope.KIND_JOIN: lambda env: ColorManager.user_msg(f"<{env.sender}>") + Style.NORMAL + " entrou no chat",
+    envelope.KIND_LEAVE: lambda env: ColorManager.user_msg(f"<{env.sender}>") + Style.NORMAL + f" {env.body or 'saiu do chat'}.",
+    envelope.KIND_ANNOUNCEMENT: lambda env: ColorManager.announcement(f"[ANÚNCIO DO ADMIN] {env.body}"),
+    envelope.KIND_VOTE: lambda env: ColorManager.vote(f"[Votação] {env.body}"),
+}
+
+def display_formatted_message(env):
+    """Exibe mensagens formatadas com cores apropriadas ao tipo do envelope"""
+    renderer = MESSAGE_RENDERERS.get(env.kind)
+    print(renderer(env) if renderer else ColorManager.info(env.body))
 
 
 
@@ -481,7 +502,7 @@ def sendMessages(client, chave):
                 break
             
             if msg.strip():
-                client.send(encrypt_message(msg, chave))
+                client.sendall(framing.encode(encrypt_message(msg, chave)))
                 
         except EOFError:
             print(Style.BRIGHT + "Input interrompido. Saindo...")
@@ -508,7 +529,7 @@ def handle_exit_command(client, chave):
     global stop_threads
     stop_threads = True
     try:
-        client.send(encrypt_message("/sair", chave))
+        client.sendall(framing.encode(encrypt_message("/sair", chave)))
     except:
         pass
 
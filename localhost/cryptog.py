@@ -9,10 +9,12 @@ def generate_key():#    Gera uma chave Fernet para criptografia simétrica
 
 
 
-def encrypt_message(message, key): #Criptografa uma mensagem de texto com a chave fornecida
+def encrypt_message(message, key): #Criptografa uma mensagem (texto ou bytes, ex: envelope) com a chave fornecida
     try:
         fernet = Fernet(key)
-        encrypted_message = fernet.encrypt(message.encode())
+        if isinstance(message, str):
+            message = message.encode()
+        encrypted_message = fernet.encrypt(message)
         return encrypted_message
     except Exception as e:
         print(f"[Erro] Falha na criptografia: {e}")
@@ -31,6 +33,15 @@ def decrypt_message(encrypted_message, key): #Descriptografa uma mensagem cripto
 
 
 
+def decrypt_bytes(encrypted_message, key): #Descriptografa e devolve os bytes (ex: envelope); None se falhar
+    try:
+        return Fernet(key).decrypt(encrypted_message)
+    except Exception as e:
+        print(f"[Erro] Falha na descriptografia: {e}")
+        return None
+
+
+
 def receive_messages(conn, key):  #Recebe mensagens do socket, descriptografa e imprime no terminal
     while True:
         try:
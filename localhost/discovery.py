@@ -0,0 +1,354 @@
+# discovery.py - Serviço local de descoberta de salas: heartbeats com TTL e push
+#
+# Cada processo servidor.py mantém uma conexão com o serviço e manda um
+# heartbeat com a porta e as salas públicas que hospeda (sala, nome, membros,
+# limite) a cada HEARTBEAT_INTERVAL segundos e logo que algo muda. As salas da
+# porta saem da lista quando a conexão cai (processo morto) ou quando ficam
+# ROOM_TTL segundos sem heartbeat (processo travado).
+# Os clientes pedem a lista com um único pedido ("list") ou assinam ("watch") e
+# recebem a lista nova a cada mudança, sem reler nada em disco.
+#
+# O primeiro servidor que não encontra o serviço sobe um embutido no
+# próprio processo; se esse processo sair, outro assume no próximo heartbeat.
+# Também dá para rodar à parte: python discovery.py
+#
+# Protocolo: frames (framing.py) com JSON. Pedidos: {"op": "heartbeat", "port",
+# "rooms": [{"room", "name", "members", "max"}]}, {"op": "remove", "port"},
+# {"op": "list"} e {"op": "watch"}. Respostas e pushes: {"version": n,
+# "rooms": [...]}, cada sala com a sua "port".
+
+import json
+import os
+import socket
+import threading
+import time
+
+import applog
+import framing
+from reactor import Reactor
+from scheduler import TimerScheduler
+
+DISCOVERY_HOST = 'localhost'
+DISCOVERY_PORT = int(os.environ.get("DISCOVERY_PORT", 49999))
+HEARTBEAT_INTERVAL = float(os.environ.get("HEARTBEAT_INTERVAL", 2.0))
+ROOM_TTL = float(os.environ.get("ROOM_TTL", 3 * HEARTBEAT_INTERVAL))
+REQUEST_TIMEOUT = 2.0
+WATCH_RETRY_MIN = 0.5   # backoff da reassinatura quando o serviço cai
+WATCH_RETRY_MAX = 5.0
+
+log = applog.get_logger("discovery")
+
+def encode_message(message):
+    return framing.encode(json.dumps(message).encode('utf-8'))
+
+# ========== SERVIÇO ==========
+class DiscoveryConnection:
+    """Uma conexão com o serviço: servidor mandando heartbeats, pedido de lista ou assinante"""
+    __slots__ = ("service", "conn", "decoder", "ports")
+
+    def __init__(self, service, conn):
+        self.service = service
+        self.conn = conn
+        self.decoder = framing.FrameDecoder(4096)
+        self.ports = set()   # portas (processos) anunciadas por esta conexão
+
+    def get_buffer(self):
+        return self.decoder.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.decoder.buffer_updated(nbytes)
+        try:
+            for frame in self.decoder.frames():
+                self.service.handle(self, json.loads(frame))
+        except (framing.FrameError, ValueError, KeyError, TypeError) as e:
+            log.warning("Pedido inválido de %s: %s", self.conn.addr, e)
+            self.conn.close()
+
+    def connection_lost(self):
+        self.service.disconnected(self)
+
+class DiscoveryService:
+    """Lista de salas viva; todo o estado é tocado só na thread do reactor"""
+
+    def __init__(self, host=DISCOVERY_HOST, port=DISCOVERY_PORT, ttl=ROOM_TTL):
+        self.host = host
+        self.port = port
+        self.ttl = ttl
+        self.rooms = {}       # porta -> salas do processo (lista do heartbeat)
+        self.expires = {}     # porta -> prazo (monotonic) do próximo heartbeat
+        self.watchers = set()
+        self.version = 0
+        self.push_pending = False
+        self.server = None
+        self.reactor = None
+        self.scheduler = TimerScheduler()
+
+    def start(self):
+        """Escuta na porta do serviço; OSError se outro processo já a ocupa"""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            server.bind((self.host, self.port))
+            server.listen()
+        except OSError:
+            server.close()
+            raise
+        self.server = server
+        self.reactor = Reactor(server, lambda conn: DiscoveryConnection(self, conn))
+        self.reactor.start()
+        self.scheduler.start()
+        self.scheduler.schedule(self.ttl / 2, self._sweep)
+        log.info("Serviço de descoberta ouvindo em %s:%s", self.host, self.port)
+
+    def stop(self):
+        self.scheduler.stop()
+        if self.reactor:
+            self.reactor.stop()
+        if self.server:
+            self.server.close()
+
+    def handle(self, client, request):
+        op = request["op"]
+        if op == "heartbeat":
+            port = int(request["port"])
+            rooms = [{"name": str(room["name"]), "port": port, "room": int(room["room"]),
+                      "members": int(room["members"]), "max": str(room["max"])}
+                     for room in request["rooms"]]
+            client.ports.add(port)
+            self.expires[port] = time.monotonic() + self.ttl
+            if self.rooms.get(port) != rooms:
+                self.rooms[port] = rooms
+                self._changed()
+        elif op == "remove":
+            port = int(request["port"])
+            client.ports.discard(port)
+            self._remove(port)
+        elif op == "list":
+            client.conn.sendall(encode_message(self.snapshot()))
+        elif op == "watch":
+            self.watchers.add(client)
+            client.conn.sendall(encode_message(self.snapshot()))
+        else:
+            raise ValueError(f"operação desconhecida: {op}")
+
+    def disconnected(self, client):
+        self.watchers.discard(client)
+        for port in client.ports:
+            self._remove(port)
+
+    def snapshot(self):
+        return {"version": self.version, "rooms": [room for rooms in self.rooms.values() for room in rooms]}
+
+    def _remove(self, port):
+        self.expires.pop(port, None)
+        if self.rooms.pop(port, None) is not None:
+            self._changed()
+
+    def _changed(self):
+        # Várias mudanças na mesma rodada do reactor viram um único push
+        self.version += 1
+        if not self.push_pending:
+            self.push_pending = True
+            self.reactor.call_soon(self._push)
+
+    def _push(self):
+        self.push_pending = False
+        if self.watchers:
+            frame = encode_message(self.snapshot())
+            for watcher in self.watchers:
+                watcher.conn.sendall(frame)
+
+    def _sweep(self):
+        # Thread do agendador: a expiração roda na thread do reactor, dona do estado
+        self.reactor.call_soon(self._expire)
+        self.scheduler.schedule(self.ttl / 2, self._sweep)
+
+    def _expire(self):
+        now = time.monotonic()
+        for port in [port for port, deadline in self.expires.items() if deadline < now]:
+            log.warning("Salas da porta %s sem heartbeat há %.0fs; removidas", port, self.ttl)
+            self._remove(port)
+
+_embedded = None
+_embedded_lock = threading.Lock()
+
+def ensure_service():
+    """Sobe o serviço embutido neste processo se a porta estiver livre; True se subiu agora"""
+    global _embedded
+    with _embedded_lock:
+        if _embedded is not None:
+            return False
+        service = DiscoveryService()
+        try:
+            service.start()
+        except OSError:
+            return False
+        _embedded = service
+        return True
+
+# ========== CLIENTES ==========
+def connect(timeout=REQUEST_TIMEOUT):
+    return socket.create_connection((DISCOVERY_HOST, DISCOVERY_PORT), timeout=timeout)
+
+def fetch_rooms(timeout=REQUEST_TIMEOUT):
+    """Lista atual ({"version", "rooms"}) num único pedido; None se o serviço não responder"""
+    try:
+        with connect(timeout) as sock:
+            sock.sendall(encode_message({"op": "list"}))
+            frame = framing.FrameReader(sock, 4096).read()
+    except (OSError, framing.FrameError):
+        return None
+    return json.loads(frame) if frame else None
+
+class RoomWatcher:
+    """Assina o serviço e chama on_change(snapshot) a cada lista nova (numa thread própria).
+    Se o serviço cair, reconecta com backoff e assina de novo: o serviço que assumir
+    recomeça a versão em 1, então a lista completa da nova assinatura vale sempre"""
+
+    def __init__(self, on_change, since_version=-1):
+        self.on_change = on_change
+        self.version = since_version
+        self.sock = None
+        self.lock = threading.Lock()   # stop() x reconexão disputam self.sock
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        try:
+            self.sock = self._subscribe()
+        except OSError:
+            return False
+        self.thread = threading.Thread(target=self._run, name="room-watcher", daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        self.stopped.set()
+        with self.lock:
+            if self.sock:
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                self.sock.close()
+
+    def _subscribe(self):
+        sock = connect()
+        sock.sendall(encode_message({"op": "watch"}))
+        sock.settimeout(None)
+        return sock
+
+    def _resubscribe(self):
+        """Nova assinatura com backoff; False se o watcher foi parado antes"""
+        delay = WATCH_RETRY_MIN
+        while not self.stopped.wait(delay):
+            try:
+                sock = self._subscribe()
+            except OSError:
+                delay = min(delay * 2, WATCH_RETRY_MAX)
+                continue
+            with self.lock:
+                if self.stopped.is_set():
+                    sock.close()
+                    return False
+                self.sock = sock
+            return True
+        return False
+
+    def _run(self):
+        fresh = False   # primeira lista de uma assinatura nova: a versão pode ter recomeçado
+        while True:
+            reader = framing.FrameReader(self.sock, 4096)
+            try:
+                while (frame := reader.read()) is not None:
+                    snapshot = json.loads(frame)
+                    if fresh or snapshot["version"] > self.version:
+                        fresh = False
+                        self.version = snapshot["version"]
+                        self.on_change(snapshot)
+            except (OSError, ValueError, framing.FrameError):
+                pass
+            with self.lock:
+                self.sock.close()
+                self.sock = None
+            if not self._resubscribe():
+                return
+            fresh = True
+
+class RoomAnnouncer:
+    """Heartbeats das salas públicas de um processo: a cada intervalo e logo depois de
+    notify(). list_rooms() devolve as salas atuais ({"room", "name", "members", "max"})"""
+
+    def __init__(self, port, list_rooms, interval=HEARTBEAT_INTERVAL):
+        self.port = port
+        self.list_rooms = list_rooms
+        self.interval = interval
+        self.changed = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="room-announcer", daemon=True)
+        self.thread.start()
+
+    def notify(self):
+        """Uma sala abriu, fechou ou mudou de contagem: manda o heartbeat agora"""
+        self.changed.set()
+
+    def stop(self):
+        self.running = False
+        self.changed.set()
+        if self.thread:
+            self.thread.join(timeout=REQUEST_TIMEOUT)
+
+    def _heartbeat(self):
+        return encode_message({"op": "heartbeat", "port": self.port, "rooms": self.list_rooms()})
+
+    def _connect(self):
+        """Conecta ao serviço; se ninguém está ouvindo, sobe um embutido e tenta de novo"""
+        for _ in range(2):
+            try:
+                return connect()
+            except OSError:
+                if ensure_service():
+                    log.info("Nenhum serviço de descoberta encontrado; hospedando um neste processo")
+        return None
+
+    def _run(self):
+        sock = None
+        while self.running:
+            if sock is None:
+                sock = self._connect()
+                if sock is None:
+                    self.changed.wait(self.interval)
+                    continue
+            try:
+                sock.sendall(self._heartbeat())
+            except OSError:
+                log.warning("Conexão com o serviço de descoberta perdida; reconectando")
+                sock.close()
+                sock = None
+                continue
+            self.changed.wait(self.interval)
+            self.changed.clear()
+
+        if sock is not None:
+            try:
+                sock.sendall(encode_message({"op": "remove", "port": self.port}))
+            except OSError:
+                pass
+            sock.close()
+
+# ========== PRINCIPAL ==========
+if __name__ == "__main__":
+    applog.setup()
+    service = DiscoveryService()
+    try:
+        service.start()
+    except OSError as e:
+        raise SystemExit(f"Porta {DISCOVERY_PORT} ocupada (outro serviço de descoberta?): {e}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        service.stop()
@@ -0,0 +1,106 @@
+# framing.py - Frames com prefixo de tamanho para o protocolo TCP do chat local
+#
+# Cada mensagem vai como 4 bytes de tamanho (big-endian) seguidos do conteúdo,
+# então não importa como o TCP junta ou corta os bytes: um recv pode trazer
+# meio frame ou dezenas deles. O FrameDecoder lê direto num bytearray
+# reaproveitado (recv_into sobre um memoryview) e devolve todos os frames
+# completos de uma vez, sem concatenar bytes a cada leitura.
+
+import struct
+
+HEADER = struct.Struct("!I")
+MAX_FRAME = 1024 * 1024   # frames maiores derrubam a conexão (cliente quebrado ou malicioso)
+BUFFER_SIZE = 64 * 1024   # tamanho inicial do buffer de leitura
+MIN_READ = 4096           # espaço livre mínimo por recv_into antes de compactar (no máximo 1/4 do buffer)
+
+class FrameError(ValueError):
+    pass
+
+def encode(payload):
+    """Um frame: tamanho + conteúdo"""
+    if len(payload) > MAX_FRAME:
+        raise FrameError(f"Frame de {len(payload)} bytes excede o limite de {MAX_FRAME}")
+    return HEADER.pack(len(payload)) + payload
+
+def encode_many(payloads):
+    """Vários frames num só bloco, para um único send()"""
+    return b"".join(encode(payload) for payload in payloads)
+
+class FrameDecoder:
+    """Parser incremental: acumula bytes num buffer reutilizável e separa os frames"""
+
+    def __init__(self, size=BUFFER_SIZE, max_frame=MAX_FRAME):
+        self.max_frame = max_frame
+        self.min_read = min(MIN_READ, size // 4)
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0   # primeiro byte ainda não consumido
+        self.end = 0     # fim dos dados válidos
+
+    def get_buffer(self):
+        """Espaço livre do buffer para um recv_into (compacta ou cresce se preciso)"""
+        if len(self.buffer) - self.end < self.min_read:
+            pendente = self.end - self.start
+            if len(self.buffer) - pendente < self.min_read:
+                # Um frame maior que o buffer: troca por um com o dobro do tamanho
+                novo = bytearray(len(self.buffer) * 2)
+                novo[:pendente] = self.view[self.start:self.end]
+                self.buffer = novo
+                self.view = memoryview(novo)
+            else:
+                self.view[:pendente] = self.view[self.start:self.end]
+            self.start, self.end = 0, pendente
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+
+    def feed(self, data):
+        """Acrescenta bytes já lidos (quando não dá para usar recv_into)"""
+        while data:
+            livre = self.get_buffer()
+            n = min(len(livre), len(data))
+            livre[:n] = data[:n]
+            self.buffer_updated(n)
+            data = data[n:]
+
+    def recv_from(self, sock):
+        """Um recv_into do socket direto no buffer; devolve o número de bytes (0 = fim)"""
+        nbytes = sock.recv_into(self.get_buffer())
+        self.buffer_updated(nbytes)
+        return nbytes
+
+    def frames(self):
+        """Devolve (e consome) todos os frames completos já recebidos"""
+        frames = []
+        start, end = self.start, self.end
+        while end - start >= HEADER.size:
+            (tamanho,) = HEADER.unpack_from(self.buffer, start)
+            if tamanho > self.max_frame:
+                raise FrameError(f"Frame de {tamanho} bytes excede o limite de {self.max_frame}")
+            fim = start + HEADER.size + tamanho
+            if fim > end:
+                break
+            frames.append(bytes(self.view[start + HEADER.size:fim]))
+            start = fim
+        if start == end:
+            start = end = 0   # buffer vazio: volta ao início sem copiar nada
+        self.start, self.end = start, end
+        return frames
+
+class FrameReader:
+    """Leitura bloqueante de um frame por vez (threads e cliente de terminal)"""
+
+    def __init__(self, sock, size=BUFFER_SIZE, max_frame=MAX_FRAME):
+        self.sock = sock
+        self.decoder = FrameDecoder(size, max_frame)
+        self.ready = []
+
+    def read(self):
+        """Próximo frame; None se a conexão fechou"""
+        while not self.ready:
+            if not self.decoder.recv_from(self.sock):
+                return None
+            self.ready = self.decoder.frames()
+            self.ready.reverse()
+        return self.ready.pop()
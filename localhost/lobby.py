@@ -0,0 +1,161 @@
+# lobby.py - Lobby das salas públicas em SQLite (modo WAL)
+#
+# Cada sala é um processo servidor.py separado e todos escrevem no mesmo lobby.
+# Com o lobby.json, cada entrada/saída relia e regravava o arquivo inteiro, e o
+# lobby_lock só valia dentro de um processo: duas salas atualizando ao mesmo
+# tempo perdiam contagens. Aqui cada sala é uma linha com a porta como chave
+# primária (índice), entradas e saídas são um UPDATE atômico de uma linha, e o
+# WAL deixa o cliente listar as salas enquanto os servidores escrevem.
+#
+# Um processo servidor.py hospeda várias salas atrás de uma única porta, então a
+# chave é (porta, sala). Um lobby.db antigo (uma sala por porta) é recriado na
+# primeira conexão dos servidores: as linhas são só espelho de processos vivos.
+# Quem só lista (o cliente) usa uma conexão somente leitura, que nunca migra:
+# com um lobby de outra versão a lista fica vazia até um servidor recriá-lo.
+#
+# As escritas do servidor passam pelo LobbyWriter: uma fila servida por uma
+# thread própria, para o reactor nunca esperar o disco ou o lock de escrita de
+# outro processo (até BUSY_TIMEOUT).
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+import applog
+
+log = applog.get_logger("lobby")
+
+LOBBY_DB = os.environ.get("LOBBY_DB", "lobby.db")
+BUSY_TIMEOUT = 5.0   # segundos esperando o lock de escrita de outro processo
+
+SCHEMA_VERSION = 2   # PRAGMA user_version; 2 = chave (porta, sala)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rooms (
+    port        INTEGER NOT NULL,
+    room        INTEGER NOT NULL,
+    name        TEXT    NOT NULL,
+    members     INTEGER NOT NULL DEFAULT 0,
+    max_members TEXT    NOT NULL,
+    created     REAL    NOT NULL,
+    PRIMARY KEY (port, room)
+)
+"""
+
+class LobbyStore:
+    """Salas públicas (porta -> nome, membros, limite); uma conexão por processo"""
+
+    def __init__(self, path=LOBBY_DB):
+        self.path = path
+        self.db = None
+        self.reader = None   # conexão somente leitura do list_rooms
+        self.lock = threading.Lock()   # a conexão é compartilhada entre as threads do processo
+
+    def _connect(self):
+        if self.db is None:
+            # Autocommit: cada comando é sua própria transação atômica
+            self.db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                      check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self._migrate()
+        return self.db
+
+    def _migrate(self):
+        # BEGIN IMMEDIATE: dois processos abrindo um lobby antigo não recriam a tabela juntos
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            if self.db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                self.db.execute("DROP TABLE IF EXISTS rooms")
+                self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.db.execute(SCHEMA)
+            self.db.execute("COMMIT")
+        except sqlite3.Error:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def _connect_reader(self):
+        if self.reader is None:
+            uri = "file:" + urllib.parse.quote(os.path.abspath(self.path)) + "?mode=ro"
+            self.reader = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                          check_same_thread=False)
+        return self.reader
+
+    def close(self):
+        with self.lock:
+            for db in (self.db, self.reader):
+                if db is not None:
+                    db.close()
+            self.db = self.reader = None
+
+    def add_room(self, name, port, room, max_members):
+        """Registra a sala; uma linha antiga com a mesma chave é de um servidor que já
+        morreu, então é substituída"""
+        with self.lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO rooms (port, room, name, members, max_members, created) VALUES (?, ?, ?, 0, ?, ?)",
+                (port, room, name, str(max_members), time.time()))
+
+    def remove_room(self, port, room):
+        with self.lock:
+            self._connect().execute("DELETE FROM rooms WHERE port = ? AND room = ?", (port, room))
+
+    def clear_port(self, port):
+        """Apaga as salas de uma porta; chamado logo depois do bind dar certo, quando
+        qualquer linha dessa porta é de um servidor que já morreu"""
+        with self.lock:
+            self._connect().execute("DELETE FROM rooms WHERE port = ?", (port,))
+
+    def update_count(self, port, room, delta):
+        """Soma delta aos membros da sala numa única linha (sem ler o lobby inteiro)"""
+        with self.lock:
+            self._connect().execute("UPDATE rooms SET members = MAX(0, members + ?) WHERE port = ? AND room = ?",
+                                    (delta, port, room))
+
+    def list_rooms(self):
+        """Salas na ordem de criação, no formato do antigo lobby.json; [] se ainda não há lobby
+        ou se ele é de outra versão (só leitura: não cria nem migra nada)"""
+        if not os.path.exists(self.path):
+            return []
+        with self.lock:
+            db = self._connect_reader()
+            if db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                return []
+            rows = db.execute(
+                "SELECT name, port, room, members, max_members FROM rooms ORDER BY created").fetchall()
+        return [{"name": name, "port": port, "room": room, "members": members, "max": max_members}
+                for name, port, room, members, max_members in rows]
+
+class LobbyWriter:
+    """Escritas do lobby em ordem, numa thread própria; quem chama só enfileira"""
+
+    def __init__(self, store):
+        self.store = store
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="lobby-writer", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Grava o que ainda está na fila e encerra a thread"""
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join(timeout=BUSY_TIMEOUT + 1)
+            self.thread = None
+
+    def submit(self, what, method, *args):
+        """Enfileira method(*args); what descreve a operação no log de erro"""
+        self.queue.put((what, method, args))
+
+    def _run(self):
+        while (job := self.queue.get()) is not None:
+            what, method, args = job
+            try:
+                method(*args)
+            except sqlite3.Error as e:
+                log.error("Falha ao %s: %s", what, e)
@@ -0,0 +1,287 @@
+# reactor.py - Núcleo orientado a eventos (selectors) do servidor local
+#
+# Uma única thread atende todos os sockets: aceita conexões, lê o que chegou
+# (recv_into direto no buffer do handler) e escreve o que ficou pendente, sem
+# uma thread (e uma pilha) por cliente.
+# Connection imita a parte do socket que o servidor usa (send/close), mas send()
+# nunca bloqueia: o que não couber no buffer do kernel vai para uma fila de saída
+# escrita quando o socket voltar a aceitar dados. Outras threads (admin, timers)
+# podem chamar send()/close(); mudanças no selector passam pela fila do reactor.
+#
+# O que os handlers enviam na própria thread do reactor não vai direto para o
+# socket: fica na fila e é escrito no fim da rodada do loop. Com a sala cheia,
+# as N mensagens que chegaram numa rodada saem num único send() por cliente, em
+# vez de N syscalls por cliente.
+
+import collections
+import os
+import selectors
+import socket
+import threading
+
+import applog
+
+OUTBOX_LIMIT = int(os.environ.get("OUTBOX_LIMIT", 1024 * 1024))  # bytes pendentes antes de derrubar um cliente lento
+ACCEPT_BATCH = 64  # accept() por evento do socket de escuta
+FLUSH_CHUNK = 64 * 1024  # mensagens pequenas da fila são juntadas num send() de até ~64 KiB
+
+log = applog.get_logger("reactor")
+
+class Connection:
+    """Socket não bloqueante de um cliente, com fila de saída própria"""
+    __slots__ = ("sock", "addr", "reactor", "handler", "outbox", "pending", "lock", "state", "writing")
+
+    def __init__(self, reactor, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.reactor = reactor
+        self.handler = None
+        self.outbox = collections.deque()
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.state = "open"   # open -> closing -> closed
+        self.writing = False  # EVENT_WRITE registrado (só a thread do reactor mexe)
+
+    def send(self, data):
+        """Escreve o que couber agora e enfileira o resto; nunca bloqueia"""
+        with self.lock:
+            if self.state != "open":
+                return 0
+            if threading.get_ident() == self.reactor.ident:
+                # Na thread do reactor: enfileira e escreve no fim da rodada
+                if not self.outbox:
+                    self.reactor.dirty.append(self)
+            elif not self.outbox:
+                try:
+                    sent = self.sock.send(data)
+                except BlockingIOError:
+                    sent = 0
+                except OSError:
+                    self._abort()
+                    return 0
+                if sent == len(data):
+                    return sent
+                data = data[sent:]
+                self.reactor.call_soon(self.reactor._want_write, self)
+            self.outbox.append(data)
+            self.pending += len(data)
+            if self.pending > self.reactor.outbox_limit:
+                log.warning("Cliente %s não acompanha a sala (%d bytes pendentes); desconectando",
+                            self.addr, self.pending)
+                self._abort()
+        return len(data)
+
+    sendall = send   # a fila aceita tudo: send() já tem a semântica de sendall()
+
+    def close(self):
+        """Fecha depois de entregar ao kernel o que já estava na fila (ex: o aviso de kick)"""
+        with self.lock:
+            if self.state != "open":
+                return
+            self.state = "closing"
+        self.reactor.call_soon(self.reactor._close, self, True)
+
+    def _abort(self):
+        # Chamado com o lock: descarta a fila e deixa o reactor fechar
+        self.state = "closing"
+        self.outbox.clear()
+        self.pending = 0
+        self.reactor.call_soon(self.reactor._close, self)
+
+    def _flush(self):
+        """Escreve o que der da fila (com o lock); True se ela esvaziou"""
+        while self.outbox:
+            chunk = self.outbox.popleft()
+            if self.outbox and len(chunk) < FLUSH_CHUNK:
+                partes = [chunk]
+                tamanho = len(chunk)
+                while self.outbox and tamanho < FLUSH_CHUNK:
+                    parte = self.outbox.popleft()
+                    partes.append(parte)
+                    tamanho += len(parte)
+                chunk = b"".join(partes)
+            try:
+                sent = self.sock.send(chunk)
+            except BlockingIOError:
+                sent = 0
+            self.pending -= sent
+            if sent < len(chunk):
+                self.outbox.appendleft(chunk[sent:])
+                return False
+        return True
+
+class Reactor:
+    """Loop de selectors numa thread; on_accept(conn) devolve o handler da conexão
+    (ou None para só fechar), um objeto com get_buffer() -> memoryview gravável,
+    buffer_updated(nbytes) e connection_lost()"""
+
+    def __init__(self, server, on_accept, outbox_limit=OUTBOX_LIMIT):
+        self.server = server
+        self.on_accept = on_accept
+        self.outbox_limit = outbox_limit
+        self.selector = selectors.DefaultSelector()
+        self.connections = set()
+        self.calls = collections.deque()
+        self.dirty = []   # conexões com fila a escrever no fim da rodada
+        self.ident = None
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        self.server.setblocking(False)
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ, "accept")
+        self.selector.register(self.wake_r, selectors.EVENT_READ, "wake")
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="reactor", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Encerra o loop e fecha todas as conexões (sem connection_lost)"""
+        self.running = False
+        self._wake()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def call_soon(self, callback, *args):
+        """Agenda callback(*args) na thread do reactor; pode ser chamado de qualquer thread"""
+        self.calls.append((callback, args))
+        if threading.get_ident() != self.ident:
+            self._wake()
+
+    def _wake(self):
+        try:
+            self.wake_w.send(b"\0")
+        except OSError:
+            pass  # buffer cheio: o reactor já tem um despertar pendente
+
+    def _run(self):
+        self.ident = threading.get_ident()
+        try:
+            while self.running:
+                for key, mask in self.selector.select():
+                    if key.data == "accept":
+                        self._accept()
+                    elif key.data == "wake":
+                        self._drain_wake()
+                    else:
+                        if mask & selectors.EVENT_WRITE:
+                            self._write(key.data)
+                        if mask & selectors.EVENT_READ:
+                            self._read(key.data)
+                while self.calls:
+                    callback, args = self.calls.popleft()
+                    try:
+                        callback(*args)
+                    except Exception as e:
+                        log.error("Erro em chamada agendada no reactor: %s", e)
+                dirty, self.dirty = self.dirty, []
+                for conn in dirty:
+                    self._write(conn)
+        except Exception as e:
+            log.error("Loop de eventos encerrado inesperadamente: %s", e)
+        finally:
+            for conn in list(self.connections):
+                self._close(conn, notify=False)
+            self.selector.close()
+            self.wake_r.close()
+            self.wake_w.close()
+
+    def _drain_wake(self):
+        try:
+            while self.wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _accept(self):
+        for _ in range(ACCEPT_BATCH):
+            try:
+                sock, addr = self.server.accept()
+            except BlockingIOError:
+                return
+            except OSError as e:
+                log.error("Falha no accept: %s", e)
+                return
+            sock.setblocking(False)
+            # O reactor já junta as escritas de cada rodada; o Nagle só atrasaria a próxima
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = Connection(self, sock, addr)
+            self.connections.add(conn)
+            self.selector.register(sock, selectors.EVENT_READ, conn)
+            try:
+                conn.handler = self.on_accept(conn)
+            except Exception as e:
+                log.error("Erro ao aceitar %s: %s", addr, e)
+                self._close(conn, notify=False)
+
+    def _read(self, conn):
+        if conn.state == "closed":
+            return
+        handler = conn.handler if conn.state == "open" else None
+        try:
+            if handler is not None:
+                nbytes = conn.sock.recv_into(handler.get_buffer())
+            else:
+                nbytes = len(conn.sock.recv(4096))   # já está fechando: descarta
+        except BlockingIOError:
+            return
+        except OSError:
+            nbytes = 0
+        if not nbytes:
+            self._close(conn)
+        elif handler is not None:
+            try:
+                handler.buffer_updated(nbytes)
+            except Exception as e:
+                log.error("Erro tratando dados de %s: %s", conn.addr, e)
+                self._close(conn)
+
+    def _want_write(self, conn):
+        with conn.lock:
+            if conn.state != "closed" and conn.outbox and not conn.writing:
+                conn.writing = True
+                self.selector.modify(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, conn)
+
+    def _write(self, conn):
+        with conn.lock:
+            if conn.state == "closed":
+                return
+            try:
+                drained = conn._flush()
+            except OSError:
+                drained = None
+            # Só espera EVENT_WRITE enquanto sobrar algo que o kernel não aceitou
+            if drained is False and not conn.writing:
+                conn.writing = True
+                self.selector.modify(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, conn)
+            elif drained and conn.writing:
+                conn.writing = False
+                self.selector.modify(conn.sock, selectors.EVENT_READ, conn)
+        if drained is None:
+            self._close(conn)
+
+    def _close(self, conn, flush=False, notify=True):
+        with conn.lock:
+            if conn.state == "closed":
+                return
+            if flush:
+                try:
+                    conn._flush()
+                except OSError:
+                    pass
+            conn.state = "closed"
+            conn.outbox.clear()
+        self.connections.discard(conn)
+        try:
+            self.selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+        if notify and conn.handler is not None:
+            try:
+                conn.handler.connection_lost()
+            except Exception as e:
+                log.error("Erro ao encerrar %s: %s", conn.addr, e)
@@ -0,0 +1,85 @@
+# scheduler.py - Agendador de timers (heap + uma thread) para o servidor local
+#
+# Fim de mute, prazo de votação e outros estados com tempo são agendados aqui em
+# vez de conferidos com time.time() a cada mensagem. Cada timer dispara no
+# máximo uma vez: cancel() e o disparo disputam o mesmo lock, e só um vence.
+# As callbacks rodam na thread do agendador e devem ser curtas.
+
+import heapq
+import itertools
+import threading
+import time
+
+import applog
+
+log = applog.get_logger("timers")
+
+class Timer:
+    """Um disparo agendado; cancel() depois do disparo não tem efeito"""
+    __slots__ = ("deadline", "callback", "args", "state")
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.state = "pending"   # pending -> fired | cancelled
+
+class TimerScheduler:
+    """Heap de timers por prazo (monotonic), servido por uma thread daemon"""
+
+    def __init__(self):
+        self.heap = []
+        self.ids = itertools.count()   # desempate estável para prazos iguais
+        self.cond = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name="timers", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread:
+            self.thread.join(timeout=2)
+
+    def schedule(self, delay, callback, *args):
+        """Chama callback(*args) daqui a delay segundos; devolve o Timer"""
+        timer = Timer(time.monotonic() + delay, callback, args)
+        with self.cond:
+            heapq.heappush(self.heap, (timer.deadline, next(self.ids), timer))
+            # Só acorda a thread se o novo timer passou a ser o primeiro da fila
+            if self.heap[0][2] is timer:
+                self.cond.notify()
+        return timer
+
+    def cancel(self, timer):
+        """True se o timer foi cancelado antes de disparar (remoção preguiçosa do heap)"""
+        with self.cond:
+            if timer is None or timer.state != "pending":
+                return False
+            timer.state = "cancelled"
+            return True
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and (not self.heap or self.heap[0][0] > time.monotonic()):
+                    timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+                    self.cond.wait(timeout)
+                if not self.running:
+                    return
+                _, _, timer = heapq.heappop(self.heap)
+                if timer.state != "pending":
+                    continue
+                timer.state = "fired"
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                log.error("Erro em timer %s: %s", getattr(timer.callback, "__name__", timer.callback), e)
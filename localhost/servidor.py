@@ -1,67 +1,122 @@
 import threading
 import socket
-import json
 import os
 import time
 import datetime
-#from cryptog import generate_key, encrypt_message, decrypt_message #usar funções de criptografia
+import itertools
+from cryptog import generate_key, encrypt_message, decrypt_message #usar funções de criptografia
+import envelope #envelope tipado das mensagens servidor -> cliente
+import applog #log em fila, escrito por uma thread própria
+from scheduler import TimerScheduler #fim de mute e prazo de votação por timer
+from reactor import Reactor #núcleo orientado a eventos (selectors)
+import framing #frames com prefixo de tamanho no TCP
+from lobby import LobbyStore, LobbyWriter #lobby das salas públicas em SQLite (WAL)
+from discovery import RoomAnnouncer #heartbeats para o serviço de descoberta
 from colorama import init, Fore, Style #colocar Cores 
 
 
 # Inicialização do colorama
 init(autoreset=True)
+log = applog.setup()
 
 
 # ========== CONFIGURAÇÕES ==========
-LOBBY_FILE = 'lobby.json'
 PRIVATE_LOG_FILE = 'private_rooms.log'
 SERVER_HOST = 'localhost'
 BUFFER_SIZE = 2048
 PROTOCOL_TIMEOUT = 10.0
+VOTE_TIMEOUT = float(os.environ.get("VOTE_TIMEOUT", 120))  # segundos até uma votação sem resultado expirar
+SERVER_ENGINE = os.environ.get("SERVER_ENGINE", "selectors")  # "selectors" ou "threads" (uma thread por cliente)
 
 
 # ========== GERENCIADOR DE CORES ========== (Padronização das cores usadas no terminal)
+def paint(style, msg):
+    """Aplica a cor só quando a saída é um terminal"""
+    return style + msg if applog.color_enabled else msg
+
 class ColorManager:
     @staticmethod
     def system(msg):
-        return Fore.MAGENTA + Style.BRIGHT + msg
+        return paint(Fore.MAGENTA + Style.BRIGHT, msg)
     
     @staticmethod
     def error(msg):
-        return Fore.RED + msg
+        return paint(Fore.RED, msg)
     
     @staticmethod
     def success(msg):
-        return Fore.GREEN + msg
+        return paint(Fore.GREEN, msg)
     
     @staticmethod
     def warning(msg):
-        return Fore.YELLOW + msg
+        return paint(Fore.YELLOW, msg)
     
     @staticmethod
     def info(msg):
-        return Fore.CYAN + msg
+        return paint(Fore.CYAN, msg)
     
     @staticmethod
     def announcement(msg):
-        return Fore.CYAN + Style.BRIGHT + msg
+        return paint(Fore.CYAN + Style.BRIGHT, msg)
 
 
+# ========== ESTADO GLOBAL ==========
+class ClientState:
+    """Estado de um cliente conectado; __slots__ evita um dict por conexão"""
+    __slots__ = ("username", "pm_blocked", "last_msg_time", "msg_count", "infractions", "muted_until")
 
+    def __init__(self, username):
+        self.username = username
+        self.pm_blocked = False
+        self.last_msg_time = time.time()
+        self.msg_count = 0
+        self.infractions = 0
+        self.muted_until = None  # prazo do mute (inf = permanente); o timer volta para None
 
-# ========== ESTADO GLOBAL ==========
-lobby_lock = threading.RLock()
-clients = {}
-clients_lock = threading.Lock()
-mute_list = {}
-mute_lock = threading.Lock()
 
-room_state = {
-    "vote_in_progress": False, "vote_type": None, "vote_target_user": None,
-    "vote_target_socket": None, "votes_for": set(), "votes_against": set(),
-    "voters": set()
-}
-room_state_lock = threading.RLock()
+
+def new_vote_state():
+    return {
+        "vote_in_progress": False, "vote_type": None, "vote_target_user": None,
+        "vote_target_socket": None, "votes_for": set(), "votes_against": set(),
+        "voters": set(), "vote_id": 0, "vote_timer": None
+    }
+
+class Room:
+    """Uma sala hospedada neste processo. Clientes, mutes e votação ficam na sala,
+    cada um com seu lock: salas diferentes nunca disputam o mesmo lock"""
+    __slots__ = ("id", "name", "password", "key", "port", "max_members", "is_public",
+                 "clients", "usernames", "clients_lock", "mute_list", "mute_lock",
+                 "state", "state_lock", "message_seq")
+
+    def __init__(self, room_id, name, password, port, max_members):
+        self.id = room_id
+        self.name = name
+        self.password = password          # None nas salas públicas
+        self.key = generate_key()         # cada sala cifra com a sua chave
+        self.port = port
+        self.max_members = max_members    # inf = ilimitado
+        self.is_public = password is None
+        self.clients = {}
+        self.usernames = {}  # nome em casefold -> socket, protegido por clients_lock
+        self.clients_lock = threading.Lock()
+        self.mute_list = {}  # nome em minúsculas -> (mute_until, timer)
+        self.mute_lock = threading.Lock()
+        self.state = new_vote_state()
+        self.state_lock = threading.RLock()
+        self.message_seq = itertools.count(1)  # número de sequência das mensagens de chat
+
+    def max_members_display(self):
+        return 'N/A' if self.max_members == float('inf') else str(self.max_members)
+
+lobby = LobbyStore()
+lobby_writer = LobbyWriter(lobby)  # escritas do lobby numa thread própria, fora do reactor
+announcer = None  # heartbeats das salas públicas para o serviço de descoberta
+rooms = {}  # id da sala -> Room
+rooms_lock = threading.Lock()  # só abre/fecha/procura salas; o resto usa os locks de cada sala
+room_ids = itertools.count(1)
+scheduler = TimerScheduler()
+vote_ids = itertools.count(1)
 
 
 
@@ -79,116 +134,141 @@ def validate_username(username):
 
 
 # ========== OPERAÇÕES DO LOBBY ==========
-def read_lobby(): #Lê a lista de servidores do arquivo do lobby
-    with lobby_lock:
-        if not os.path.exists(LOBBY_FILE):
-            return []
-        try:
-            with open(LOBBY_FILE, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            return []
+def public_rooms():
+    """Salas públicas abertas, no formato do heartbeat da descoberta"""
+    with rooms_lock:
+        public = [room for room in rooms.values() if room.is_public]
+    return [{"room": room.id, "name": room.name, "members": len(room.clients),
+             "max": room.max_members_display()} for room in public]
 
 
 
-def write_lobby(servers):#Escreve a lista de servidores no arquivo do lobby
-    with lobby_lock:
-        try:
-            with open(LOBBY_FILE, 'w') as f:
-                json.dump(servers, f, indent=4)
-        except IOError as e:
-            print(ColorManager.error(f"[Erro] Falha ao escrever no lobby: {e}"))
+def add_server_to_lobby(room):#Adiciona uma nova sala ao lobby
+    global announcer
+    if announcer is None:
+        # Um anunciador por processo, com todas as salas públicas no mesmo heartbeat
+        announcer = RoomAnnouncer(room.port, public_rooms)
+        announcer.start()
+    announcer.notify()
+    lobby_writer.submit("registrar a sala no lobby", lobby.add_room,
+                        room.name, room.port, room.id, room.max_members_display())
 
 
 
-def add_server_to_lobby(name, port, max_members):#Adiciona um novo servidor ao lobby
-    servers = read_lobby()
-    if any(s['port'] == port for s in servers):
-        print(ColorManager.warning(f"Porta {port} já está listada. Ignorando"))
-        return
-    
-    servers.append({
-        "name": name, 
-        "port": port, 
-        "members": 0, 
-        "max": max_members
-    })
-    write_lobby(servers)
+def remove_server_from_lobby(room):#     Remove uma sala do lobby
+    if announcer:
+        announcer.notify()  # o próximo heartbeat já vai sem a sala
+    lobby_writer.submit("remover a sala do lobby", lobby.remove_room, room.port, room.id)
+    log.info("Sala %s da porta %s removida do lobby.", room.id, room.port)
 
 
 
-def remove_server_from_lobby(port):#     Remove um servidor do lobby
-    with lobby_lock:
-        servers = read_lobby()
-        new_servers = [s for s in servers if int(s.get('port', 0)) != port]
-        write_lobby(new_servers)
-    
-    print(ColorManager.info(f"Servidor da porta {port} removido do lobby."))
+def update_lobby_count(room, delta):# Atualiza o número de membros de uma sala no lobby (uma linha)
+    if announcer:
+        announcer.notify()  # heartbeat imediato com a contagem nova
+    lobby_writer.submit("atualizar o lobby", lobby.update_count, room.port, room.id, delta)
 
 
 
-def update_lobby_count(port, delta):# Atualiza o número de membros de um servidor no lobby
-    with lobby_lock:
-        servers = read_lobby()
-        lobby_updated = False
-        
-        for server in servers:
-            if int(server.get('port', 0)) == port:
-                current_members = server.get('members', 0)
-                if not isinstance(current_members, int): 
-                    current_members = 0
-                server['members'] = max(0, current_members + delta)
-                lobby_updated = True
-                break
-        
-        if lobby_updated:
-            write_lobby(servers)
-
-
-
-def log_private_room(port, password): # Registra a criação de uma sala privada
+def log_private_room(room): # Registra a criação de uma sala privada
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = f"[{timestamp}] Private Room Created - Port: {port}, Password: {password}\n"
+    log_entry = f"[{timestamp}] Private Room Created - Port: {room.port}, Room: {room.id}, Password: {room.password}\n"
     
     try:
         with open(PRIVATE_LOG_FILE, 'a') as f:
             f.write(log_entry)
     except Exception as e:
-        print(ColorManager.error(f"Falha ao escrever no log privado: {e}"))
+        log.error("Falha ao escrever no log privado: %s", e)
+
+
+
+
+# ========== OPERAÇÕES DE SALAS ==========
+def open_room(name, password, port, max_members):
+    """Cria a sala e a coloca no registro; a partir daqui o handshake já a encontra"""
+    room = Room(next(room_ids), name, password, port, max_members)
+    with rooms_lock:
+        rooms[room.id] = room
+    if room.is_public:
+        add_server_to_lobby(room)
+    else:
+        log_private_room(room)
+    return room
+
+
+
+def find_room(room_id):
+    with rooms_lock:
+        return rooms.get(room_id)
+
+
+
+def close_room(room):
+    """Fecha uma sala: sai do registro (novas conexões recebem FAIL_ROOM), derruba os
+    clientes e cancela os timers dela. As outras salas do processo continuam"""
+    with rooms_lock:
+        if rooms.pop(room.id, None) is None:
+            return
+    if room.is_public:
+        remove_server_from_lobby(room)
+
+    with room.clients_lock:
+        for client_socket in list(room.clients.keys()):
+            client_socket.close()
+        room.clients.clear()
+        room.usernames.clear()
+
+    with room.mute_lock:
+        for _, timer in room.mute_list.values():
+            scheduler.cancel(timer)
+        room.mute_list.clear()
+
+    reset_vote_state(room)
 
 
 
 
 # ========== OPERAÇÕES DE CLIENTES ==========
-def find_user_by_name(username):
-    """Encontra um usuário pelo nome (case-insensitive)"""
-    with clients_lock:
-        for sock, data in clients.items():
-            if data["username"].lower() == username.lower():
-                return sock, data
+def find_user_by_name(room, username):
+    """Encontra um usuário pelo nome (case-insensitive) em O(1) pelo índice"""
+    with room.clients_lock:
+        sock = room.usernames.get(username.casefold())
+        if sock is not None:
+            return sock, room.clients[sock]
     return None, None
 
 
 
-def send_system_message(client_socket, message, CHAVE):
-    """Envia uma mensagem do sistema para um cliente específico"""
+def send_frame(client_socket, payload):
+    """Envia um frame inteiro (tamanho + conteúdo) para um cliente"""
+    client_socket.sendall(framing.encode(payload))
+
+
+
+def send_envelope(client_socket, kind, body, CHAVE, sender=""):
+    """Cifra um envelope e o envia para um cliente específico"""
     try:
-        #encrypted_msg = encrypt_message(f"[Sistema] {message}", CHAVE)
-        client_socket.send()
+        send_frame(client_socket, encrypt_message(envelope.encode(kind, body, sender), CHAVE))
     except (OSError, ConnectionError):
         pass  # Cliente desconectado
 
 
 
-def kick_user(username, CHAVE, reason="foi expulso"):
+def send_system_message(client_socket, message, CHAVE):
+    """Envia uma mensagem do sistema para um cliente específico"""
+    send_envelope(client_socket, envelope.KIND_SYSTEM, message, CHAVE)
+
+
+
+def kick_user(room, username, reason="foi expulso"):
     """Expulsa um usuário da sala"""
-    socket_to_kick, user_data = find_user_by_name(username)
+    socket_to_kick, user_data = find_user_by_name(room, username)
     if socket_to_kick:
-        actual_username = user_data["username"]
+        actual_username = user_data.username
         print(ColorManager.info(f"Expulsando {actual_username}..."))
         
         try:
-            socket_to_kick.send((f"Você {reason}.", CHAVE))
+            send_system_message(socket_to_kick, f"Você {reason}.", room.key)
             socket_to_kick.close()
         except (OSError, ConnectionError):
             pass
@@ -198,7 +278,7 @@ def kick_user(username, CHAVE, reason="foi expulso"):
 
 
 
-def mute_user(username, CHAVE, minutes=0):
+def mute_user(room, username, minutes=0):
     """Silencia um usuário por um período determinado"""
     username_lower = username.lower()
     mute_until = float('inf') if minutes <= 0 else time.time() + (minutes * 60)
@@ -207,103 +287,130 @@ def mute_user(username, CHAVE, minutes=0):
     admin_msg = f"Silenciando {username} {duration_msg}."
     user_msg = f"Você foi silenciado {duration_msg}."
 
-    with mute_lock:
-        mute_list[username_lower] = mute_until
+    target_socket, user_data = find_user_by_name(room, username)
+
+    # Flag e timer mudam sob o mesmo lock, para o disparo não limpar o flag antes de ele ser ligado
+    with room.mute_lock:
+        _, old_timer = room.mute_list.get(username_lower, (None, None))
+        scheduler.cancel(old_timer)
+        timer = None if minutes <= 0 else scheduler.schedule(minutes * 60, expire_mute, room, username, mute_until)
+        room.mute_list[username_lower] = (mute_until, timer)
+        if user_data:
+            user_data.muted_until = mute_until
     
     print(ColorManager.info(admin_msg))
     
-    target_socket, _ = find_user_by_name(username)
     if target_socket:
-        send_system_message(target_socket, user_msg, CHAVE)
+        send_system_message(target_socket, user_msg, room.key)
 
 
 
 
 
-def unmute_user(username, CHAVE):
+def unmute_user(room, username):
     """Remove o silêncio de um usuário"""
-    username_lower = username.lower()
-    user_was_muted = False
-    
-    with mute_lock:
-        if username_lower in mute_list:
-            mute_list.pop(username_lower)
-            user_was_muted = True
+    target_socket, user_data = find_user_by_name(room, username)
+
+    with room.mute_lock:
+        entry = room.mute_list.pop(username.lower(), None)
+        if entry:
+            scheduler.cancel(entry[1])
+            if user_data:
+                user_data.muted_until = None
     
-    if user_was_muted:
+    if entry:
         print(ColorManager.info(f"Removido silêncio de {username}"))
-        target_socket, _ = find_user_by_name(username)
         if target_socket:
-            send_system_message(target_socket, "Você não está mais silenciado.", CHAVE)
+            send_system_message(target_socket, "Você não está mais silenciado.", room.key)
     else:
         print(ColorManager.warning(f"Usuário '{username}' não estava silenciado"))
 
 
 
+def expire_mute(room, username, mute_until):
+    """Timer do fim do mute; ignora o disparo se o mute foi trocado nesse meio tempo"""
+    target_socket, user_data = find_user_by_name(room, username)
+
+    with room.mute_lock:
+        entry = room.mute_list.get(username.lower())
+        if not entry or entry[0] != mute_until:
+            return
+        del room.mute_list[username.lower()]
+        if user_data:
+            user_data.muted_until = None
+    
+    log.info("Fim do silêncio de %s", username)
+    if target_socket:
+        send_system_message(target_socket, "Você não está mais silenciado.", room.key)
+
+
 
 
 
-def warn_user(username, reason, CHAVE):
+
+def warn_user(room, username, reason):
     """Envia um aviso formal para um usuário"""
-    target_socket, user_data = find_user_by_name(username)
+    target_socket, user_data = find_user_by_name(room, username)
     if target_socket:
-        print(ColorManager.info(f"Enviando aviso para {user_data['username']}"))
+        print(ColorManager.info(f"Enviando aviso para {user_data.username}"))
         msg = f"Você recebeu um AVISO. Motivo: {reason}"
-        send_system_message(target_socket, msg, CHAVE)
+        send_system_message(target_socket, msg, room.key)
     else:
         print(ColorManager.warning(f"Usuário '{username}' não encontrado"))
 
 
 
 
-def broadcast_message(message_str, CHAVE, PORTA=-1, skip_client=None):
-    """Transmite uma mensagem para todos os clientes conectados"""
-    encrypted_msg = (message_str, CHAVE)
+def broadcast_message(room, kind, body, skip_client=None, sender=""):
+    """Transmite um envelope (cifrado uma única vez) para todos os clientes da sala"""
+    seq = next(room.message_seq) if kind == envelope.KIND_CHAT else 0
+    frame = framing.encode(encrypt_message(envelope.encode(kind, body, sender, seq=seq), room.key))
     current_clients = {}
     
-    with clients_lock:
-        current_clients = clients.copy()
+    with room.clients_lock:
+        current_clients = room.clients.copy()
     
     for client_socket in current_clients.keys():
         if client_socket != skip_client:
             try:
-                client_socket.send(encrypted_msg)
+                client_socket.sendall(frame)
             except (OSError, ConnectionError):
                 # Cliente desconectado - remova em uma thread separada
                 threading.Thread(
                     target=delete_client, 
-                    args=[client_socket, CHAVE, PORTA]
+                    args=[room, client_socket]
                 ).start()
 
 
 
 
 
-def delete_client(client_socket, CHAVE, PORTA, reason="saiu do chat"):
+def delete_client(room, client_socket, reason="saiu do chat"):
     """Remove um cliente e limpa seus recursos"""
     username = "Alguém"
     
-    with clients_lock:
-        user_data = clients.pop(client_socket, None)
+    with room.clients_lock:
+        user_data = room.clients.pop(client_socket, None)
         if user_data:
-            username = user_data["username"]
+            username = user_data.username
+            room.usernames.pop(username.casefold(), None)
     
-    with mute_lock:
-        if username.lower() in mute_list:
-            mute_list.pop(username.lower())
+    with room.mute_lock:
+        entry = room.mute_list.pop(username.lower(), None)
+        if entry:
+            scheduler.cancel(entry[1])
     
     try:
         client_socket.close()
     except (OSError, ConnectionError):
         pass
     
-    print(ColorManager.info(f"Conexão perdida com {username}"))
+    log.info("Conexão perdida com %s", username)
     
-    if PORTA != 0:
-        update_lobby_count(PORTA, -1)
+    if room.is_public:
+        update_lobby_count(room, -1)
     
-    if CHAVE:
-        broadcast_message(f"<{username}> {reason}.", CHAVE, PORTA, None)
+    broadcast_message(room, envelope.KIND_LEAVE, reason, None, sender=username)
 
 
 
@@ -311,34 +418,31 @@ def delete_client(client_socket, CHAVE, PORTA, reason="saiu do chat"):
 
 
 # ========== SISTEMA DE VOTAÇÃO ==========
-def reset_vote_state():
+def reset_vote_state(room):
     """Reseta o estado da votação atual"""
-    global room_state
-    with room_state_lock:
-        room_state = {
-            "vote_in_progress": False, "vote_type": None, "vote_target_user": None,
-            "vote_target_socket": None, "votes_for": set(), "votes_against": set(),
-            "voters": set()
-        }
+    with room.state_lock:
+        scheduler.cancel(room.state["vote_timer"])
+        room.state = new_vote_state()
 
 
 
 
-def check_vote_status(CHAVE, PORTA):
+def check_vote_status(room):
     """Verifica e processa o resultado de uma votação em andamento"""
     action_to_take = None
     target_user = None
     vote_type = None
     result_message = ""
 
-    with room_state_lock:
+    with room.state_lock:
+        room_state = room.state
         if not room_state["vote_in_progress"]:
             return
 
         total_voters = len(room_state["voters"])
         if total_voters < 2:
             result_message = "Votação cancelada: número insuficiente de eleitores"
-            reset_vote_state()
+            reset_vote_state(room)
         else:
             required_votes = (total_voters // 2) + 1
             votes_for_count = len(room_state["votes_for"])
@@ -354,18 +458,33 @@ def check_vote_status(CHAVE, PORTA):
                 vote_type = room_state["vote_type"]
                 result_message = f"A votação foi APROVADA ({votes_for_count} a favor). {target_user} será punido."
                 action_to_take = vote_type
-                reset_vote_state()
+                reset_vote_state(room)
             elif vote_failed:
                 result_message = f"A votação FALHOU ({votes_for_count} a favor, {votes_against_count} contra). {room_state['vote_target_user']} não será punido."
-                reset_vote_state()
+                reset_vote_state(room)
 
     if result_message:
-        broadcast_message(f"[Votação] {result_message}", CHAVE, PORTA)
+        broadcast_message(room, envelope.KIND_VOTE, result_message)
 
     if action_to_take == 'kick':
-        kick_user(target_user, CHAVE, reason="foi expulso por votação")
+        kick_user(room, target_user, reason="foi expulso por votação")
     elif action_to_take == 'mute':
-        mute_user(target_user, CHAVE, minutes=10)
+        mute_user(room, target_user, minutes=10)
+
+
+
+def expire_vote(room, vote_id):
+    """Timer do prazo da votação: encerra sem punição se ela ainda não terminou"""
+    with room.state_lock:
+        room_state = room.state
+        if not room_state["vote_in_progress"] or room_state["vote_id"] != vote_id:
+            return
+        votes_for_count = len(room_state["votes_for"])
+        votes_against_count = len(room_state["votes_against"])
+        target_user = room_state["vote_target_user"]
+        reset_vote_state(room)
+
+    broadcast_message(room, envelope.KIND_VOTE, f"A votação EXPIROU ({votes_for_count} a favor, {votes_against_count} contra). {target_user} não será punido.")
 
 
 
@@ -373,147 +492,190 @@ def check_vote_status(CHAVE, PORTA):
 
 
 # ========== HANDLER DE CLIENTES ==========
-def accept_connections_loop(server, CHAVE, PASSWORD, PORTA, CHAT_NAME, MAX_MEMBERS):
-    """Loop principal para aceitar conexões de clientes"""
-    is_public = (PASSWORD is None)
-    
+def refuse_if_full(client, addr, room):
+    """Recusa a conexão (FAIL_FULL) se a sala estiver cheia; True se recusou"""
+    with room.clients_lock:
+        if len(room.clients) < room.max_members:
+            return False
+
+    log.warning("Conexão recusada de %s: Sala %s cheia.", addr, room.id)
+    try:
+        send_frame(client, b"FAIL_FULL")
+    except (OSError, ConnectionError):
+        pass
+    client.close()
+    return True
+
+
+
+def select_room(client, addr, data):
+    """Primeiro frame do handshake: o id da sala. Devolve a Room, ou None depois de
+    responder FAIL_ROOM (sala inexistente) ou FAIL_FULL (sala cheia) e fechar"""
+    try:
+        room = find_room(int(data))
+    except ValueError:
+        room = None
+
+    if room is None:
+        log.warning("Conexão recusada de %s: Sala %r não existe.", addr, data[:20])
+        send_frame(client, b"FAIL_ROOM")
+        client.close()
+        return None
+
+    if refuse_if_full(client, addr, room):
+        return None
+    return room
+
+
+
+class LockedSocket:
+    """Socket de um cliente no modelo de threads: broadcast, PM e admin enviam de threads
+    diferentes, então o sendall de cada frame roda sob um lock da conexão para os frames
+    não se intercalarem (o Connection do reactor já serializa com o próprio lock)"""
+    __slots__ = ("sock", "send_lock")
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.send_lock = threading.Lock()
+
+    def sendall(self, data):
+        with self.send_lock:
+            self.sock.sendall(data)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+
+def accept_connections_loop(server):
+    """Loop principal para aceitar conexões de clientes (modelo de uma thread por cliente)"""
     try:
         while True:
             client, addr = server.accept()
-            
-            with clients_lock:
-                if MAX_MEMBERS > 0 and len(clients) >= MAX_MEMBERS:
-                    print(ColorManager.warning(f"Conexão recusada de {addr}: Sala cheia."))
-                    try:
-                        client.send(b"FAIL_FULL")
-                    except (OSError, ConnectionError):
-                        pass
-                    client.close()
-                    continue
-
-            print(ColorManager.info(f"Nova tentativa de conexão de: {addr}"))
+            client = LockedSocket(client)
+            log.info("Nova tentativa de conexão de: %s", addr)
             
             thread = threading.Thread(
                 target=client_handler,
-                args=[client, CHAVE, PASSWORD, PORTA, is_public, CHAT_NAME, MAX_MEMBERS]
+                args=[client, addr]
             )
             thread.start()
             
     except OSError as e:
         if e.errno == 9:  # Bad file descriptor
-            print(ColorManager.info("Loop de conexões encerrado (socket fechado)"))
+            log.info("Loop de conexões encerrado (socket fechado)")
         else:
-            print(ColorManager.error(f"Loop de conexões encerrado inesperadamente: {e}"))
+            log.error("Loop de conexões encerrado inesperadamente: %s", e)
     except Exception as e:
-        print(ColorManager.error(f"Erro inesperado no loop de conexões: {e}"))
+        log.error("Erro inesperado no loop de conexões: %s", e)
 
 
 
 
 
 
-def process_regular_message(username, msg, CHAVE, client, PORTA):
+def process_regular_message(room, username, msg, client):
     """Processa mensagens regulares (não-comando) com proteção contra spam"""
     now = time.time()
     
-    with clients_lock:
-        if client not in clients:
+    with room.clients_lock:
+        if client not in room.clients:
             return
-        user_data = clients[client]
+        user_data = room.clients[client]
 
     # Sistema anti-spam
-    if now - user_data["last_msg_time"] < 5.0:
-        user_data["msg_count"] += 1
+    if now - user_data.last_msg_time < 5.0:
+        user_data.msg_count += 1
     else:
-        user_data["msg_count"] = 1
+        user_data.msg_count = 1
     
-    user_data["last_msg_time"] = now
+    user_data.last_msg_time = now
 
-    if user_data["msg_count"] > 10:
-        user_data["infractions"] += 1
-        user_data["msg_count"] = 0
+    if user_data.msg_count > 10:
+        user_data.infractions += 1
+        user_data.msg_count = 0
         
-        if user_data["infractions"] == 1:
-            warn_user(username, "Spam (Aviso 1/3)", CHAVE)
-        elif user_data["infractions"] == 2:
-            send_system_message(client, "Spam (Aviso 2/3). Você foi silenciado por 5 minutos", CHAVE)
-            mute_user(username, CHAVE, minutes=5)
-        elif user_data["infractions"] >= 3:
-            kick_user(username, CHAVE, reason="foi expulso por spam excessivo (3 avisos)")
+        if user_data.infractions == 1:
+            warn_user(room, username, "Spam (Aviso 1/3)")
+        elif user_data.infractions == 2:
+            send_system_message(client, "Spam (Aviso 2/3). Você foi silenciado por 5 minutos", room.key)
+            mute_user(room, username, minutes=5)
+        elif user_data.infractions >= 3:
+            kick_user(room, username, reason="foi expulso por spam excessivo (3 avisos)")
             return
 
     # Transmissão da mensagem normal
-    full_message = f"<{username}> {msg}"
-    broadcast_message(full_message, CHAVE, PORTA, client)
+    broadcast_message(room, envelope.KIND_CHAT, msg, client, sender=username)
 
 
 
 
 
 
-def handle_private_message(username, msg, CHAVE, client):
+def handle_private_message(room, username, msg, client):
     """Processa mensagens privadas"""
     parts = msg.split(' ', 2)
     if len(parts) < 3:
-        send_system_message(client, "Uso: /pm <username> <mensagem>", CHAVE)
+        send_system_message(client, "Uso: /pm <username> <mensagem>", room.key)
         return
 
     target_username = parts[1]
     pm_text = parts[2]
-    target_socket, target_data = find_user_by_name(target_username)
+    target_socket, target_data = find_user_by_name(room, target_username)
     
     if target_socket:
         if target_socket == client:
-            send_system_message(client, "Não pode enviar PM para si mesmo", CHAVE)
-        elif target_data["pm_blocked"]:
-            send_system_message(client, f"'{target_data['username']}' não aceita PMs", CHAVE)
+            send_system_message(client, "Não pode enviar PM para si mesmo", room.key)
+        elif target_data.pm_blocked:
+            send_system_message(client, f"'{target_data.username}' não aceita PMs", room.key)
         else:
-            pm_to_target = f"[PM de {username}] {pm_text}"
-            target_socket.send((pm_to_target, CHAVE))
-            pm_confirm = f"[PM enviada para {target_data['username']}] {pm_text}"
-            client.send((pm_confirm, CHAVE))
+            send_envelope(target_socket, envelope.KIND_PRIVATE, pm_text, room.key, sender=username)
+            send_envelope(client, envelope.KIND_PRIVATE_SENT, pm_text, room.key, sender=target_data.username)
     else:
-        send_system_message(client, f"Usuário '{target_username}' não encontrado", CHAVE)
+        send_system_message(client, f"Usuário '{target_username}' não encontrado", room.key)
 
 
 
 
 
 
-def handle_vote_start(username, msg, CHAVE, PORTA, client):
+def handle_vote_start(room, username, msg, client):
     """Inicia uma votação"""
-    with room_state_lock:
+    with room.state_lock:
+        room_state = room.state
         if room_state["vote_in_progress"]:
-            send_system_message(client, "Já existe uma votação em progresso", CHAVE)
+            send_system_message(client, "Já existe uma votação em progresso", room.key)
             return
 
         vote_type = 'kick' if 'votekick' in msg.lower() else 'mute'
         target_username = msg.split(' ', 1)[1]
-        target_socket, target_data = find_user_by_name(target_username)
+        target_socket, target_data = find_user_by_name(room, target_username)
 
         if not target_socket:
-            send_system_message(client, f"Usuário '{target_username}' não encontrado", CHAVE)
+            send_system_message(client, f"Usuário '{target_username}' não encontrado", room.key)
         elif target_socket == client:
-            send_system_message(client, "Não pode iniciar votação contra si mesmo", CHAVE)
+            send_system_message(client, "Não pode iniciar votação contra si mesmo", room.key)
         else:
-            with clients_lock:
-                current_usernames = set(data["username"] for data in clients.values())
+            with room.clients_lock:
+                current_usernames = set(data.username for data in room.clients.values())
             
             if len(current_usernames) < 2:
-                send_system_message(client, "São necessários pelo menos 2 usuários para votar", CHAVE)
+                send_system_message(client, "São necessários pelo menos 2 usuários para votar", room.key)
                 return
 
             room_state["vote_in_progress"] = True
             room_state["vote_type"] = vote_type
-            room_state["vote_target_user"] = target_data["username"]
+            room_state["vote_target_user"] = target_data.username
             room_state["vote_target_socket"] = target_socket
             room_state["voters"] = current_usernames
             room_state["votes_for"] = {username}
             room_state["votes_against"] = set()
+            room_state["vote_id"] = vote_id = next(vote_ids)
+            room_state["vote_timer"] = scheduler.schedule(VOTE_TIMEOUT, expire_vote, room, vote_id)
 
-            broadcast_message(f"[Votação] {username} iniciou votação para {vote_type} {target_data['username']}", CHAVE, PORTA)
-            broadcast_message(f"[Votação] Digite /vote yes ou /vote no", CHAVE, PORTA)
-            check_vote_status(CHAVE, PORTA)
+            broadcast_message(room, envelope.KIND_VOTE, f"{username} iniciou votação para {vote_type} {target_data.username}")
+            broadcast_message(room, envelope.KIND_VOTE, "Digite /vote yes ou /vote no")
+            check_vote_status(room)
 
 
 
@@ -521,15 +683,16 @@ def handle_vote_start(username, msg, CHAVE, PORTA, client):
 
 
 
-def handle_vote_cast(username, msg_lower, CHAVE, PORTA, client):
+def handle_vote_cast(room, username, msg_lower, client):
     """Processa um voto em uma eleição"""
-    with room_state_lock:
+    with room.state_lock:
+        room_state = room.state
         if not room_state["vote_in_progress"]:
-            send_system_message(client, "Nenhuma votação em progresso", CHAVE)
+            send_system_message(client, "Nenhuma votação em progresso", room.key)
         elif username not in room_state["voters"]:
-            send_system_message(client, "Não pode votar (não estava online no início)", CHAVE)
+            send_system_message(client, "Não pode votar (não estava online no início)", room.key)
         elif username in room_state["votes_for"] or username in room_state["votes_against"]:
-            send_system_message(client, "Você já votou", CHAVE)
+            send_system_message(client, "Você já votou", room.key)
         else:
             vote = 'SIM'
             if 'yes' in msg_lower:
@@ -538,8 +701,8 @@ def handle_vote_cast(username, msg_lower, CHAVE, PORTA, client):
                 room_state["votes_against"].add(username)
                 vote = 'NÃO'
             
-            broadcast_message(f"[Votação] {username} votou {vote}.", CHAVE, PORTA)
-            check_vote_status(CHAVE, PORTA)
+            broadcast_message(room, envelope.KIND_VOTE, f"{username} votou {vote}.")
+            check_vote_status(room)
 
 
 
@@ -547,139 +710,186 @@ def handle_vote_cast(username, msg_lower, CHAVE, PORTA, client):
 
 
 
-def process_command(username, msg, CHAVE, PORTA, CHAT_NAME, MAX_MEMBERS, client):
+def process_command(room, username, msg, client):
     """Processa comandos do usuário"""
     msg_lower = msg.lower()
     
     if msg_lower == '/help':
         help_text = "Comandos: /sair, /users, /info, /pm <user> <msg>, /togglepm, /votekick <user>, /votemute <user>, /vote <yes/no>"
-        send_system_message(client, help_text, CHAVE)
+        send_system_message(client, help_text, room.key)
 
     elif msg_lower == '/togglepm':
-        with clients_lock:
-            if client not in clients:
+        with room.clients_lock:
+            if client not in room.clients:
                 return
-            clients[client]["pm_blocked"] = not clients[client]["pm_blocked"]
-            status = "BLOQUEADAS" if clients[client]["pm_blocked"] else "DESBLOQUEADAS"
-        send_system_message(client, f"Mensagens privadas agora estão {status}.", CHAVE)
+            room.clients[client].pm_blocked = not room.clients[client].pm_blocked
+            status = "BLOQUEADAS" if room.clients[client].pm_blocked else "DESBLOQUEADAS"
+        send_system_message(client, f"Mensagens privadas agora estão {status}.", room.key)
 
     elif msg_lower.startswith('/pm '):
-        handle_private_message(username, msg, CHAVE, client)
+        handle_private_message(room, username, msg, client)
 
     elif msg_lower == '/info':
-        max_members_display = 'N/A' if MAX_MEMBERS == float('inf') else str(MAX_MEMBERS)
-        with clients_lock:
-            num_clients = len(clients)
-        info = f"Sala: '{CHAT_NAME}', Membros: {num_clients}/{max_members_display}"
-        send_system_message(client, info, CHAVE)
+        with room.clients_lock:
+            num_clients = len(room.clients)
+        info = f"Sala: '{room.name}', Membros: {num_clients}/{room.max_members_display()}"
+        send_system_message(client, info, room.key)
 
     elif msg_lower.startswith('/votekick ') or msg_lower.startswith('/votemute '):
-        handle_vote_start(username, msg, CHAVE, PORTA, client)
+        handle_vote_start(room, username, msg, client)
 
     elif msg_lower == '/vote yes' or msg_lower == '/vote no':
-        handle_vote_cast(username, msg_lower, CHAVE, PORTA, client)
+        handle_vote_cast(room, username, msg_lower, client)
 
     elif msg_lower == '/users':
-        with clients_lock:
-            user_list = ", ".join([data["username"] for data in clients.values()])
-        response = f"[Sistema] Usuários online ({len(clients)}): {user_list}"
-        client.send((response, CHAVE))
+        with room.clients_lock:
+            user_list = ", ".join([data.username for data in room.clients.values()])
+        send_system_message(client, f"Usuários online ({len(room.clients)}): {user_list}", room.key)
 
     else:
         # Mensagem normal
-        full_message = f"<{username}> {msg}"
-        broadcast_message(full_message, CHAVE, PORTA, client)
+        broadcast_message(room, envelope.KIND_CHAT, msg, client, sender=username)
 
 
 
 
 
 
-def client_handler(client, CHAVE, PASSWORD, PORTA, is_public, CHAT_NAME, MAX_MEMBERS):
-    """Gerencia a comunicação com um cliente específico"""
-    username = ""
-    username_lower = ""
+def check_password(client, password_attempt, room):
+    """Confere a senha da sala privada; responde FAIL e fecha se ela estiver errada"""
+    if password_attempt == room.password:
+        return True
+    log.warning("Tentativa de conexão falhou: Senha errada")
+    send_frame(client, b"FAIL")
+    client.close()
+    return False
+
+
+
+def register_client(room, client, username):
+    """Valida o nome e registra o cliente (OK_NAME/FAIL_NAME); devolve o ClientState ou None"""
+    if not validate_username(username):
+        log.warning("Nome de usuário inválido: %s", username)
+        send_frame(client, b"FAIL_NAME")
+        client.close()
+        return None
+
+    # Verificação de nome duplicado
+    # Verificação e registro na mesma seção crítica, para dois logins
+    # simultâneos com o mesmo nome não passarem ambos
+    with room.clients_lock:
+        name_taken = username.casefold() in room.usernames
+        if not name_taken:
+            state = room.clients[client] = ClientState(username)
+            room.usernames[username.casefold()] = client
+
+    if name_taken:
+        log.warning("Conexão recusada: Nome '%s' já em uso", username)
+        send_frame(client, b"FAIL_NAME")
+        client.close()
+        return None
+
+    send_frame(client, b"OK_NAME")
+    return state
+
+
+
+def forget_client(room, client):
+    """Desfaz o registro de um cliente que caiu antes de entrar na sala"""
+    with room.clients_lock:
+        state = room.clients.pop(client, None)
+        if state is not None:
+            room.usernames.pop(state.username.casefold(), None)
+
+
+
+def welcome_client(room, client, state):
+    """Anuncia a entrada, envia as boas-vindas e avisa se o usuário continua silenciado"""
+    username = state.username
+    log.info("'%s' entrou na sala %s", username, room.id)
     
-    try:
-        # Autenticação por senha (se aplicável)
-        if PASSWORD is not None:
-            password_attempt = client.recv(1024).decode('utf-8')
-            if password_attempt != PASSWORD:
-                print(ColorManager.warning("Tentativa de conexão falhou: Senha errada"))
-                client.send(b"FAIL     ")
-                client.close()
-                return
+    if room.is_public:
+        update_lobby_count(room, +1)
 
-        # Envio da chave de criptografia
-        client.send(CHAVE)
-
-        # Recebimento e validação do nome de usuário
-        encrypted_username = client.recv(BUFFER_SIZE)
-        username = (encrypted_username, CHAVE).strip()
-        username_lower = username.lower()
-
-        # Validação do nome de usuário
-        if not validate_username(username):
-            print(ColorManager.warning(f"Nome de usuário inválido: {username}"))
-            client.send(b"FAIL_NAME")
-            client.close()
-            return
+    broadcast_message(room, envelope.KIND_JOIN, "", client, sender=username)
 
-        # Verificação de nome duplicado
-        with clients_lock:
-            for data in clients.values():
-                if data["username"].lower() == username_lower:
-                    print(ColorManager.warning(f"Conexão recusada: Nome '{username}' já em uso"))
-                    client.send(b"FAIL_NAME")
-                    client.close()
-                    return
+    # Mensagem de boas-vindas
+    welcome_msg = f"Você entrou no chat '{room.name}'. {len(room.clients)}/{room.max_members_display()} usuários online."
+    send_system_message(client, welcome_msg, room.key)
 
-        client.send(b"OK_NAME  ")
+    # Verificação de mute status: o flag do cliente passa a refletir a mute_list,
+    # e o timer do mute o limpa quando o prazo acabar
+    with room.mute_lock:
+        mute_until, _ = room.mute_list.get(username.lower(), (None, None))
+        state.muted_until = mute_until
+    
+    if mute_until is not None:
+        if mute_until == float('inf'):
+            msg = "Você está silenciado permanentemente nesta sala"
+        else:
+            remaining = max(0, int(mute_until - time.time()))
+            msg = f"Você continua silenciado. Faltam {remaining // 60}m {remaining % 60}s"
+        send_system_message(client, msg, room.key)
 
-        # Registro do cliente
-        with clients_lock:
-            clients[client] = {
-                "username": username,
-                "pm_blocked": False,
-                "last_msg_time": time.time(),
-                "msg_count": 0,
-                "infractions": 0
-            }
 
-        print(ColorManager.success(f"'{username}' entrou no chat"))
-        
-        if is_public:
-            update_lobby_count(PORTA, +1)
 
-        broadcast_message(f"<{username}> entrou no chat", CHAVE, PORTA, client)
+def handle_client_message(room, client, state, msg):
+    """Trata uma mensagem (já decifrada) de um cliente que está na sala"""
+    # Verificação de mute: só o flag, sem lock nem relógio (o timer o limpa)
+    mute_until = state.muted_until
+    if mute_until is not None:
+        if mute_until == float('inf'):
+            msg_mute = "Você está silenciado permanentemente"
+        else:
+            remaining = max(0, int(mute_until - time.time()))
+            msg_mute = f"Você está silenciado. Faltam {remaining // 60}m {remaining % 60}s"
+        send_system_message(client, msg_mute, room.key)
+        return
 
-        # Mensagem de boas-vindas
-        max_members_display = 'N/A' if MAX_MEMBERS == float('inf') else str(MAX_MEMBERS)
-        welcome_msg = f"Você entrou no chat '{CHAT_NAME}'. {len(clients)}/{max_members_display} usuários online."
-        send_system_message(client, welcome_msg, CHAVE)
+    # Processamento de comandos e mensagens
+    if not msg.startswith('/'):
+        process_regular_message(room, state.username, msg, client)
+    else:
+        process_command(room, state.username, msg, client)
 
 
 
+def client_handler(client, addr):
+    """Gerencia a comunicação com um cliente específico (modelo de uma thread por cliente)"""
+    username = ""
+    room = None
+    reader = framing.FrameReader(client, BUFFER_SIZE)
+    
+    try:
+        # Escolha da sala (o primeiro frame é o id dela)
+        room = select_room(client, addr, reader.read() or b"")
+        if room is None:
+            return
 
-        # Verificação de mute status
-        with mute_lock:
-            mute_until = mute_list.get(username_lower)
-        
-        if mute_until:
-            now = time.time()
-            if now < mute_until:
-                if mute_until == float('inf'):
-                    msg = "Você está silenciado permanentemente nesta sala"
-                else:
-                    remaining = int(mute_until - now)
-                    msg = f"Você continua silenciado. Faltam {remaining // 60}m {remaining % 60}s"
-                send_system_message(client, msg, CHAVE)
-            else:
-                with mute_lock:
-                    mute_list.pop(username_lower, None)
+        # Autenticação por senha (se aplicável)
+        if not room.is_public:
+            password_attempt = (reader.read() or b"").decode('utf-8')
+            if not check_password(client, password_attempt, room):
+                return
+
+        # Envio da chave de criptografia
+        send_frame(client, room.key)
+
+        # Recebimento, validação e registro do nome de usuário
+        encrypted_username = reader.read()
+        if encrypted_username is None:
+            raise ConnectionError("conexão fechada antes do nome de usuário")
+        username = decrypt_message(encrypted_username, room.key).strip()
+        state = register_client(room, client, username)
+        if state is None:
+            return
+
+        welcome_client(room, client, state)
 
     except Exception as e:
-        print(ColorManager.error(f"Erro na autenticação: {e}"))
+        log.error("Erro na autenticação: %s", e)
+        if room is not None:
+            forget_client(room, client)
         client.close()
         return
 
@@ -689,43 +899,98 @@ def client_handler(client, CHAVE, PASSWORD, PORTA, is_public, CHAT_NAME, MAX_MEM
     # Loop principal de mensagens do cliente
     while True:
         try:
-            msg_criptografada = client.recv(BUFFER_SIZE)
-            if not msg_criptografada:
+            msg_criptografada = reader.read()
+            if msg_criptografada is None:
                 break
 
-            msg = (msg_criptografada, CHAVE).strip()
-
-            # Verificação de mute
-            with mute_lock:
-                mute_until = mute_list.get(username_lower)
-            
-            if mute_until:
-                now = time.time()
-                if now < mute_until:
-                    if mute_until == float('inf'):
-                        msg_mute = "Você está silenciado permanentemente"
-                    else:
-                        remaining = int(mute_until - now)
-                        msg_mute = f"Você está silenciado. Faltam {remaining // 60}m {remaining % 60}s"
-                    send_system_message(client, msg_mute, CHAVE)
-                    continue
-                else:
-                    unmute_user(username, CHAVE)
-
-            # Processamento de comandos e mensagens
-            if not msg.startswith('/'):
-                process_regular_message(username, msg, CHAVE, client, PORTA)
-            else:
-                process_command(username, msg, CHAVE, PORTA, CHAT_NAME, MAX_MEMBERS, client)
+            msg = decrypt_message(msg_criptografada, room.key).strip()
+            handle_client_message(room, client, state, msg)
 
         except ConnectionResetError:
-            print(ColorManager.info(f"Conexão resetada por {username}"))
+            log.info("Conexão resetada por %s", username)
             break
         except Exception as e:
-            print(ColorManager.error(f"Erro no loop do cliente {username}: {e}"))
+            log.error("Erro no loop do cliente %s: %s", username, e)
             break
 
-    delete_client(client, CHAVE, PORTA)
+    delete_client(room, client)
+
+
+
+
+
+
+# ========== NÚCLEO DE EVENTOS ==========
+class ChatConnection:
+    """Etapas do client_handler (sala, senha, nome, mensagens) disparadas a cada frame
+    que o reactor lê, em vez de recv() bloqueante numa thread própria"""
+    __slots__ = ("conn", "decoder", "stage", "room", "state")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.decoder = framing.FrameDecoder(BUFFER_SIZE)
+        self.stage = "room"
+        self.room = None
+        self.state = None
+
+    def get_buffer(self):
+        return self.decoder.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        """Trata todos os frames completos deste recv_into (vários, se o cliente enviou em sequência)"""
+        self.decoder.buffer_updated(nbytes)
+        try:
+            frames = self.decoder.frames()
+        except framing.FrameError as e:
+            log.warning("Frame inválido de %s: %s", self.conn.addr, e)
+            self.conn.close()
+            return
+        for frame in frames:
+            if self.conn.state != "open":
+                break
+            self.frame_received(frame)
+
+    def frame_received(self, data):
+        try:
+            if self.stage == "chat":
+                msg = decrypt_message(data, self.room.key).strip()
+                handle_client_message(self.room, self.conn, self.state, msg)
+            elif self.stage == "room":
+                self.room = select_room(self.conn, self.conn.addr, data)
+                if self.room is None:
+                    return
+                if self.room.is_public:
+                    send_frame(self.conn, self.room.key)
+                    self.stage = "name"
+                else:
+                    self.stage = "password"
+            elif self.stage == "password":
+                if check_password(self.conn, data.decode('utf-8'), self.room):
+                    send_frame(self.conn, self.room.key)
+                    self.stage = "name"
+            elif self.stage == "name":
+                username = decrypt_message(data, self.room.key).strip()
+                self.state = register_client(self.room, self.conn, username)
+                if self.state is not None:
+                    welcome_client(self.room, self.conn, self.state)
+                    self.stage = "chat"
+        except Exception as e:
+            name = self.state.username if self.state else self.conn.addr
+            log.error("Erro no cliente %s: %s", name, e)
+            self.conn.close()
+
+    def connection_lost(self):
+        if self.stage == "chat":
+            delete_client(self.room, self.conn)
+        elif self.room is not None:
+            forget_client(self.room, self.conn)
+
+
+
+def accept_event_connection(conn):
+    """on_accept do reactor: a sala só é conhecida no primeiro frame"""
+    log.info("Nova tentativa de conexão de: %s", conn.addr)
+    return ChatConnection(conn)
 
 
 
@@ -733,8 +998,8 @@ def client_handler(client, CHAVE, PASSWORD, PORTA, is_public, CHAT_NAME, MAX_MEM
 
 
 # ========== INTERFACE ADMINISTRATIVA ==========
-def handle_admin_command(cmd, CHAVE_SECRETA, PORTA, is_public):
-    """Processa comandos do administrador"""
+def handle_admin_command(cmd, room):
+    """Processa comandos do administrador para a sala escolhida"""
     cmd_parts = cmd.split()
     if not cmd_parts:
         return True  # Continuar loop
@@ -742,13 +1007,14 @@ def handle_admin_command(cmd, CHAVE_SECRETA, PORTA, is_public):
     command = cmd_parts[0].lower()
 
     command_handlers = {
-        'sair': lambda: admin_command_sair(PORTA, is_public),
-        'users': lambda: admin_command_users(),
-        'kick': lambda: admin_command_kick(cmd_parts, CHAVE_SECRETA),
-        'warn': lambda: admin_command_warn(cmd_parts, CHAVE_SECRETA),
-        'mute': lambda: admin_command_mute(cmd_parts, CHAVE_SECRETA),
-        'unmute': lambda: admin_command_unmute(cmd_parts, CHAVE_SECRETA),
-        'broadcast': lambda: admin_command_broadcast(cmd, CHAVE_SECRETA, PORTA)
+        'sair': lambda: admin_command_sair(room),
+        'voltar': lambda: admin_command_voltar(room),
+        'users': lambda: admin_command_users(room),
+        'kick': lambda: admin_command_kick(cmd_parts, room),
+        'warn': lambda: admin_command_warn(cmd_parts, room),
+        'mute': lambda: admin_command_mute(cmd_parts, room),
+        'unmute': lambda: admin_command_unmute(cmd_parts, room),
+        'broadcast': lambda: admin_command_broadcast(cmd, room)
     }
 
     handler = command_handlers.get(command)
@@ -762,48 +1028,55 @@ def handle_admin_command(cmd, CHAVE_SECRETA, PORTA, is_public):
 
 
 
-def admin_command_sair(PORTA, is_public):
+def admin_command_sair(room):
     """Comando sair do administrador"""
     print(ColorManager.info("Comando 'sair' recebido. Desligando esta sala..."))
-    if is_public:
-        remove_server_from_lobby(PORTA)
+    close_room(room)
     return False
 
 
 
 
-def admin_command_users():
+def admin_command_voltar(room):
+    """Volta ao menu principal deixando a sala aberta"""
+    print(ColorManager.info(f"A sala {room.id} continua aberta. Voltando ao menu principal..."))
+    return False
+
+
+
+
+def admin_command_users(room):
     """Lista usuários online"""
-    with clients_lock:
-        if not clients:
+    with room.clients_lock:
+        if not room.clients:
             print(ColorManager.info("Nenhum usuário online"))
         else:
-            user_list = ", ".join([data["username"] for data in clients.values()])
-            print(ColorManager.info(f"Usuários online ({len(clients)}): {user_list}"))
+            user_list = ", ".join([data.username for data in room.clients.values()])
+            print(ColorManager.info(f"Usuários online ({len(room.clients)}): {user_list}"))
     return True
 
 
 
 
 
-def admin_command_kick(cmd_parts, CHAVE_SECRETA):
+def admin_command_kick(cmd_parts, room):
     """Expulsa um usuário"""
     if len(cmd_parts) < 2:
         print(ColorManager.warning("Uso: kick <username>"))
     else:
-        kick_user(cmd_parts[1], CHAVE_SECRETA, reason="foi expulso pelo anfitrião")
+        kick_user(room, cmd_parts[1], reason="foi expulso pelo anfitrião")
     return True
 
 
 
 
 
-def admin_command_warn(cmd_parts, CHAVE_SECRETA):
+def admin_command_warn(cmd_parts, room):
     """Adverte um usuário"""
     if len(cmd_parts) < 2:
         print(ColorManager.warning("Uso: warn <username>"))
     else:
-        warn_user(cmd_parts[1], "Comportamento inadequado (aviso do admin)", CHAVE_SECRETA)
+        warn_user(room, cmd_parts[1], "Comportamento inadequado (aviso do admin)")
     return True
 
 
@@ -811,7 +1084,7 @@ def admin_command_warn(cmd_parts, CHAVE_SECRETA):
 
 
 
-def admin_command_mute(cmd_parts, CHAVE_SECRETA):
+def admin_command_mute(cmd_parts, room):
     """Silencia um usuário"""
     if len(cmd_parts) < 2:
         print(ColorManager.warning("Uso: mute <username> [minutos]"))
@@ -819,7 +1092,7 @@ def admin_command_mute(cmd_parts, CHAVE_SECRETA):
         minutes = 0
         if len(cmd_parts) > 2 and cmd_parts[2].isdigit():
             minutes = int(cmd_parts[2])
-        mute_user(cmd_parts[1], CHAVE_SECRETA, minutes)
+        mute_user(room, cmd_parts[1], minutes)
     return True
 
 
@@ -827,135 +1100,210 @@ def admin_command_mute(cmd_parts, CHAVE_SECRETA):
 
 
 
-def admin_command_unmute(cmd_parts, CHAVE_SECRETA):
+def admin_command_unmute(cmd_parts, room):
     """Remove silêncio de um usuário"""
     if len(cmd_parts) < 2:
         print(ColorManager.warning("Uso: unmute <username>"))
     else:
-        unmute_user(cmd_parts[1], CHAVE_SECRETA)
+        unmute_user(room, cmd_parts[1])
     return True
 
 
 
 
 
-def admin_command_broadcast(cmd, CHAVE_SECRETA, PORTA):
+def admin_command_broadcast(cmd, room):
     """Transmite uma mensagem para todos"""
     if len(cmd.split()) < 2:
         print(ColorManager.warning("Uso: broadcast <mensagem>"))
     else:
         message = cmd.split(' ', 1)[1]
         print(ColorManager.info("Enviando anúncio..."))
-        anuncio = f"[ANÚNCIO DO ADMIN] {message}"
-        broadcast_message(anuncio, CHAVE_SECRETA, PORTA)
+        broadcast_message(room, envelope.KIND_ANNOUNCEMENT, message)
     return True
 
 
 
 
 
+def admin_room_loop(room):
+    """Loop de comandos do administrador para uma sala"""
+    print(ColorManager.info("Comandos: 'users', 'kick <user>', 'warn <user>', 'mute <user> [min]', 'unmute <user>', 'broadcast <msg>', 'voltar', 'sair'"))
+    try:
+        running = True
+        while running:
+            cmd = input().strip()
+            running = handle_admin_command(cmd, room)
+
+    except KeyboardInterrupt:
+        print(ColorManager.info("\nCtrl+C recebido. Desligando esta sala..."))
+        close_room(room)
+        print(ColorManager.info("Sala desligada. Voltando ao menu principal..."))
+        return
+
+    if room.id not in rooms:
+        print(ColorManager.info("Sala desligada. Voltando ao menu principal..."))
+
+
+
+
+
 
 # ========== FUNÇÃO PRINCIPAL ==========
+def start_listener(PORTA):
+    """Abre a porta única do processo e inicia o atendimento: reactor (padrão) ou uma
+    thread por cliente. Devolve (server, reactor) ou (None, None) se a porta estiver em uso"""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if not initialize_server(server, PORTA):
+        return None, None
+
+    # O bind deu certo: salas dessa porta que ainda estão no lobby são de um processo morto
+    lobby_writer.submit("limpar o lobby", lobby.clear_port, PORTA)
+
+    reactor = None
+    if SERVER_ENGINE == "threads":
+        accept_thread = threading.Thread(target=accept_connections_loop, args=[server])
+        accept_thread.daemon = True
+        accept_thread.start()
+    else:
+        reactor = Reactor(server, accept_event_connection)
+        reactor.start()
+
+    print(ColorManager.success(f"Servidor ouvindo na porta {PORTA}; todas as salas deste processo usam essa porta"))
+    return server, reactor
+
+
+
+def shutdown(server, reactor):
+    """Desliga todas as salas e a porta do processo"""
+    global announcer
+    print(ColorManager.info("Fechando salas e conexões..."))
+    with rooms_lock:
+        open_rooms = list(rooms.values())
+    for room in open_rooms:
+        close_room(room)
+    if announcer:
+        announcer.stop()  # manda o "remove": as salas somem da descoberta na hora
+        announcer = None
+    if reactor:
+        reactor.stop()
+    if server:
+        server.close()
+    lobby_writer.stop()  # grava as remoções ainda na fila
+    scheduler.stop()
+
+
+
 def main():
     """Função principal do servidor"""
-    while True:
-        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        CHAVE_SECRETA =()
+    server = reactor = None
+    PORTA = None
+    scheduler.start()
+    lobby_writer.start()
         
-        # Limpeza de estado global
-        clients.clear()
-        mute_list.clear()
-        reset_vote_state()
-
-        print(ColorManager.success("\n--- Criar Novo Chat (Menu Principal) ---"))
-
-        # Configuração inicial da sala
-        SENHA, chat_name, is_public = setup_chat_type()
-        if not chat_name:
-            continue
-
-        PORTA = setup_port()
-        if not PORTA:
-            continue
-
-        MAX_MEMBERS = setup_member_limit()
-        if MAX_MEMBERS is None:
-            continue
-
-        # Inicialização do servidor
-        if not initialize_server(server, PORTA):
-            continue
-
-        # Registro da sala
-        max_members_display = 'N/A' if MAX_MEMBERS == 0 else str(MAX_MEMBERS)
-        if is_public:
-            add_server_to_lobby(chat_name, PORTA, max_members_display)
-            print(ColorManager.success(f"Sala Pública {chat_name} registrada na PORTA:{PORTA} (Max: {max_members_display})"))
-        else:
-            log_private_room(PORTA, SENHA)
-            print(ColorManager.success(f"Sala Privada criada na PORTA: {PORTA} (Max: {max_members_display})"))
-            print(ColorManager.info(f"SENHA: {SENHA}"))
-
-        print("---------------------------------------")
-        print(ColorManager.info(f"Aguardando conexões na porta {PORTA}..."))
-
-        # Início do loop de aceitação de conexões
-        accept_thread = threading.Thread(
-            target=accept_connections_loop,
-            args=[server, CHAVE_SECRETA, SENHA, PORTA, chat_name, MAX_MEMBERS if MAX_MEMBERS > 0 else float('inf')]
-        )
-        accept_thread.daemon = True
-        accept_thread.start()
+    try:
+        while True:
+            print(ColorManager.success("\n--- Criar Novo Chat (Menu Principal) ---"))
+            choice = main_menu()
 
-        print(ColorManager.success("Servidor rodando. O terminal está livre"))
-        print(ColorManager.info("Comandos: 'users', 'kick <user>', 'warn <user>', 'mute <user> [min]', 'unmute <user>', 'broadcast <msg>', 'sair'"))
+            if choice == '4':
+                break
+            if choice == '3':
+                room = choose_open_room()
+                if room:
+                    admin_room_loop(room)
+                continue
+
+            # Configuração da sala
+            SENHA, chat_name, is_public = setup_chat_type(choice)
+            if not chat_name:
+                continue
+
+            # A porta é escolhida uma vez; as salas seguintes entram no mesmo processo
+            if server is None:
+                PORTA = setup_port()
+                if not PORTA:
+                    continue
+                server, reactor = start_listener(PORTA)
+                if server is None:
+                    continue
 
-        # Loop de comandos do administrador
-        try:
-            running = True
-            while running:
-                cmd = input().strip()
-                running = handle_admin_command(cmd, CHAVE_SECRETA, PORTA, is_public)
+            MAX_MEMBERS = setup_member_limit()
+            if MAX_MEMBERS is None:
+                continue
 
-        except KeyboardInterrupt:
-            print(ColorManager.info("\nCtrl+C recebido. Desligando esta sala..."))
+            # Registro da sala
+            room = open_room(chat_name, SENHA, PORTA, MAX_MEMBERS if MAX_MEMBERS > 0 else float('inf'))
             if is_public:
-                remove_server_from_lobby(PORTA)
+                print(ColorManager.success(f"Sala Pública {chat_name} registrada na PORTA:{PORTA}, SALA:{room.id} (Max: {room.max_members_display()})"))
+            else:
+                print(ColorManager.success(f"Sala Privada criada na PORTA: {PORTA}, SALA: {room.id} (Max: {room.max_members_display()})"))
+                print(ColorManager.info(f"SENHA: {SENHA}"))
 
-        # Limpeza final
-        print(ColorManager.info("Fechando servidor e conexões..."))
-        server.close()
-        
-        with clients_lock:
-            for client_socket in list(clients.keys()):
-                client_socket.close()
-            clients.clear()
-        
-        with mute_lock:
-            mute_list.clear()
-        
-        reset_vote_state()
-        print(ColorManager.info("Sala desligada. Voltando ao menu principal..."))
+            print("---------------------------------------")
+            print(ColorManager.info(f"Aguardando conexões na porta {PORTA}, sala {room.id}..."))
+            print(ColorManager.success("Servidor rodando. O terminal está livre"))
 
+            admin_room_loop(room)
 
+    except KeyboardInterrupt:
+        print(ColorManager.info("\nCtrl+C recebido."))
 
+    # Limpeza final
+    shutdown(server, reactor)
+    print(ColorManager.info("Servidor desligado."))
 
 
 
 
-def setup_chat_type():
-    """Configura o tipo de chat (público/privado)"""
+
+
+
+def main_menu():
+    """Menu principal: criar sala, administrar uma sala aberta ou desligar o servidor"""
     while True:
-        choice = input("\n1: Criar Chat Público \n2: Criar Chat Privado \nEscolha: ")
+        choice = input("\n1: Criar Chat Público \n2: Criar Chat Privado \n3: Administrar Sala Aberta \n4: Desligar Servidor \nEscolha: ")
+
+        if choice in ('1', '2', '3', '4'):
+            return choice
+        print(ColorManager.error("Opção inválida"))
+
+
+
+
+
+
+def setup_chat_type(choice):
+    """Configura o tipo de chat (público/privado)"""
+    if choice == '1':
+        chat_name = input("\nDigite um nome público para sua sala: ")
+        return None, chat_name, True
+    SENHA = input("\nDigite uma SENHA para sua sala: ")
+    return SENHA, "Chat Privado", False
         
-        if choice == '1':
-            chat_name = input("\nDigite um nome público para sua sala: ")
-            return None, chat_name, True
-        elif choice == '2':
-            SENHA = input("\nDigite uma SENHA para sua sala: ")
-            return SENHA, "Chat Privado", False
-        else:
-            print(ColorManager.error("Opção inválida"))
+
+
+
+
+
+def choose_open_room():
+    """Lista as salas abertas neste processo e pergunta qual administrar"""
+    with rooms_lock:
+        open_rooms = list(rooms.values())
+    if not open_rooms:
+        print(ColorManager.warning("Nenhuma sala aberta"))
+        return None
+
+    for room in open_rooms:
+        kind = "Pública" if room.is_public else "Privada"
+        print(f"{room.id}: {room.name} ({kind}, {len(room.clients)}/{room.max_members_display()})")
+    try:
+        room = find_room(int(input("Número da sala: ")))
+    except ValueError:
+        room = None
+    if room is None:
+        print(ColorManager.error("Sala inexistente"))
+    return room
 
 
 
@@ -1009,6 +1357,7 @@ def initialize_server(server, port):
     except OSError as e:
         print(ColorManager.error(f"Erro: Porta {port} já está em uso. {e}"))
         print(ColorManager.info("Voltando ao menu principal..."))
+        server.close()
         return False
 
 if __name__ == "__main__":
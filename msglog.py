@@ -0,0 +1,273 @@
+# msglog.py - Log de mensagens em disco: append-only, segmentado, com índice esparso
+#
+# Cada segmento é um par <seq_base>.log / <seq_base>.idx. O .log guarda registros
+# (cabeçalho + sala + remetente + texto); o .idx guarda (seq, timestamp, offset) a cada
+# index_interval registros. A escrita acontece em lote numa thread própria e a
+# leitura usa mmap, sem carregar os arquivos inteiros.
+
+import bisect
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+import applog
+
+RECORD_HEADER = struct.Struct("!QdHHI")  # seq, timestamp, tamanhos da sala, do remetente e do texto
+INDEX_ENTRY = struct.Struct("!QdQ")      # seq, timestamp, offset no .log
+WRITE_BATCH = 1024
+
+log = applog.get_logger("msglog")
+
+class MessageLog:
+    """Log segmentado de mensagens de chat"""
+
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024, index_interval=64,
+                 max_segments=16, flush_interval=0.2):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.max_segments = max_segments
+        self.flush_interval = flush_interval
+
+        self.next_seq = 1
+        self.seq_lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.thread = None
+
+        # Estado do segmento aberto (usado só pela thread escritora)
+        self.log_file = None
+        self.idx_file = None
+        self.segment_size = 0
+        self.segment_records = 0
+
+    # ========== ESCRITA ==========
+    def open(self):
+        """Recupera o último segmento e inicia a thread escritora"""
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._segments()
+        if segments:
+            self._recover(segments[-1])
+        self.thread = threading.Thread(target=self._writer, name="msglog-writer", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        if self.thread and self.thread.is_alive():
+            self.pending.put(None)
+            self.thread.join(timeout=5)
+        self._close_segment()
+
+    def append(self, room, sender, text, timestamp=None):
+        """Reserva o próximo número de sequência e enfileira o registro; não toca o disco"""
+        with self.seq_lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.pending.put((seq, timestamp or time.time(), room, sender, text))
+        return seq
+
+    def _writer(self):
+        while True:
+            item = self.pending.get()
+            batch = [item]
+            # Junta o que chegou durante a espera num único write/flush
+            time.sleep(self.flush_interval)
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            try:
+                self._write_batch([record for record in batch if record is not None])
+            except OSError as e:
+                log.error("Falha ao gravar lote: %s", e)
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        chunks = []
+        index_entries = []
+        for seq, timestamp, room, sender, text in batch:
+            if self.log_file is None or self.segment_size >= self.segment_bytes:
+                self._flush(chunks, index_entries)
+                chunks, index_entries = [], []
+                self._rotate(seq)
+
+            room_bytes = room.encode('utf-8')
+            sender_bytes = sender.encode('utf-8')
+            text_bytes = text.encode('utf-8')
+            if self.segment_records % self.index_interval == 0:
+                index_entries.append(INDEX_ENTRY.pack(seq, timestamp, self.segment_size))
+            record = (RECORD_HEADER.pack(seq, timestamp, len(room_bytes), len(sender_bytes), len(text_bytes))
+                      + room_bytes + sender_bytes + text_bytes)
+            chunks.append(record)
+            self.segment_size += len(record)
+            self.segment_records += 1
+
+        self._flush(chunks, index_entries)
+
+    def _flush(self, chunks, index_entries):
+        if chunks:
+            self.log_file.write(b"".join(chunks))
+            self.log_file.flush()
+        if index_entries:
+            self.idx_file.write(b"".join(index_entries))
+            self.idx_file.flush()
+
+    def _rotate(self, base_seq):
+        self._close_segment()
+        log_path, idx_path = self._paths(base_seq)
+        self.log_file = open(log_path, 'ab')
+        self.idx_file = open(idx_path, 'ab')
+        self.segment_size = 0
+        self.segment_records = 0
+
+        # Retenção: remove os segmentos mais antigos
+        segments = self._segments()
+        for old in segments[:max(0, len(segments) - self.max_segments)]:
+            for path in self._paths(old):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _close_segment(self):
+        for f in (self.log_file, self.idx_file):
+            if f:
+                f.close()
+        self.log_file = None
+        self.idx_file = None
+
+    def _recover(self, base_seq):
+        """Descarta um registro final incompleto e reconstrói o índice do último segmento"""
+        log_path, idx_path = self._paths(base_seq)
+        records, valid_end = self._scan(base_seq, 0)
+
+        with open(log_path, 'r+b') as f:
+            f.truncate(valid_end)
+        with open(idx_path, 'wb') as f:
+            for position, (seq, timestamp, offset, _, _, _) in enumerate(records):
+                if position % self.index_interval == 0:
+                    f.write(INDEX_ENTRY.pack(seq, timestamp, offset))
+
+        self.next_seq = records[-1][0] + 1 if records else base_seq
+        self.log_file = open(log_path, 'ab')
+        self.idx_file = open(idx_path, 'ab')
+        self.segment_size = valid_end
+        self.segment_records = len(records)
+
+    # ========== LEITURA ==========
+    def read_last(self, count, room=None):
+        """Últimas count mensagens (da sala, se informada), da mais antiga para a mais nova,
+        como tuplas (seq, timestamp, remetente, texto)"""
+        result = []
+        for base_seq in reversed(self._segments()):
+            index = self._read_index(base_seq)
+            offsets = [entry[2] for entry in index] or [0]
+            # Recua pelos pontos do índice até achar mensagens suficientes no segmento
+            step = 1
+            while True:
+                start = offsets[max(0, len(offsets) - step)]
+                records, _ = self._scan(base_seq, start, room)
+                if len(records) + len(result) >= count or start == offsets[0]:
+                    break
+                step *= 2
+            result = records[-(count - len(result)):] + result
+            if len(result) >= count:
+                break
+        return [(seq, timestamp, sender, text) for seq, timestamp, _, _, sender, text in result]
+
+    def read_since(self, since, room=None, limit=50):
+        """Até limit mensagens com timestamp >= since, da mais antiga para a mais nova"""
+        segments = self._segments()
+        result = []
+        for position, base_seq in enumerate(segments):
+            # Pula segmentos que terminam antes de since (o próximo já começa antes dele)
+            if position + 1 < len(segments):
+                next_index = self._read_index(segments[position + 1])
+                if next_index and next_index[0][1] <= since:
+                    continue
+
+            index = self._read_index(base_seq)
+            timestamps = [entry[1] for entry in index]
+            point = bisect.bisect_left(timestamps, since) - 1
+            start = index[point][2] if point >= 0 else 0
+
+            records, _ = self._scan(base_seq, start, room, limit=limit - len(result), since=since)
+            result.extend(records)
+            if len(result) >= limit:
+                break
+        return [(seq, timestamp, sender, text) for seq, timestamp, _, _, sender, text in result]
+
+    def read_after(self, after_seq, room=None, limit=50):
+        """Até limit mensagens com seq > after_seq, da mais antiga para a mais nova"""
+        segments = self._segments()
+        # Primeiro segmento que pode conter after_seq + 1 (cada nome é a seq base do segmento)
+        position = max(0, bisect.bisect_right(segments, after_seq + 1) - 1)
+        result = []
+        for base_seq in segments[position:]:
+            index = self._read_index(base_seq)
+            seqs = [entry[0] for entry in index]
+            point = bisect.bisect_right(seqs, after_seq + 1) - 1
+            start = index[point][2] if point >= 0 else 0
+
+            records, _ = self._scan(base_seq, start, room, limit=limit - len(result), after=after_seq)
+            result.extend(records)
+            if len(result) >= limit:
+                break
+        return [(seq, timestamp, sender, text) for seq, timestamp, _, _, sender, text in result]
+
+    def _scan(self, base_seq, offset, room=None, limit=None, since=None, after=None):
+        """Lê registros completos a partir de offset via mmap; retorna (registros, fim válido)"""
+        log_path, _ = self._paths(base_seq)
+        records = []
+        try:
+            with open(log_path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size <= offset:
+                    return records, offset
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    pos = offset
+                    while pos + RECORD_HEADER.size <= size:
+                        seq, timestamp, room_len, sender_len, text_len = RECORD_HEADER.unpack_from(mm, pos)
+                        body = pos + RECORD_HEADER.size
+                        end = body + room_len + sender_len + text_len
+                        if end > size:
+                            break
+                        if (since is None or timestamp >= since) and (after is None or seq > after):
+                            record_room = mm[body:body + room_len].decode('utf-8')
+                            if room is None or record_room == room:
+                                sender = mm[body + room_len:body + room_len + sender_len].decode('utf-8')
+                                text = mm[body + room_len + sender_len:end].decode('utf-8')
+                                records.append((seq, timestamp, pos, record_room, sender, text))
+                                if limit is not None and len(records) >= limit:
+                                    return records, end
+                        pos = end
+                    return records, pos
+        except FileNotFoundError:
+            return records, offset
+
+    def _read_index(self, base_seq):
+        _, idx_path = self._paths(base_seq)
+        try:
+            with open(idx_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        return list(INDEX_ENTRY.iter_unpack(data[:usable]))
+
+    def _segments(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-4]) for name in names if name.endswith(".log") and name[:-4].isdigit())
+
+    def _paths(self, base_seq):
+        name = f"{base_seq:020d}"
+        return (os.path.join(self.directory, name + ".log"),
+                os.path.join(self.directory, name + ".idx"))
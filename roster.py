@@ -0,0 +1,76 @@
+# roster.py - Lista de presença versionada, com as páginas do /users em cache
+#
+# Cada entrada ou saída incrementa a versão. Os avisos de entrada/saída levam a
+# versão no seq do envelope, então o cliente mantém uma lista local aplicando os
+# deltas e só pede a lista inteira de novo se perceber um buraco na sequência.
+# As páginas do /users são montadas uma vez por versão, não a cada pedido.
+
+import envelope
+
+class Roster:
+    """Nomes online (casefold -> nome exibido) com versão e páginas renderizadas"""
+
+    def __init__(self, page_size=100):
+        self.page_size = page_size
+        self.names = {}
+        self.version = 0
+        self._pages = {}
+        self._ordered = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, username):
+        return username.casefold() in self.names
+
+    def get(self, username):
+        return self.names.get(username.casefold())
+
+    def values(self):
+        return self.names.values()
+
+    def add(self, username, version=None):
+        """Registra a entrada e devolve a nova versão (a do hub, se informada)"""
+        self.names[username.casefold()] = username
+        return self._changed(version)
+
+    def remove(self, username, version=None):
+        """Registra a saída e devolve a nova versão; None se o nome não estava na lista"""
+        if self.names.pop(username.casefold(), None) is None and version is None:
+            return None
+        return self._changed(version)
+
+    def reset(self, usernames, version):
+        """Substitui a lista inteira (espelho recebido do hub)"""
+        self.names = {name.casefold(): name for name in usernames}
+        self._changed(version)
+
+    def _changed(self, version):
+        self.version = self.version + 1 if version is None else version
+        self._pages.clear()
+        self._ordered = None
+        return self.version
+
+    def page_count(self):
+        return max(1, -(-len(self.names) // self.page_size))
+
+    def page(self, number=1):
+        """Envelope KIND_ROSTER (seq = versão) de uma página, montado uma vez por versão.
+        Corpo: "página total_de_páginas total_de_nomes" e um nome por linha."""
+        number = min(max(1, number), self.page_count())
+        payload = self._pages.get(number)
+        if payload is None:
+            if self._ordered is None:
+                self._ordered = list(self.names.values())
+            inicio = (number - 1) * self.page_size
+            linhas = [f"{number} {self.page_count()} {len(self.names)}"]
+            linhas.extend(self._ordered[inicio:inicio + self.page_size])
+            payload = self._pages[number] = envelope.encode(envelope.KIND_ROSTER, "\n".join(linhas),
+                                                            seq=self.version)
+        return payload
+
+def parse_page(body):
+    """(página, total de páginas, total de nomes, nomes) do corpo de um KIND_ROSTER"""
+    cabecalho, _, nomes = body.partition("\n")
+    page, pages, total = (int(campo) for campo in cabecalho.split())
+    return page, pages, total, nomes.split("\n") if nomes else []
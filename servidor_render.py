@@ -1,143 +1,794 @@
 # servidor.py - Adapted for WebSockets and Render.com deployment
 
 import asyncio
+import atexit
+import datetime
+import gc
+import json
+import multiprocessing
 import os
 import signal
 import sys
 import time
+import tracemalloc
+from collections import deque
 import websockets
-from cryptography.fernet import Fernet
+import websockets.legacy.server
 from colorama import init, Fore, Style
+import applog
+import cryptog
+from admission import AdmissionControl, forwarded_ip
+import envelope
+from cryptopool import CryptoOffload
+from lagmon import LoopLagMonitor
+from bus import BusClient, BusHub
+from history import HistoryStore
+from msglog import MessageLog
+from roster import Roster
+from sessions import SessionStore
+import metrics
 
 # Inicialização do colorama
 init(autoreset=True)
+log = applog.setup()
 
 # ========== CONFIGURAÇÕES ==========
 PORT = int(os.environ.get("PORT", 10000))
+FANOUT_DEBUG = os.environ.get("FANOUT_DEBUG", "0") == "1"
+FANOUT_REPORT_INTERVAL = float(os.environ.get("FANOUT_REPORT_INTERVAL", 60))
+SEND_QUEUE_SIZE = int(os.environ.get("SEND_QUEUE_SIZE", 256))
+# Política para fila cheia: drop_oldest, coalesce ou disconnect
+SLOW_CONSUMER_POLICY = os.environ.get("SLOW_CONSUMER_POLICY", "drop_oldest")
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+if SLOW_CONSUMER_POLICY not in SLOW_CONSUMER_POLICIES:
+    SLOW_CONSUMER_POLICY = "drop_oldest"
+# Modo multi-processo: WORKERS > 1 cria workers que compartilham a porta (SO_REUSEPORT)
+WORKERS = int(os.environ.get("WORKERS", 1))
+BUS_SOCKET = os.environ.get("BUS_SOCKET", f"/tmp/chat-online-{os.getpid()}.sock")
+# Histórico em memória reenviado a quem entra
+DEFAULT_ROOM = "geral"
+HISTORY_MAX_MESSAGES = int(os.environ.get("HISTORY_MAX_MESSAGES", 100))
+HISTORY_MAX_BYTES = int(os.environ.get("HISTORY_MAX_BYTES", 64 * 1024))
+HISTORY_BATCH = int(os.environ.get("HISTORY_BATCH", 20))
+HISTORY_BATCH_DELAY = float(os.environ.get("HISTORY_BATCH_DELAY", 0.05))
+HISTORY_REPLAY_CONCURRENCY = int(os.environ.get("HISTORY_REPLAY_CONCURRENCY", 32))
+# Log de mensagens em disco, consultado por /history
+MESSAGE_LOG = os.environ.get("MESSAGE_LOG", "1") == "1"
+LOG_DIR = os.environ.get("LOG_DIR", "chat_log")
+LOG_SEGMENT_BYTES = int(os.environ.get("LOG_SEGMENT_BYTES", 4 * 1024 * 1024))
+LOG_INDEX_INTERVAL = int(os.environ.get("LOG_INDEX_INTERVAL", 64))
+LOG_MAX_SEGMENTS = int(os.environ.get("LOG_MAX_SEGMENTS", 16))
+HISTORY_PAGE_MAX = int(os.environ.get("HISTORY_PAGE_MAX", 50))
+# Nomes por página do /users
+USERS_PAGE_SIZE = int(os.environ.get("USERS_PAGE_SIZE", 100))
+
+# Resume de sessão: segundos em que o nome fica reservado após uma queda (0 = desliga)
+SESSION_GRACE = float(os.environ.get("SESSION_GRACE", 30))
+SESSION_MAX_PENDING = int(os.environ.get("SESSION_MAX_PENDING", 100))
+CLOSE_REPLACED = 4000         # conexão antiga fechada porque a sessão foi retomada em outra
+CLOSE_SESSION_EXPIRED = 4001  # resume recusado: o cliente deve fazer login de novo
+# Cifra fora do loop: "off", "thread" ou "process"; liga só quando o lag passa do limiar (0 = sempre)
+CRYPTO_EXECUTOR = os.environ.get("CRYPTO_EXECUTOR", "thread")
+CRYPTO_WORKERS = int(os.environ.get("CRYPTO_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+CRYPTO_LAG_THRESHOLD_MS = float(os.environ.get("CRYPTO_LAG_THRESHOLD_MS", 20))
+CRYPTO_BATCH_MAX = int(os.environ.get("CRYPTO_BATCH_MAX", 64))
+
+# Lag do event loop: amostragem, janela dos percentis e limiar que tira o /healthz do ar
+LAG_SAMPLE_INTERVAL = float(os.environ.get("LAG_SAMPLE_INTERVAL", 0.1))
+LAG_WINDOW_SECONDS = float(os.environ.get("LAG_WINDOW_SECONDS", 30))
+HEALTH_LAG_THRESHOLD_MS = float(os.environ.get("HEALTH_LAG_THRESHOLD_MS", 250))
+HEALTH_LAG_SUSTAIN = float(os.environ.get("HEALTH_LAG_SUSTAIN", 5))
+
+# Admissão (0 = sem limite; com WORKERS > 1 valem por worker): logins simultâneos,
+# conexões por IP e conexões no total. Acima deles a conexão é recusada antes do upgrade.
+MAX_HANDSHAKES = int(os.environ.get("MAX_HANDSHAKES", 64))
+MAX_CONNECTIONS_PER_IP = int(os.environ.get("MAX_CONNECTIONS_PER_IP", 20))
+MAX_CONNECTIONS = int(os.environ.get("MAX_CONNECTIONS", 5000))
+LOGIN_TIMEOUT = float(os.environ.get("LOGIN_TIMEOUT", 30))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 2))
+# Atrás do proxy do Render o IP do cliente vem no X-Forwarded-For (render.yaml liga);
+# exposto direto, o cabeçalho seria forjável e furaria o limite por IP
+TRUST_PROXY = os.environ.get("TRUST_PROXY", "0") == "1"
+CLOSE_TRY_AGAIN = 1013  # "Try Again Later": limite atingido depois do upgrade
+
+# Orçamento de memória por conexão (bytes) para os buffers do websockets; 0 = padrões do
+# websockets (até 32 mensagens de 1 MiB na fila de entrada de cada conexão)
+CONNECTION_MEMORY_BUDGET = int(os.environ.get("CONNECTION_MEMORY_BUDGET", 256 * 1024))
+# MEMORY_TRACE=1 liga o tracemalloc e o relatório em /memory (deixa o servidor mais lento)
+MEMORY_TRACE = os.environ.get("MEMORY_TRACE", "0") == "1"
+if MEMORY_TRACE:
+    tracemalloc.start()
+
+# Motores de cifra aceitos, em ordem de preferência do servidor
+CIPHER_ENGINES = [name for name in os.environ.get("CIPHER_ENGINES", "aesgcm,chacha20,fernet").split(",")
+                  if name in cryptog.ENGINES]
+
+def connection_limits(budget):
+    """Parâmetros do websockets.serve que cabem em `budget` bytes por conexão.
+    Pior caso: max_queue * max_size (entrada) + read_limit + write_limit = 3/4 do orçamento;
+    o resto fica para a fila de saída e os objetos da conexão. Sem permessage-deflate: os
+    frames já vão cifrados (não comprimem) e os contextos zlib custam ~45 KB por conexão."""
+    if budget <= 0:
+        return {}
+    fatia = max(4096, budget // 8)
+    return {
+        "max_size": fatia,
+        "max_queue": max(1, (budget // 2) // fatia),
+        "read_limit": fatia,
+        "write_limit": fatia,
+        "compression": None,
+    }
 
 # ========== GERENCIADOR DE CORES ==========
+def paint(style, msg):
+    """Aplica a cor só quando a saída é um terminal"""
+    return style + msg if applog.color_enabled else msg
+
 class ColorManager:
     @staticmethod
     def system(msg):
-        return Fore.MAGENTA + Style.BRIGHT + msg
+        return paint(Fore.MAGENTA + Style.BRIGHT, msg)
     
     @staticmethod
     def error(msg):
-        return Fore.RED + msg
+        return paint(Fore.RED, msg)
     
     @staticmethod
     def success(msg):
-        return Fore.GREEN + msg
+        return paint(Fore.GREEN, msg)
     
     @staticmethod
     def warning(msg):
-        return Fore.YELLOW + msg
+        return paint(Fore.YELLOW, msg)
     
     @staticmethod
     def info(msg):
-        return Fore.CYAN + msg
+        return paint(Fore.CYAN, msg)
 
 # ========== ESTADO GLOBAL ==========
-clients = {}
-clients_lock = asyncio.Lock()
+class ClientRegistry:
+    """Clientes registrados neste processo, pensado para um único event loop.
+    Nenhum método tem await: cada operação é atômica em relação às outras tasks, sem lock.
+    A iteração usa um snapshot imutável (copy-on-write): refeito só depois de uma
+    entrada/saída e compartilhado por todos os broadcasts até a próxima."""
+
+    def __init__(self):
+        self._by_ws = {}
+        self._by_name = {}    # nome em casefold -> websocket
+        self._snapshot = ()
+        self._stale = False
+
+    def __len__(self):
+        return len(self._by_ws)
+
+    def __contains__(self, websocket):
+        return websocket in self._by_ws
+
+    def get(self, websocket):
+        return self._by_ws.get(websocket)
+
+    def register(self, websocket, data):
+        self._by_ws[websocket] = data
+        self._by_name[data.username.casefold()] = websocket
+        self._stale = True
+
+    def unregister(self, websocket):
+        """Remove o cliente e devolve seus dados (None se não estava registrado)"""
+        data = self._by_ws.pop(websocket, None)
+        if data is None:
+            return None
+        # Após um takeover o nome pode já apontar para a conexão nova
+        if self._by_name.get(data.username.casefold()) is websocket:
+            del self._by_name[data.username.casefold()]
+        self._stale = True
+        return data
+
+    def find(self, username):
+        """Busca O(1) de (websocket, dados) pelo nome, sem diferenciar maiúsculas"""
+        websocket = self._by_name.get(username.casefold())
+        if websocket is None:
+            return None, None
+        return websocket, self._by_ws[websocket]
+
+    def snapshot(self):
+        """Tupla (websocket, dados) estável: pode ser percorrida mesmo com awaits no meio"""
+        if self._stale:
+            self._snapshot = tuple(self._by_ws.items())
+            self._stale = False
+        return self._snapshot
+
+    def values(self):
+        return [data for _, data in self.snapshot()]
+
+clients = ClientRegistry()
+histories = HistoryStore(HISTORY_MAX_MESSAGES, HISTORY_MAX_BYTES)
+replay_slots = asyncio.Semaphore(HISTORY_REPLAY_CONCURRENCY)
+# ========== MÉTRICAS ==========
+registry = metrics.Registry()
+connected_clients = registry.gauge("chat_connected_clients", "Clientes registrados neste processo",
+                                   lambda: len(clients))
+messages_in = registry.counter("chat_messages_in_total", "Frames recebidos de clientes registrados")
+messages_out = registry.counter("chat_messages_out_total", "Frames enviados pelas filas de saída")
+bytes_in = registry.counter("chat_bytes_in_total", "Bytes cifrados recebidos")
+bytes_out = registry.counter("chat_bytes_out_total", "Bytes cifrados enviados")
+decrypt_failures = registry.counter("chat_decrypt_failures_total", "Frames que não puderam ser decifrados")
+dropped_messages = registry.counter("chat_dropped_messages_total", "Mensagens descartadas por filas cheias")
+# Filas de saída no momento da coleta: gauges, porque os valores sobem e descem
+queue_depth_max = registry.gauge("chat_send_queue_depth_max", "Maior fila de saída entre os clientes")
+queue_depth_total = registry.gauge("chat_send_queue_depth_total", "Itens somando as filas de saída")
+fanout_seconds = registry.histogram("chat_broadcast_fanout_seconds", "Tempo de fan-out de um broadcast")
+log_dropped = registry.gauge("chat_log_dropped", "Registros de log descartados por fila cheia", applog.dropped)
+handler_seconds = registry.histogram("chat_handler_processing_seconds", "Tempo para processar uma mensagem recebida")
+
+def collect_queue_depths():
+    depths = [data.outbox.depth() for data in clients.values()]
+    queue_depth_max.set(max(depths, default=0))
+    queue_depth_total.set(sum(depths))
+
+registry.on_collect(collect_queue_depths)
+
+lag_monitor = LoopLagMonitor(LAG_SAMPLE_INTERVAL, LAG_WINDOW_SECONDS,
+                             HEALTH_LAG_THRESHOLD_MS / 1000, HEALTH_LAG_SUSTAIN)
+registry.gauge("chat_event_loop_lag_seconds", "Lag médio (móvel) do event loop", lambda: lag_monitor.lag)
+registry.gauge("chat_event_loop_lag_p99_seconds", "p99 do lag do event loop na janela",
+               lambda: lag_monitor.percentile(0.99))
+registry.gauge("chat_ready", "0 quando o /healthz responde 503 por lag", lambda: int(not lag_monitor.degraded()))
+
+crypto = CryptoOffload(CRYPTO_EXECUTOR, CRYPTO_WORKERS, CRYPTO_LAG_THRESHOLD_MS / 1000,
+                       CRYPTO_BATCH_MAX, registry=registry)
+
+# Só o processo único (ou o hub, no modo multi-processo) escreve; workers apenas leem
+message_log = MessageLog(LOG_DIR, LOG_SEGMENT_BYTES, LOG_INDEX_INTERVAL, LOG_MAX_SEGMENTS)
+
+# Sessões do modo processo único; no modo multi-processo quem guarda é o hub
+sessions = SessionStore(SESSION_GRACE, SESSION_MAX_PENDING)
+roster = Roster(USERS_PAGE_SIZE)  # modo processo único; no multi-processo vale o espelho do hub (bus.roster)
+admission = AdmissionControl(MAX_HANDSHAKES, MAX_CONNECTIONS_PER_IP, MAX_CONNECTIONS, registry)
+
+# Preenchidos apenas nos workers do modo multi-processo
+bus = None
+WORKER_ID = None
 
 # Chave FIXA para evitar problemas de transmissão
-CHAVE_SECRETA = Fernet.generate_key()
-print("=" * 60)
-print("🚀 INICIANDO SERVIDOR DE CHAT - RENDER.COM")
-print("=" * 60)
-print(f"🔑 Chave FIXA gerada: {CHAVE_SECRETA.decode()[:50]}...")
-print(f"🌐 Porta: {PORT}")
-print("=" * 60)
+CHAVE_SECRETA = cryptog.generate_key()
+log.info("🚀 INICIANDO SERVIDOR DE CHAT - RENDER.COM")
+log.info("🔑 Chave FIXA gerada: %s...", CHAVE_SECRETA.decode()[:50])
+log.info("🔐 Motores de cifra: %s", ", ".join(CIPHER_ENGINES))
+log.info("🧮 Cifra fora do loop: %s (%d workers, limiar de lag %.0f ms)",
+         CRYPTO_EXECUTOR, CRYPTO_WORKERS, CRYPTO_LAG_THRESHOLD_MS)
+log.info("🌐 Porta: %d", PORT)
+if CONNECTION_MEMORY_BUDGET > 0:
+    log.info("🧠 Orçamento por conexão: %d KiB (%s)", CONNECTION_MEMORY_BUDGET // 1024,
+             ", ".join(f"{key}={value}" for key, value in connection_limits(CONNECTION_MEMORY_BUDGET).items()))
+
+class ClientSession:
+    """Estado de um cliente registrado; __slots__ evita um dict por conexão"""
+    __slots__ = ("username", "ip", "join_time", "cipher", "outbox", "token")
+
+    def __init__(self, username, ip, cipher, outbox, token):
+        self.username = username
+        self.ip = ip
+        self.join_time = time.time()
+        self.cipher = cipher
+        self.outbox = outbox
+        self.token = token
+
+def current_roster():
+    """Lista de presença: espelho do hub no modo multi-processo, senão a local (inclui sessões em graça)"""
+    return bus.roster if bus else roster
+
+def online_usernames():
+    return list(current_roster().values())
+
+def online_count():
+    return len(current_roster())
 
 def validate_username(username):
     return (2 <= len(username) <= 20 and 
             not username.startswith('/') and 
             all(c.isalnum() or c in '_- ' for c in username))
 
-async def send_system_message(websocket, message):
+# ========== FILAS DE SAÍDA ==========
+class OutboundQueue:
+    """Fila de saída limitada de um cliente, drenada por uma task escritora dedicada"""
+
+    def __init__(self, websocket, username, cipher, maxsize=SEND_QUEUE_SIZE, policy=SLOW_CONSUMER_POLICY):
+        self.websocket = websocket
+        self.username = username
+        self.cipher = cipher
+        self.maxsize = maxsize
+        self.policy = policy
+        self.items = deque()
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.coalesced = 0
+        self.closing = False
+        self.task = None
+
+    def depth(self):
+        return len(self.items)
+
+    def put(self, data):
+        """Enfileira sem bloquear; aplica a política de cliente lento se a fila estiver cheia"""
+        if self.closing:
+            return False
+
+        if len(self.items) >= self.maxsize:
+            dropped_messages.inc()
+            if self.policy == "drop_oldest":
+                self.items.popleft()
+                self.dropped += 1
+            elif self.policy == "coalesce":
+                # Um único marcador representa todas as mensagens descartadas
+                if self.coalesced == 0:
+                    self.items.append(None)
+                self.coalesced += 1
+                self.dropped += 1
+                return False
+            else:
+                self.closing = True
+                self.items.clear()
+                log.warning(ColorManager.warning("🐢 %s desconectado: fila de saída cheia"), self.username)
+                asyncio.create_task(self.websocket.close(1008, "Cliente lento"))
+                return False
+
+        self.items.append(data)
+        self.ready.set()
+        return True
+
+    def start(self):
+        self.task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        self.closing = True
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def _writer(self):
+        """Envia os itens na ordem; só esta task espera pelo dreno do socket"""
+        try:
+            while True:
+                if not self.items:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+
+                data = self.items.popleft()
+                if isinstance(data, asyncio.Future):
+                    # Cifrado no pool: espera o lote sem perder a ordem da fila
+                    try:
+                        data = await data
+                    except Exception as e:
+                        # Pular a mensagem deixaria o cliente com um buraco calado na conversa:
+                        # fecha com erro interno e o handler faz a saída (e o resume, se houver graça)
+                        log.error(ColorManager.error("💥 Falha ao cifrar para %s: %s"), self.username, e)
+                        self.closing = True
+                        self.items.clear()
+                        asyncio.create_task(self.websocket.close(1011, "Erro interno do servidor"))
+                        return
+                elif data is None:
+                    omitidas = self.coalesced
+                    self.coalesced = 0
+                    data = self.cipher.encrypt(envelope.encode(
+                        envelope.KIND_SYSTEM, f"⚠️ {omitidas} mensagens omitidas (conexão lenta)"))
+                await self.websocket.send(data)
+                messages_out.inc()
+                bytes_out.inc(len(data))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+def queue_depths():
+    """Retorna (usuário, profundidade, descartadas) de cada cliente, do mais atrasado ao menos"""
+    depths = [(data.username, data.outbox.depth(), data.outbox.dropped)
+              for data in clients.values()]
+    return sorted(depths, key=lambda item: item[1], reverse=True)
+
+def cipher_for(websocket):
+    """Motor de cifra (em cache) negociado no handshake desta conexão"""
+    return cryptog.get_engine(cryptog.engine_from_subprotocol(websocket.subprotocol), CHAVE_SECRETA)
+
+async def send_envelope(websocket, kind, body="", sender="", room="", seq=0, timestamp=None):
+    """Cifra um envelope para um único cliente; se registrado, vai pela fila de saída"""
     try:
-        encrypted_msg = Fernet(CHAVE_SECRETA).encrypt(f"[Sistema] {message}".encode())
-        await websocket.send(encrypted_msg)
+        payload = envelope.encode(kind, body, sender, room, seq, timestamp)
+        client = clients.get(websocket)
+        if client:
+            client.outbox.put(crypto.encrypt_nowait(client.cipher, payload))
+        else:
+            await websocket.send(cipher_for(websocket).encrypt(payload))
     except:
         pass
 
-async def broadcast_message(message_str, skip_ws=None):
+async def send_system_message(websocket, message):
+    await send_envelope(websocket, envelope.KIND_SYSTEM, message)
+
+# ========== FAN-OUT ==========
+fanout_stats = {
+    "broadcasts": 0,
+    "deliveries": 0,
+    "total_ms": 0.0,
+    "max_ms": 0.0,
+    "last_ms": 0.0
+}
+
+def record_fanout(recipients, elapsed_ms):
+    """Acumula o tempo de fan-out de um broadcast"""
+    fanout_stats["broadcasts"] += 1
+    fanout_stats["deliveries"] += recipients
+    fanout_stats["total_ms"] += elapsed_ms
+    fanout_stats["last_ms"] = elapsed_ms
+    fanout_stats["max_ms"] = max(fanout_stats["max_ms"], elapsed_ms)
+    fanout_seconds.observe(elapsed_ms / 1000)
+
+message_seq = 0
+
+def sequence_message(room, sender, body):
+    """(seq, timestamp) de uma mensagem de sala; com o log ativo, o próprio log é o sequenciador"""
+    global message_seq
+    timestamp = time.time()
+    if MESSAGE_LOG:
+        return message_log.append(room, sender, body, timestamp), timestamp
+    message_seq += 1
+    return message_seq, timestamp
+
+async def broadcast_message(kind, body="", sender="", skip_ws=None, room=None):
+    """Entrega um envelope a todos; no modo multi-processo passa pelo hub, que o ordena e retransmite.
+    Com room, a mensagem recebe número de sequência e entra no histórico da sala."""
+    skip_id = id(skip_ws) if skip_ws else None
+    if bus:
+        bus.publish({"op": "chat", "kind": kind, "body": body, "sender": sender,
+                     "room": room, "skip": skip_id})
+        return
+    seq, timestamp = sequence_message(room, sender, body) if room else (0, None)
+    deliver_local(envelope.encode(kind, body, sender, room or "", seq, timestamp), skip_id, room)
+
+def deliver_local(payload, skip_id=None, room=None):
+    """Cifra o envelope uma única vez por motor e o entrega aos clientes deste processo sem esperar nenhum"""
+    if room:
+        histories.room(room).append(payload)
     if not clients:
         return
-        
-    encrypted_msg = Fernet(CHAVE_SECRETA).encrypt(message_str.encode())
-    
-    async with clients_lock:
-        current_clients = list(clients.keys())
-    
-    for ws in current_clients:
-        if ws != skip_ws:
-            try:
-                await ws.send(encrypted_msg)
-            except:
-                async with clients_lock:
-                    if ws in clients:
-                        del clients[ws]
+
+    inicio = time.perf_counter()
+    ciphertexts = {}
+
+    # Apenas enfileira: cada escritor drena o seu socket, então um cliente
+    # lento não atrasa a entrega para os demais
+    recipients = 0
+    for ws, data in clients.snapshot():
+        if id(ws) != skip_id:
+            cipher = data.cipher
+            encrypted_msg = ciphertexts.get(cipher.name)
+            if encrypted_msg is None:
+                encrypted_msg = ciphertexts[cipher.name] = crypto.encrypt_nowait(cipher, payload)
+            data.outbox.put(encrypted_msg)
+            recipients += 1
+
+    elapsed_ms = (time.perf_counter() - inicio) * 1000
+    record_fanout(recipients, elapsed_ms)
+    if FANOUT_DEBUG:
+        log.debug("📤 Fan-out para %d clientes em %.2f ms", recipients, elapsed_ms)
+
+async def report_stats():
+    """Task que imprime periodicamente o fan-out e os clientes com fila acumulada"""
+    ultimo_total = 0
+    while True:
+        await asyncio.sleep(FANOUT_REPORT_INTERVAL)
+        total = fanout_stats["broadcasts"]
+        if total != ultimo_total:
+            media = fanout_stats["total_ms"] / total
+            log.info("📊 Fan-out: %d broadcasts, %d entregas, média %.2f ms, máx %.2f ms",
+                     total, fanout_stats["deliveries"], media, fanout_stats["max_ms"])
+            ultimo_total = total
+
+        mensagens, conteudo, memoria = histories.stats()
+        if mensagens:
+            log.info("🧠 Histórico: %d mensagens, %.1f KB de payload, ~%.1f KB em memória",
+                     mensagens, conteudo / 1024, memoria / 1024)
+
+        atrasados = [item for item in queue_depths() if item[1] >= SEND_QUEUE_SIZE // 2]
+        if atrasados:
+            resumo = ", ".join(f"{nome}={depth} (descartadas {dropped})"
+                               for nome, depth, dropped in atrasados[:10])
+            log.warning(ColorManager.warning("🐢 Filas de saída acumuladas: %s"), resumo)
+
+async def missed_messages(room, last_seq):
+    """(payloads da sala com seq > last_seq, completo). Vêm do histórico em memória e, se ele
+    não cobrir o intervalo, do log em disco; last_seq 0 = o histórico em memória inteiro"""
+    ring = histories.room(room).snapshot()
+    if not last_seq:
+        return ring, True
+    seqs = [envelope.decode(payload).seq for payload in ring]
+    if seqs and last_seq > seqs[-1]:
+        # A numeração recomeçou (reinício sem log): a seq do cliente não vale mais
+        return ring, True
+    perdidas = [payload for seq, payload in zip(seqs, ring) if seq > last_seq]
+    if seqs and seqs[0] <= last_seq + 1:
+        return perdidas, True
+    if not MESSAGE_LOG:
+        return perdidas, not seqs
+
+    primeira = seqs[0] if seqs else None
+    records = await asyncio.to_thread(message_log.read_after, last_seq, room, HISTORY_PAGE_MAX)
+    antigas = [envelope.encode(envelope.KIND_CHAT, text, sender, room, seq, timestamp)
+               for seq, timestamp, sender, text in records if primeira is None or seq < primeira]
+    completo = len(records) < HISTORY_PAGE_MAX or (primeira is not None and records[-1][0] >= primeira - 1)
+    return antigas + perdidas, completo
+
+async def replay_history(websocket, room, last_seq=0):
+    """Reenvia o histórico da sala (ou só o que veio depois de last_seq) em lotes espaçados,
+    para uma onda de logins não travar o loop"""
+    backlog, completo = await missed_messages(room, last_seq)
+    if not backlog:
+        return
+
+    client = clients.get(websocket)
+    if not client:
+        return
+    cipher = client.cipher
+    outbox = client.outbox
+
+    async with replay_slots:
+        if not completo:
+            outbox.put(crypto.encrypt_nowait(cipher, envelope.encode(
+                envelope.KIND_SYSTEM, "⚠️ Nem tudo o que você perdeu cabe aqui; use /history para ver mais")))
+        titulo = (f"📜 {len(backlog)} mensagens desde a sua última conexão:" if last_seq
+                  else f"📜 Últimas {len(backlog)} mensagens:")
+        outbox.put(crypto.encrypt_nowait(cipher, envelope.encode(envelope.KIND_SYSTEM, titulo)))
+        for inicio in range(0, len(backlog), HISTORY_BATCH):
+            if websocket not in clients:
+                return
+            for payload in backlog[inicio:inicio + HISTORY_BATCH]:
+                outbox.put(crypto.encrypt_nowait(cipher, payload))
+            await asyncio.sleep(HISTORY_BATCH_DELAY)
+        outbox.put(crypto.encrypt_nowait(cipher, envelope.encode(envelope.KIND_SYSTEM, "📜 Fim do histórico")))
+
+# ========== /history ==========
+HISTORY_USAGE = "Uso: /history [n] ou /history <desde>, com desde = 30m, 2h, 1d ou HH:MM"
+
+def parse_history_args(arg):
+    """Interpreta o argumento de /history: ('last', n), ('since', timestamp) ou None"""
+    arg = arg.strip().lower()
+    if not arg:
+        return "last", 20
+    if arg.isdigit():
+        return "last", max(1, min(int(arg), HISTORY_PAGE_MAX))
+
+    unidades = {"m": 60, "h": 3600, "d": 86400}
+    if arg[-1] in unidades and arg[:-1].isdigit():
+        return "since", time.time() - int(arg[:-1]) * unidades[arg[-1]]
+
+    try:
+        hora = datetime.datetime.strptime(arg, "%H:%M").time()
+    except ValueError:
+        return None
+    desde = datetime.datetime.combine(datetime.date.today(), hora)
+    if desde > datetime.datetime.now():
+        desde -= datetime.timedelta(days=1)
+    return "since", desde.timestamp()
+
+async def send_history(websocket, arg, room):
+    """Pagina o log em disco (via mmap, fora do loop) e envia o resultado ao cliente"""
+    parsed = parse_history_args(arg)
+    if parsed is None:
+        await send_system_message(websocket, HISTORY_USAGE)
+        return
+    if not MESSAGE_LOG:
+        await send_system_message(websocket, "Histórico em disco desativado neste servidor")
+        return
+
+    modo, valor = parsed
+    if modo == "last":
+        records = await asyncio.to_thread(message_log.read_last, valor, room)
+    else:
+        records = await asyncio.to_thread(message_log.read_since, valor, room, HISTORY_PAGE_MAX)
+
+    if not records:
+        await send_system_message(websocket, "📜 Nenhuma mensagem encontrada")
+        return
+
+    client = clients.get(websocket)
+    if not client:
+        return
+    await send_system_message(websocket, f"📜 {len(records)} mensagens:")
+    for seq, timestamp, sender, text in records:
+        payload = envelope.encode(envelope.KIND_HISTORY, text, sender, room, seq, timestamp)
+        client.outbox.put(crypto.encrypt_nowait(client.cipher, payload))
+    if modo == "since" and len(records) == HISTORY_PAGE_MAX:
+        await send_system_message(websocket, f"📜 Mostrando as primeiras {HISTORY_PAGE_MAX}; use um horário posterior para continuar")
+
+# ========== SESSÕES ==========
+async def resume_session(token):
+    """(nome, token novo, PMs pendentes) se a sessão ainda está na janela de graça, senão None"""
+    if bus:
+        return await bus.resume(token)
+    # Token de sessão já vencida: libera o nome agora, para o /login que vem em seguida
+    end_expired_session(sessions.expire_token(token))
+    resumed = sessions.resume(token)
+    if not resumed:
+        return None
+    session, pending = resumed
+    return session.username, session.token, pending
+
+def take_over(username):
+    """Fecha a conexão antiga de quem retomou a sessão, sem aviso de saída"""
+    websocket, _ = clients.find(username)
+    if websocket is None:
+        return
+    data = clients.unregister(websocket)
+    asyncio.create_task(close_replaced(websocket, data.outbox))
+
+async def close_replaced(websocket, outbox):
+    await outbox.stop()
+    await websocket.close(CLOSE_REPLACED, "Sessão retomada em outra conexão")
+
+def end_expired_session(session):
+    """Tira da lista quem estava em graça e avisa a saída (None: nada a fazer)"""
+    if session is None:
+        return
+    log.info("⌛ Sessão de %s expirou", session.username)
+    version = roster.remove(session.username)
+    if version is not None:
+        deliver_presence(envelope.KIND_LEAVE, session.username, version)
+
+async def expire_sessions():
+    """Task do modo processo único: encerra as sessões cuja janela de graça acabou"""
+    while True:
+        await asyncio.sleep(1)
+        for session in sessions.expire():
+            end_expired_session(session)
+
+def deliver_presence(kind, username, version):
+    """Aviso de entrada/saída com a versão da lista no seq; quem entrou não recebe o próprio aviso"""
+    websocket, _ = clients.find(username) if kind == envelope.KIND_JOIN else (None, None)
+    deliver_local(envelope.encode(kind, "", username, "", version), id(websocket) if websocket else None)
+
+async def on_bus_message(msg):
+    """Eventos vindos do hub para os clientes deste worker"""
+    try:
+        if msg["op"] == "chat":
+            skip_id = msg["skip"] if msg["worker"] == WORKER_ID else None
+            payload = envelope.encode(msg["kind"], msg["body"], msg["sender"], msg["room"] or "",
+                                      msg.get("seq", 0), msg.get("ts"))
+            deliver_local(payload, skip_id, msg["room"])
+        elif msg["op"] == "pm":
+            target_ws, _ = clients.find(msg["to"])
+            if target_ws:
+                await send_envelope(target_ws, envelope.KIND_PRIVATE, msg["text"], msg["from"])
+        elif msg["op"] == "presence":
+            kind = envelope.KIND_JOIN if msg["event"] == "join" else envelope.KIND_LEAVE
+            deliver_presence(kind, msg["username"], msg["version"])
+        elif msg["op"] == "takeover":
+            take_over(msg["username"])
+    except Exception as e:
+        log.error("❌ Erro processando evento do barramento: %s", e)
 
 async def handler(websocket, path):
-    client_ip = websocket.remote_address[0] if websocket.remote_address else "unknown"
-    print(f"📡 Nova conexão de: {client_ip}")
+    client_ip = websocket.client_ip
+    # Os limites podem ter sido atingidos enquanto o upgrade desta conexão terminava
+    ticket = admission.enter(client_ip)
+    if ticket is None:
+        await websocket.close(CLOSE_TRY_AGAIN, "Servidor cheio, tente mais tarde")
+        return
+    log.info("📡 Nova conexão de: %s", client_ip)
+    cipher = cipher_for(websocket)
+    saiu = False
     
     try:
         # ENVIAR CHAVE PRIMEIRO - como texto base64 para evitar corrupção
         chave_b64 = CHAVE_SECRETA.decode('utf-8')
         await websocket.send(chave_b64)
-        print(f"🔑 Chave enviada para {client_ip}")
+        log.debug("🔑 Chave enviada para %s (motor: %s)", client_ip, cipher.name)
 
-        # Receber username criptografado
-        encrypted_username = await asyncio.wait_for(websocket.recv(), timeout=30.0)
+        # Receber username criptografado (ou "/resume <token> <última seq>")
+        encrypted_username = await asyncio.wait_for(websocket.recv(), timeout=LOGIN_TIMEOUT)
         
         # Tentar descriptografar
         try:
-            username = Fernet(CHAVE_SECRETA).decrypt(encrypted_username).decode('utf-8').strip()
-            print(f"✅ Login bem-sucedido: {username}")
+            username = (await crypto.decrypt(cipher, encrypted_username)).decode('utf-8').strip()
         except Exception as e:
-            print(f"❌ Falha na descriptografia de {client_ip}: {e}")
+            decrypt_failures.inc()
+            log.warning("❌ Falha na descriptografia de %s: %s", client_ip, e)
             await websocket.close(1008, "Erro de autenticação")
             return
-        
-        if not validate_username(username):
-            await websocket.close(1008, "Nome de usuário inválido")
-            return
 
-        # Verificar duplicata
-        async with clients_lock:
-            if any(data["username"].lower() == username.lower() for data in clients.values()):
+        resumed = None
+        if username.startswith("/resume "):
+            partes = username.split()
+            try:
+                token = partes[1]
+                last_seq = int(partes[2]) if len(partes) > 2 else 0
+            except (IndexError, ValueError):
+                await websocket.close(1008, "Pedido de resume inválido")
+                return
+            resumed = await resume_session(token)
+            if not resumed:
+                await websocket.close(CLOSE_SESSION_EXPIRED, "Sessão expirada")
+                return
+            # Sessão válida: sem nova validação de nome e sem aviso de presença
+            username, session_token, pending = resumed
+            take_over(username)
+            log.info("🔄 %s retomou a sessão (última seq %d)", username, last_seq)
+        else:
+            last_seq = 0
+            if username.startswith("/login "):
+                # Reconexão sem sessão (ex.: servidor reiniciou): login normal + a última seq vista
+                partes = username.split(" ", 2)
+                if len(partes) < 3 or not partes[1].isdigit():
+                    await websocket.close(1008, "Pedido de login inválido")
+                    return
+                last_seq = int(partes[1])
+                username = partes[2].strip()
+
+            if not validate_username(username):
+                await websocket.close(1008, "Nome de usuário inválido")
+                return
+
+            # Verificar duplicata (no modo multi-processo quem decide é o hub)
+            if bus:
+                name_free, session_token = await bus.claim(username)
+            else:
+                # Graça vencida mas ainda não varrida: o nome já está livre
+                end_expired_session(sessions.expire_user(username))
+                name_free = username not in roster
+                session_token = sessions.issue(username) if name_free else None
+            if not name_free:
                 await websocket.close(1008, "Nome já está em uso")
                 return
+            log.info("✅ Login bem-sucedido: %s", username)
+
+        # Registrar cliente (sem await: atômico em relação às outras tasks)
+        outbox = OutboundQueue(websocket, username, cipher)
+        clients.register(websocket, ClientSession(username, client_ip, cipher, outbox, session_token))
+        outbox.start()
+        # No multi-processo a entrada já foi anunciada pelo hub no claim
+        join_version = roster.add(username) if not bus and not resumed else None
+        user_count = online_count()
+        ticket.logged_in()
 
-            # Registrar cliente
-            clients[websocket] = {
-                "username": username,
-                "ip": client_ip,
-                "join_time": time.time()
-            }
-            user_count = len(clients)
+        if SESSION_GRACE > 0:
+            await send_envelope(websocket, envelope.KIND_SESSION, session_token)
 
-        print(f"🎉 {username} conectou-se ({user_count} usuários online)")
+        if resumed:
+            await send_system_message(websocket, f"🔄 Sessão retomada, {username}.")
+            # PMs recebidas durante a queda e, depois, só as mensagens da sala com seq > last_seq
+            for pm in pending:
+                await send_envelope(websocket, envelope.KIND_PRIVATE, pm["text"], pm["from"])
+            await replay_history(websocket, DEFAULT_ROOM, last_seq)
+        else:
+            log.info("🎉 %s conectou-se (%d usuários online)", username, user_count)
 
-        # Mensagem de boas-vindas
-        await broadcast_message(f"👉 {username} entrou no chat", websocket)
-        await send_system_message(websocket, f"Bem-vindo(a) {username}! {user_count} usuários online.")
-        await send_system_message(websocket, "Comandos: /users, /pm <user> <msg>, /sair")
+            # Mensagem de boas-vindas
+            if join_version is not None:
+                deliver_presence(envelope.KIND_JOIN, username, join_version)
+            await send_system_message(websocket, f"Bem-vindo(a) {username}! {user_count} usuários online.")
+            await send_system_message(websocket, "Comandos: /users, /pm <user> <msg>, /history [n|desde], /sair")
+            await replay_history(websocket, DEFAULT_ROOM, last_seq)
 
         # Loop principal de mensagens
         async for encrypted_msg in websocket:
+            inicio = time.perf_counter()
+            messages_in.inc()
+            bytes_in.inc(len(encrypted_msg))
             try:
-                msg = Fernet(CHAVE_SECRETA).decrypt(encrypted_msg).decode('utf-8').strip()
+                msg = (await crypto.decrypt(cipher, encrypted_msg)).decode('utf-8').strip()
                 
                 if msg.lower() == '/sair':
+                    saiu = True
                     break
-                elif msg.lower() == '/users':
-                    async with clients_lock:
-                        user_list = ", ".join([data["username"] for data in clients.values()])
-                    await send_system_message(websocket, f"👥 Online ({len(clients)}): {user_list}")
+                elif msg.lower() == '/users' or msg.lower().startswith('/users '):
+                    # Página pronta em cache (refeita só quando a lista muda); sem lock
+                    arg = msg[len('/users'):].strip()
+                    page = int(arg) if arg.isdigit() else 1
+                    client = clients.get(websocket)
+                    if client:
+                        client.outbox.put(crypto.encrypt_nowait(client.cipher, current_roster().page(page)))
+                elif msg.lower() == '/history' or msg.lower().startswith('/history '):
+                    await send_history(websocket, msg[len('/history'):], DEFAULT_ROOM)
                 elif msg.lower().startswith('/pm '):
                     parts = msg.split(' ', 2)
                     if len(parts) < 3:
@@ -148,80 +799,250 @@ async def handler(websocket, path):
                     pm_msg = parts[2]
                     
                     # Encontrar usuário alvo
-                    target_ws = None
-                    target_username = None
-                    async with clients_lock:
-                        for ws, data in clients.items():
-                            if data["username"].lower() == target_user.lower():
-                                target_ws = ws
-                                target_username = data["username"]
-                                break
+                    target_ws, target_data = clients.find(target_user)
+                    target_username = target_data.username if target_data else None
                     
                     if target_ws and target_ws != websocket:
-                        await send_system_message(target_ws, f"📩 {username} para você: {pm_msg}")
-                        await send_system_message(websocket, f"📩 Você para {target_username}: {pm_msg}")
+                        await send_envelope(target_ws, envelope.KIND_PRIVATE, pm_msg, username)
+                        await send_envelope(websocket, envelope.KIND_PRIVATE_SENT, pm_msg, target_username)
+                    elif not target_ws and not bus and sessions.add_pending(target_user, {"from": username, "text": pm_msg}):
+                        # Destinatário em graça: recebe a PM quando retomar a sessão
+                        target_username = sessions.detached(target_user).username
+                        await send_envelope(websocket, envelope.KIND_PRIVATE_SENT, pm_msg, target_username)
+                    elif not target_ws and bus and target_user in bus.roster:
+                        # Destinatário conectado em outro worker
+                        bus.publish({"op": "pm", "to": target_user, "from": username, "text": pm_msg})
+                        target_username = bus.roster.get(target_user)
+                        await send_envelope(websocket, envelope.KIND_PRIVATE_SENT, pm_msg, target_username)
                     else:
                         await send_system_message(websocket, f"Usuário '{target_user}' não encontrado")
                 else:
                     # Mensagem normal
-                    async with clients_lock:
-                        if websocket in clients:
-                            await broadcast_message(f"💬 {username}: {msg}", websocket)
+                    if websocket in clients:
+                        await broadcast_message(envelope.KIND_CHAT, msg, username, websocket, DEFAULT_ROOM)
                             
+            except cryptog.DecryptError:
+                decrypt_failures.inc()
+                log.warning("❌ Mensagem de %s não pôde ser decifrada", username)
+                break
             except Exception as e:
-                print(f"❌ Erro processando mensagem de {username}: {e}")
+                log.error("❌ Erro processando mensagem de %s: %s", username, e)
                 break
+            finally:
+                handler_seconds.observe(time.perf_counter() - inicio)
 
     except asyncio.TimeoutError:
-        print(f"⏰ Timeout na autenticação de {client_ip}")
+        log.warning("⏰ Timeout na autenticação de %s", client_ip)
     except websockets.exceptions.ConnectionClosed:
-        print(f"📡 Conexão fechada durante handshake: {client_ip}")
+        log.info("📡 Conexão fechada durante handshake: %s", client_ip)
     except Exception as e:
-        print(f"💥 Erro no handler para {client_ip}: {e}")
+        log.error("💥 Erro no handler para %s: %s", client_ip, e)
     finally:
         # Remover cliente
-        async with clients_lock:
-            if websocket in clients:
-                username = clients[websocket]["username"]
-                del clients[websocket]
-                user_count = len(clients)
-                print(f"👋 {username} desconectou ({user_count} usuários restantes)")
-                await broadcast_message(f"👋 {username} saiu do chat", None)
+        outbox = None
+        # Sem await daqui até ticket.release(): saída e aviso atômicos em relação às outras tasks
+        data = clients.unregister(websocket)
+        if data:
+            username = data.username
+            outbox = data.outbox
+            # Queda sem /sair (e sem fechamento normal): o nome fica reservado pela janela de graça
+            resumable = SESSION_GRACE > 0 and not saiu and websocket.close_code != 1000
+            if resumable and bus:
+                bus.detach(username, data.token)
+                log.info("⏸️ %s caiu; sessão mantida por %.0f s", username, SESSION_GRACE)
+            elif resumable and sessions.detach(data.token):
+                log.info("⏸️ %s caiu; sessão mantida por %.0f s", username, SESSION_GRACE)
+            else:
+                # No multi-processo o hub anuncia a saída a todos os workers
+                if bus:
+                    bus.release(username)
+                else:
+                    sessions.drop(data.token)
+                    version = roster.remove(username)
+                    if version is not None:
+                        deliver_presence(envelope.KIND_LEAVE, username, version)
+                user_count = online_count()
+                log.info("👋 %s desconectou (%d usuários restantes)", username, user_count)
+        ticket.release()
+        if outbox:
+            await outbox.stop()
 
 async def health_check(path, request_headers):
-    """Health check para o Render"""
+    """Health check para o Render e métricas para o Prometheus.
+    /health é só liveness; /healthz responde 503 enquanto o loop estiver atrasado.
+    /memory (só com MEMORY_TRACE=1) mostra a memória rastreada pelo tracemalloc."""
     if path == "/health" or path == "/healthz":
-        return 200, [], b"OK"
+        degraded = lag_monitor.degraded()
+        body = json.dumps({
+            "status": "degraded" if degraded else "ok",
+            "worker": WORKER_ID,
+            "clients": len(clients),
+            "connections": admission.connections,
+            "handshakes": admission.handshakes,
+            "lag": lag_monitor.snapshot(),
+            "lag_threshold_ms": HEALTH_LAG_THRESHOLD_MS,
+        }).encode('utf-8')
+        headers = [("Content-Type", "application/json")]
+        if path == "/healthz" and degraded:
+            return 503, headers + [("Retry-After", str(max(1, round(HEALTH_LAG_SUSTAIN))))], body
+        return 200, headers, body
+    if path == "/metrics":
+        return 200, [("Content-Type", metrics.CONTENT_TYPE)], registry.render().encode('utf-8')
+    if path == "/memory" and MEMORY_TRACE:
+        return 200, [("Content-Type", "application/json")], json.dumps(memory_report()).encode('utf-8')
     return None
 
-async def main():
-    print("🔄 Iniciando servidor WebSocket...")
+def memory_report(top=15):
+    """Memória rastreada pelo tracemalloc e as linhas que mais alocam (pausa o loop)"""
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    stats = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ]).statistics("lineno")
+    return {
+        "traced_bytes": current,
+        "peak_bytes": peak,
+        "connections": admission.connections,
+        "clients": len(clients),
+        "top": [{"where": str(stat.traceback[0]), "bytes": stat.size, "count": stat.count}
+                for stat in stats[:top]],
+    }
+
+class ChatServerProtocol(websockets.legacy.server.WebSocketServerProtocol):
+    """Protocolo do servidor com controle de admissão antes do upgrade"""
+
+    async def process_request(self, path, request_headers):
+        response = await super().process_request(path, request_headers)
+        if response is not None:
+            return response
+        # Conta só para as conexões que viram WebSocket (health check e métricas passam direto)
+        self.client_ip = forwarded_ip(self.remote_address, request_headers, TRUST_PROXY)
+        reason = admission.check(self.client_ip)
+        if reason is None:
+            return None
+        admission.reject(reason)
+        log.warning("🚦 Conexão de %s recusada (limite: %s)", self.client_ip, reason)
+        status = 429 if reason == "per_ip" else 503
+        return status, [("Retry-After", str(ADMISSION_RETRY_AFTER))], b"Servidor cheio, tente mais tarde\n"
+
+def cancel_on_sigterm():
+    """SIGTERM (deploy/restart no Render) cancela a task principal: os finally e o atexit
+    rodam (socket do barramento removido, log de mensagens fechado) em vez de o processo morrer seco"""
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+async def main(worker_id=None):
+    global bus, WORKER_ID
+
+    cancel_on_sigterm()
+    if worker_id is not None:
+        WORKER_ID = worker_id
+        # Cada worker expõe as próprias métricas; o rótulo separa as séries
+        registry.labels["worker"] = str(worker_id)
+        bus = BusClient(BUS_SOCKET, worker_id, on_bus_message, Roster(USERS_PAGE_SIZE))
+        await bus.connect()
+        log.info("👷 Worker %d (pid %d) conectado ao barramento", worker_id, os.getpid())
+    elif MESSAGE_LOG:
+        message_log.open()
+        atexit.register(message_log.close)
+
+    log.info("🔄 Iniciando servidor WebSocket...")
     
     # Configurações para Render
     start_server = websockets.serve(
         handler,
         "0.0.0.0",
         PORT,
+        subprotocols=cryptog.engine_subprotocols(CIPHER_ENGINES),
         ping_interval=20,
         ping_timeout=20,
-        process_request=health_check
+        process_request=health_check,
+        create_protocol=ChatServerProtocol,
+        **connection_limits(CONNECTION_MEMORY_BUDGET),
+        reuse_port=bus is not None
     )
 
-    print(f"✅ Servidor iniciado na porta {PORT}")
-    print("🔗 URLs para conexão:")
-    print(f"   Local: ws://localhost:{PORT}")
-    print(f"   Render: wss://chat-online-vj6d.onrender.com")
-    print("📡 Aguardando conexões...")
+    log.info("✅ Servidor iniciado na porta %d", PORT)
+    log.info("🔗 URLs para conexão: ws://localhost:%d (local), wss://chat-online-vj6d.onrender.com (Render)", PORT)
+    log.info("📡 Aguardando conexões...")
 
+    lag_monitor.start()
+    crypto.start(lag_monitor)
     await start_server
+    asyncio.create_task(report_stats())
+    if not bus and SESSION_GRACE > 0:
+        asyncio.create_task(expire_sessions())
     
-    # Manter o servidor rodando
-    await asyncio.Future()
+    # Manter o servidor rodando (um worker encerra se perder o barramento)
+    if bus:
+        await bus.wait_closed()
+        log.error(ColorManager.error("💥 Worker %d perdeu o barramento, encerrando"), worker_id)
+    else:
+        await asyncio.Future()
+
+# ========== MODO MULTI-PROCESSO ==========
+def run_worker(worker_id):
+    # O fork herda o handler de SIGTERM do mestre, que acordaria o loop dele: volta ao padrão
+    # até o loop do worker instalar o próprio
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        asyncio.run(main(worker_id))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        # O processo filho sai sem rodar o atexit: esvazia a fila de log aqui
+        applog.stop()
+
+async def run_cluster():
+    """Processo mestre: roda o hub do barramento e mantém WORKERS processos vivos"""
+    def on_chat(msg):
+        # O hub vê todas as mensagens de sala: é o sequenciador global e o único escritor do log
+        if msg.get("room"):
+            msg["seq"], msg["ts"] = sequence_message(msg["room"], msg["sender"], msg["body"])
+
+    cancel_on_sigterm()
+    if MESSAGE_LOG:
+        message_log.open()
+        atexit.register(message_log.close)
+
+    hub = BusHub(BUS_SOCKET, on_chat, SESSION_GRACE)
+    await hub.start()
+    log.info("🧩 Barramento em %s, iniciando %d workers", BUS_SOCKET, WORKERS)
+
+    context = multiprocessing.get_context("fork")
+    workers = {}
+
+    def spawn(worker_id):
+        proc = context.Process(target=run_worker, args=(worker_id,), daemon=True)
+        proc.start()
+        workers[worker_id] = proc
+
+    for worker_id in range(WORKERS):
+        spawn(worker_id)
+
+    try:
+        while True:
+            await asyncio.sleep(1)
+            for worker_id, proc in list(workers.items()):
+                if not proc.is_alive():
+                    log.warning(ColorManager.warning("⚠️ Worker %d saiu (código %s), reiniciando"),
+                                worker_id, proc.exitcode)
+                    spawn(worker_id)
+    finally:
+        for proc in workers.values():
+            proc.terminate()
+        # Os workers saem antes do hub fechar, para não verem o barramento cair
+        for proc in workers.values():
+            await asyncio.to_thread(proc.join, 5)
+        await hub.close()
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
-    except KeyboardInterrupt:
-        print("\n🛑 Servidor interrompido")
+        if WORKERS > 1:
+            asyncio.run(run_cluster())
+        else:
+            asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        log.info("🛑 Servidor interrompido")
     except Exception as e:
-        print(f"💥 Erro fatal: {e}")
\ No newline at end of file
+        log.critical("💥 Erro fatal: %s", e)
@@ -0,0 +1,111 @@
+# sessions.py - Sessões retomáveis: token emitido no login, janela de graça após a queda
+#
+# Enquanto a sessão está "destacada" (conexão caiu sem /sair), o nome continua
+# reservado e as PMs para o usuário ficam pendentes. Um resume dentro da janela
+# devolve a sessão com um token novo; depois dela, a sessão expira.
+
+import secrets
+import time
+
+class Session:
+    def __init__(self, token, username):
+        self.token = token
+        self.username = username
+        self.expires = None   # None enquanto conectada; prazo (monotonic) quando destacada
+        self.pending = []     # PMs recebidas durante a queda
+
+    @property
+    def detached(self):
+        return self.expires is not None
+
+class SessionStore:
+    """Sessões por token e por nome (casefold)"""
+
+    def __init__(self, grace, max_pending=100):
+        self.grace = grace
+        self.max_pending = max_pending
+        self.by_token = {}
+        self.by_name = {}
+
+    def __len__(self):
+        return len(self.by_token)
+
+    def issue(self, username):
+        """Cria a sessão de um login novo e devolve o token"""
+        self.drop_user(username)
+        session = Session(secrets.token_urlsafe(18), username)
+        self.by_token[session.token] = session
+        self.by_name[username.casefold()] = session
+        return session.token
+
+    def detach(self, token):
+        """Inicia a janela de graça; None se a sessão não existe ou se o resume está desligado"""
+        session = self.by_token.get(token)
+        if session is None or self.grace <= 0:
+            return None
+        session.expires = time.monotonic() + self.grace
+        return session
+
+    def detach_user(self, username):
+        session = self.by_name.get(username.casefold())
+        return self.detach(session.token) if session else None
+
+    def resume(self, token):
+        """(sessão, PMs pendentes) com token novo, ou None se o token é inválido ou expirou.
+        Aceita também sessão ainda conectada: a conexão antiga pode não ter percebido a queda."""
+        session = self.by_token.get(token)
+        if session is None or (session.detached and session.expires <= time.monotonic()):
+            return None
+        del self.by_token[token]
+        session.token = secrets.token_urlsafe(18)
+        session.expires = None
+        self.by_token[session.token] = session
+        pending, session.pending = session.pending, []
+        return session, pending
+
+    def expire_token(self, token):
+        """Encerra na hora a sessão do token se a graça dela acabou, sem esperar a
+        varredura; devolve a sessão expirada (para liberar o nome) ou None"""
+        return self._expire_if_due(self.by_token.get(token))
+
+    def expire_user(self, username):
+        """Como expire_token, pela sessão do nome"""
+        return self._expire_if_due(self.by_name.get(username.casefold()))
+
+    def _expire_if_due(self, session):
+        if session is None or not session.detached or session.expires > time.monotonic():
+            return None
+        self.drop(session.token)
+        return session
+
+    def detached(self, username):
+        session = self.by_name.get(username.casefold())
+        return session if session and session.detached else None
+
+    def add_pending(self, username, item):
+        """Guarda uma PM para um usuário destacado; False se ele não está em graça"""
+        session = self.detached(username)
+        if session is None:
+            return False
+        if len(session.pending) < self.max_pending:
+            session.pending.append(item)
+        return True
+
+    def drop(self, token):
+        session = self.by_token.pop(token, None)
+        if session and self.by_name.get(session.username.casefold()) is session:
+            del self.by_name[session.username.casefold()]
+        return session
+
+    def drop_user(self, username):
+        session = self.by_name.get(username.casefold())
+        return self.drop(session.token) if session else None
+
+    def expire(self):
+        """Remove e devolve as sessões destacadas cujo prazo passou"""
+        agora = time.monotonic()
+        expired = [session for session in self.by_token.values()
+                   if session.detached and session.expires <= agora]
+        for session in expired:
+            self.drop(session.token)
+        return expired